@@ -96,12 +96,41 @@ export const uploadFile = async (file: File, projectId: number, isQuotation: boo
         'Content-Type': 'multipart/form-data',
       },
     })
+    // Processing runs in the background, wait for the ingestion job to finish
+    return await waitForIngestionJob(response.data.job_id)
+  } catch (error) {
+    throw error
+  }
+}
+
+export const getIngestionJob = async (jobId: number) => {
+  try {
+    const response = await api.get(`/api/jobs/${jobId}`)
     return response.data
   } catch (error) {
     throw error
   }
 }
 
+export const waitForIngestionJob = async (
+  jobId: number,
+  intervalMs: number = 1000,
+  timeoutMs: number = 15 * 60 * 1000
+) => {
+  const deadline = Date.now() + timeoutMs
+  while (Date.now() < deadline) {
+    const job = await getIngestionJob(jobId)
+    if (job.status === 'completed') {
+      return job
+    }
+    if (job.status === 'failed') {
+      throw new Error(job.error || 'File processing failed')
+    }
+    await new Promise((resolve) => setTimeout(resolve, intervalMs))
+  }
+  throw new Error(`File processing did not finish within ${Math.round(timeoutMs / 60000)} minutes (job ${jobId})`)
+}
+
 export const getProjects = async () => {
   try {
     const response = await api.get('/api/projects')
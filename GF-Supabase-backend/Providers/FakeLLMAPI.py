@@ -0,0 +1,68 @@
+import os
+import json
+import time
+import asyncio
+import httpx
+from logger import CustomLogger
+from Providers.registry import llm_registry
+
+logger = CustomLogger('fake_llm')
+
+
+class FakeLLMAPI:
+    """Offline provider answering with a canned Answer/Dashboard response
+
+    Requests go through a pooled httpx.Client like the real providers, but
+    an in-process transport answers them after LLM_FAKE_LATENCY_MS, so
+    tests and benchmarks can count client constructions and requests per
+    shared instance without any network access. Select it with
+    LLM_PROVIDER=fake.
+    """
+
+    def __init__(self, latency_ms=None):
+        self.latency = (latency_ms if latency_ms is not None
+                        else float(os.environ.get('LLM_FAKE_LATENCY_MS', 0))) / 1000.0
+        self.client = llm_registry.http_client('fake', transport=httpx.MockTransport(self._handle),
+                                               base_url='http://fake-llm.local')
+        self.async_client = llm_registry.async_http_client('fake', transport=httpx.MockTransport(self._ahandle),
+                                                           base_url='http://fake-llm.local')
+
+    @staticmethod
+    def _reply(request):
+        payload = json.loads(request.content)
+        return httpx.Response(200, json={
+            "Answer": f"Fake answer from {len(payload['relevant_data'])} characters of context",
+            "Dashboard": []
+        })
+
+    def _handle(self, request):
+        if self.latency:
+            time.sleep(self.latency)
+        return self._reply(request)
+
+    async def _ahandle(self, request):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self._reply(request)
+
+    def get_ai_response(self, prompt, relevant_data):
+        response = self.client.post('/chat', json={'prompt': prompt, 'relevant_data': relevant_data or ''})
+        response.raise_for_status()
+        return response.text
+
+    async def aget_ai_response(self, prompt, relevant_data):
+        response = await self.async_client.post('/chat', json={'prompt': prompt, 'relevant_data': relevant_data or ''})
+        response.raise_for_status()
+        return response.text
+
+    def stream_ai_response(self, prompt, relevant_data):
+        # Small fixed-size deltas, like a token stream
+        response_text = self.get_ai_response(prompt, relevant_data)
+        for start in range(0, len(response_text), 8):
+            yield response_text[start:start + 8]
+
+    def close(self):
+        self.client.close()
+
+    async def aclose(self):
+        await self.async_client.aclose()
@@ -1,38 +1,15 @@
 import os
 import json
 import logging
-from openai import AzureOpenAI
+from openai import AzureOpenAI, AsyncAzureOpenAI
 from logger import CustomLogger
 from error_handler import AppError
+from Providers.response_stream import parse_ai_response
+from Providers.registry import llm_registry
 
 logger = CustomLogger('openai_llm')
 
-class OPENAILLMAPI:
-    def __init__(self):
-        self.configure_api()
-        
-    def configure_api(self):
-        try:
-            self.client = AzureOpenAI(
-                api_key=os.environ.get('AZURE_API_KEY', "9ScmyYoI3Pnr1l96550vspRI58OoJe7b4VoVnIhUEdV9qB1ICkQCJQQJ99ALACYeBjFXJ3w3AAABACOGRRoa"),
-                api_version=os.environ.get('AZURE_API_VERSION', "2024-02-15-preview"),
-                azure_endpoint=os.environ.get('AZURE_ENDPOINT', "https://greencode-eastus.openai.azure.com")
-            )
-            if not self.client.api_key:
-                logger.error("Azure OpenAI API key not found")
-                raise AppError("Azure OpenAI API key not configured", status_code=500)
-        except Exception as e:
-            logger.error(f"Error configuring Azure OpenAI API: {str(e)}")
-            raise AppError(f"Error configuring Azure OpenAI API: {str(e)}", status_code=500)
-
-    def get_ai_response(self, prompt, relevant_data):
-        logger.info("Processing AI response", {
-            'prompt_length': len(prompt),
-            'data_length': len(relevant_data)
-        })
-        
-        try:
-            system_message = """You are an expert data analyst. Format your entire response as a JSON string. Your response must be exactly in this format:
+SYSTEM_MESSAGE = """You are an expert data analyst. Format your entire response as a JSON string. Your response must be exactly in this format:
 {
     "Answer": "Your detailed analysis here",
     "Dashboard": []
@@ -58,55 +35,125 @@ The Dashboard array should contain visualization objects when appropriate, each
 
 Important: Your entire response must be a valid JSON string. Do not include any text or explanation outside of the JSON structure."""
 
-            full_prompt = f"{relevant_data}\n\nQuestion: {prompt}"
-            
-            response = self.client.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {"role": "system", "content": system_message},
-                    {"role": "user", "content": full_prompt}
-                ],
-                temperature=0.2,
-                max_tokens=3000,  # Adjust if needed
-                n=1,
-                top_p=1
-            )
-            
-            # Get the response content and log it for debugging
-            response_text = response.choices[0].message.content.strip()
-            logger.info(f"Raw API Response: {response_text[:500]}...")  # Log first 500 chars
-            
-            # Try to parse the JSON response
-            try:
-                response_json = json.loads(response_text)
-                
-                # Validate response structure
-                if not isinstance(response_json, dict):
-                    logger.error("Response is not a dictionary")
-                    raise ValueError("Invalid response structure - not a dictionary")
-                    
-                if 'Answer' not in response_json or 'Dashboard' not in response_json:
-                    logger.error("Missing required keys in response")
-                    raise ValueError("Invalid response structure - missing required keys")
-                    
-                if not isinstance(response_json['Dashboard'], list):
-                    logger.error("Dashboard is not an array")
-                    raise ValueError("Invalid response structure - Dashboard is not an array")
-                
-                logger.info("AI response validated successfully")
-                return response_text
-                
-            except json.JSONDecodeError as e:
-                logger.error(f"JSON Decode Error: {str(e)}\nResponse text: {response_text}")
-                raise AppError(f"Invalid JSON response from AI: {str(e)}")
-            except ValueError as e:
-                logger.error(f"Validation Error: {str(e)}\nResponse text: {response_text}")
-                raise AppError(f"Invalid response structure from AI: {str(e)}")
+
+class OPENAILLMAPI:
+    """Azure OpenAI provider
+
+    Get the shared instance from Providers.registry.get_llm() rather than
+    constructing one per request; its pooled HTTP client is thread-safe.
+    The async methods must run on the registry's event loop
+    (llm_registry.run).
+    """
+
+    def __init__(self):
+        self.configure_api()
+        
+    def configure_api(self):
+        try:
+            settings = {
+                'api_key': os.environ.get('AZURE_API_KEY', "9ScmyYoI3Pnr1l96550vspRI58OoJe7b4VoVnIhUEdV9qB1ICkQCJQQJ99ALACYeBjFXJ3w3AAABACOGRRoa"),
+                'api_version': os.environ.get('AZURE_API_VERSION', "2024-02-15-preview"),
+                'azure_endpoint': os.environ.get('AZURE_ENDPOINT', "https://greencode-eastus.openai.azure.com")
+            }
+            self.client = AzureOpenAI(**settings, http_client=llm_registry.http_client('openai'))
+            self.async_client = AsyncAzureOpenAI(**settings, http_client=llm_registry.async_http_client('openai'))
+            if not self.client.api_key:
+                logger.error("Azure OpenAI API key not found")
+                raise AppError("Azure OpenAI API key not configured", status_code=500)
+        except Exception as e:
+            logger.error(f"Error configuring Azure OpenAI API: {str(e)}")
+            raise AppError(f"Error configuring Azure OpenAI API: {str(e)}", status_code=500)
+
+    def close(self):
+        self.client.close()
+
+    async def aclose(self):
+        await self.async_client.close()
+
+    @staticmethod
+    def _completion_args(prompt, relevant_data):
+        return dict(
+            model="gpt-4o",
+            messages=[
+                {"role": "system", "content": SYSTEM_MESSAGE},
+                {"role": "user", "content": f"{relevant_data}\n\nQuestion: {prompt}"}
+            ],
+            temperature=0.2,
+            max_tokens=3000,  # Adjust if needed
+            n=1,
+            top_p=1
+        )
+
+    @staticmethod
+    def _validated_text(response):
+        # Get the response content and log it for debugging
+        response_text = response.choices[0].message.content.strip()
+        logger.info(f"Raw API Response: {response_text[:500]}...")  # Log first 500 chars
+        
+        # Try to parse the JSON response
+        try:
+            parse_ai_response(response_text)
+            logger.info("AI response validated successfully")
+            return response_text
             
+        except json.JSONDecodeError as e:
+            logger.error(f"JSON Decode Error: {str(e)}\nResponse text: {response_text}")
+            raise AppError(f"Invalid JSON response from AI: {str(e)}")
+        except ValueError as e:
+            logger.error(f"Validation Error: {str(e)}\nResponse text: {response_text}")
+            raise AppError(f"Invalid response structure from AI: {str(e)}")
+
+    def get_ai_response(self, prompt, relevant_data):
+        logger.info("Processing AI response", {
+            'prompt_length': len(prompt),
+            'data_length': len(relevant_data)
+        })
+        
+        try:
+            response = self.client.chat.completions.create(**self._completion_args(prompt, relevant_data))
+            return self._validated_text(response)
         except Exception as e:
             logger.error(f"Error in Azure OpenAI API call: {str(e)}")
             raise AppError(f"Error processing AI response: {str(e)}")
 
+    async def aget_ai_response(self, prompt, relevant_data):
+        """Async get_ai_response, sharing the pooled connections of the registry's event loop"""
+        logger.info("Processing AI response (async)", {
+            'prompt_length': len(prompt),
+            'data_length': len(relevant_data)
+        })
+
+        try:
+            response = await self.async_client.chat.completions.create(**self._completion_args(prompt, relevant_data))
+            return self._validated_text(response)
+        except Exception as e:
+            logger.error(f"Error in Azure OpenAI API call: {str(e)}")
+            raise AppError(f"Error processing AI response: {str(e)}")
+
+    def stream_ai_response(self, prompt, relevant_data):
+        """Yield the response text deltas as the model generates them
+
+        Feed them to an AnswerStreamParser and call its finish() to validate
+        the complete response.
+        """
+        logger.info("Streaming AI response", {
+            'prompt_length': len(prompt),
+            'data_length': len(relevant_data)
+        })
+
+        try:
+            stream = self.client.chat.completions.create(
+                **self._completion_args(prompt, relevant_data),
+                stream=True
+            )
+            for chunk in stream:
+                # Azure sends a first chunk without choices carrying the content filter results
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        except Exception as e:
+            logger.error(f"Error in Azure OpenAI streaming call: {str(e)}")
+            raise AppError(f"Error processing AI response: {str(e)}")
+
     def process_query(self, relevant_data, query):
         logger.info("Processing query", {'query': query})
         try:
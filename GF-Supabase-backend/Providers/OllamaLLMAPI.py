@@ -3,37 +3,12 @@ import json
 import logging
 from logger import CustomLogger
 from error_handler import AppError
+from Providers.registry import llm_registry
 
 logger = CustomLogger('ollama_llm')
 
-class OllamaLLMAPI:
-    def __init__(self, model_name='llama3.1'):
-        """Initialize Ollama API with specified model."""
-        self.model_name = model_name
-        self._ensure_model_available()
-
-    def _ensure_model_available(self):
-        """Ensure the specified model is available locally."""
-        try:
-            ollama.show(self.model_name)
-        except Exception as e:
-            logger.warning(f"Model {self.model_name} not found, attempting to pull it")
-            try:
-                ollama.pull(self.model_name)
-            except Exception as pull_error:
-                logger.error(f"Failed to pull model: {str(pull_error)}")
-                raise AppError(f"Failed to initialize model {self.model_name}", status_code=500)
-
-    def get_ai_response(self, prompt, relevant_data):
-        """Get AI response using Ollama."""
-        logger.info("Processing AI response", {
-            'prompt_length': len(prompt),
-            'data_length': len(relevant_data)
-        })
-        
-        try:
-            # Create the system prompt with JSON schema
-            system_prompt = """You are an expert data analyst. You will be provided with some construction project management data on which you may be asked to analyze. 
+# Instructs the model to answer with the Answer/Dashboard JSON schema
+SYSTEM_PROMPT = """You are an expert data analyst. You will be provided with some construction project management data on which you may be asked to analyze. 
 
 Your response must strictly follow this JSON schema:
 {
@@ -135,19 +110,57 @@ When responding:
 - Do not make assumptions when forecasting - ask for clarification if needed
 """
 
-            messages = [
-                {
-                    "role": "system",
-                    "content": system_prompt
-                },
-                {
-                    "role": "user",
-                    "content": f"{relevant_data}\n\nQuestion: {prompt}\n\nAnswer:"
-                }
-            ]
+
+class OllamaLLMAPI:
+    def __init__(self, model_name='llama3.1', host=None):
+        """Initialize Ollama API with specified model.
+
+        ``host`` defaults to OLLAMA_HOST or the local server. Requests go
+        through one pooled keep-alive client shared by all threads; the
+        async client belongs to the registry's event loop.
+        """
+        self.model_name = model_name
+        self.client = ollama.Client(host=host, **llm_registry.http_client_options('ollama'))
+        self.async_client = ollama.AsyncClient(host=host, **llm_registry.async_http_client_options('ollama'))
+        self._ensure_model_available()
+
+    def _ensure_model_available(self):
+        """Ensure the specified model is available locally."""
+        try:
+            self.client.show(self.model_name)
+        except Exception as e:
+            logger.warning(f"Model {self.model_name} not found, attempting to pull it")
+            try:
+                self.client.pull(self.model_name)
+            except Exception as pull_error:
+                logger.error(f"Failed to pull model: {str(pull_error)}")
+                raise AppError(f"Failed to initialize model {self.model_name}", status_code=500)
+
+    @staticmethod
+    def _messages(prompt, relevant_data):
+        return [
+            {
+                "role": "system",
+                "content": SYSTEM_PROMPT
+            },
+            {
+                "role": "user",
+                "content": f"{relevant_data}\n\nQuestion: {prompt}\n\nAnswer:"
+            }
+        ]
+
+    def get_ai_response(self, prompt, relevant_data):
+        """Get AI response using Ollama."""
+        logger.info("Processing AI response", {
+            'prompt_length': len(prompt),
+            'data_length': len(relevant_data)
+        })
+        
+        try:
+            messages = self._messages(prompt, relevant_data)
 
             # Make the API call with format=json to ensure JSON output
-            response = ollama.chat(
+            response = self.client.chat(
                 model=self.model_name,
                 messages=messages,
                 format='json',
@@ -166,6 +179,60 @@ When responding:
             })
             raise AppError(f"Error processing AI response: {str(e)}")
 
+    async def aget_ai_response(self, prompt, relevant_data):
+        """Async get_ai_response, to be awaited on the registry's event loop."""
+        logger.info("Processing AI response (async)", {
+            'prompt_length': len(prompt),
+            'data_length': len(relevant_data)
+        })
+
+        try:
+            response = await self.async_client.chat(
+                model=self.model_name,
+                messages=self._messages(prompt, relevant_data),
+                format='json',
+                options={
+                    "temperature": 0.2,
+                    "num_ctx": 4096
+                }
+            )
+            logger.info("AI response received successfully")
+            return response['message']['content']
+
+        except Exception as e:
+            logger.error(f"Error in Ollama API call: {str(e)}", {
+                'error_type': type(e).__name__
+            })
+            raise AppError(f"Error processing AI response: {str(e)}")
+
+    def stream_ai_response(self, prompt, relevant_data):
+        """Yield the response text deltas as Ollama generates them."""
+        logger.info("Streaming AI response", {
+            'prompt_length': len(prompt),
+            'data_length': len(relevant_data)
+        })
+
+        try:
+            stream = self.client.chat(
+                model=self.model_name,
+                messages=self._messages(prompt, relevant_data),
+                format='json',
+                options={
+                    "temperature": 0.2,
+                    "num_ctx": 4096
+                },
+                stream=True
+            )
+            for chunk in stream:
+                content = chunk['message']['content']
+                if content:
+                    yield content
+        except Exception as e:
+            logger.error(f"Error in Ollama streaming call: {str(e)}", {
+                'error_type': type(e).__name__
+            })
+            raise AppError(f"Error processing AI response: {str(e)}")
+
     def process_query(self, relevant_data, query):
         """Process a query and return the response."""
         logger.info("Processing query", {'query': query})
@@ -201,4 +268,4 @@ if __name__ == "__main__":
         response = llm_api.process_query(test_data, test_query)
         print(json.dumps(json.loads(response), indent=2))
     except Exception as e:
-        print(f"Error occurred: {str(e)}") 
\ No newline at end of file
+        print(f"Error occurred: {str(e)}") 
\ No newline at end of file
@@ -1,3 +1,4 @@
 from .OPENAILLMAPI import OPENAILLMAPI
+from .registry import llm_registry, get_llm
 
-__all__ = ['OPENAILLMAPI']
\ No newline at end of file
+__all__ = ['OPENAILLMAPI', 'llm_registry', 'get_llm']
\ No newline at end of file
@@ -0,0 +1,219 @@
+"""Process-wide registry of LLM providers
+
+Every provider is built once per process and shared by all Flask worker
+threads. Its HTTP client keeps a bounded pool of keep-alive connections,
+so requests reuse open TLS connections instead of paying the handshake on
+every call.
+
+The async variants (aget_ai_response) run on one event loop owned by the
+registry, because httpx.AsyncClient connections are bound to the loop
+that opened them. Synchronous code submits coroutines with
+llm_registry.run().
+"""
+import os
+import time
+import asyncio
+import threading
+from collections import Counter
+import httpx
+from logger import CustomLogger
+from error_handler import AppError
+
+logger = CustomLogger('llm_registry')
+
+
+def pool_limits():
+    """Connection limits shared by every provider's HTTP client"""
+    return httpx.Limits(
+        max_connections=int(os.environ.get('LLM_MAX_CONNECTIONS', 20)),
+        max_keepalive_connections=int(os.environ.get('LLM_MAX_KEEPALIVE_CONNECTIONS', 10)),
+        keepalive_expiry=float(os.environ.get('LLM_KEEPALIVE_EXPIRY', 60))
+    )
+
+
+def pool_timeout():
+    return httpx.Timeout(float(os.environ.get('LLM_TIMEOUT', 120)), connect=10.0)
+
+
+class AsyncRateLimiter:
+    """Token bucket spacing out request starts to ``rate`` per second
+
+    ``burst`` requests may start back to back before the spacing applies.
+    A rate of 0 disables the limit. Use it from a single event loop.
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = None
+
+    async def acquire(self):
+        if not self.rate:
+            return
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class ProviderRegistry:
+    """Builds each named provider once and hands the same instance to every caller
+
+    Providers are registered as factories and constructed lazily on first
+    use. The instances must be safe to share between threads, which holds
+    for the OpenAI and Ollama clients since both wrap a single httpx.Client.
+    """
+
+    def __init__(self, default=None):
+        self.default = default or os.environ.get('LLM_PROVIDER', 'openai').lower()
+        self._factories = {}
+        self._instances = {}
+        self._lock = threading.Lock()
+        self._created = Counter()
+        self._requests = Counter()
+        self._limiters = {}
+        self._loop = None
+
+    def register(self, name, factory):
+        with self._lock:
+            self._factories[name] = factory
+
+    def get(self, name=None):
+        """Return the shared provider, building it on first use"""
+        name = (name or self.default).lower()
+        provider = self._instances.get(name)
+        if provider is not None:
+            return provider
+        with self._lock:
+            provider = self._instances.get(name)
+            if provider is None:
+                factory = self._factories.get(name)
+                if factory is None:
+                    raise AppError(f"Unknown LLM provider: {name}", status_code=500)
+                provider = self._instances[name] = factory()
+                self._created[name] += 1
+                logger.info(f"Created shared LLM provider {name}")
+        return provider
+
+    def http_client(self, name, **kwargs):
+        """Pooled keep-alive httpx.Client whose requests are counted under ``name``"""
+        return httpx.Client(limits=pool_limits(), timeout=pool_timeout(),
+                            event_hooks={'request': [lambda request: self._count_request(name)]},
+                            **kwargs)
+
+    def http_client_options(self, name):
+        """The same pool settings as keyword arguments, for SDKs that build their own httpx.Client"""
+        return {
+            'limits': pool_limits(),
+            'timeout': pool_timeout(),
+            'event_hooks': {'request': [lambda request: self._count_request(name)]}
+        }
+
+    def async_http_client(self, name, **kwargs):
+        """Pooled httpx.AsyncClient for the registry's event loop"""
+        return httpx.AsyncClient(limits=pool_limits(), timeout=pool_timeout(),
+                                 event_hooks={'request': [lambda request: self._acount_request(name)]},
+                                 **kwargs)
+
+    def async_http_client_options(self, name):
+        return {
+            'limits': pool_limits(),
+            'timeout': pool_timeout(),
+            'event_hooks': {'request': [lambda request: self._acount_request(name)]}
+        }
+
+    async def _acount_request(self, name):
+        self._count_request(name)
+
+    def rate_limiter(self, name):
+        """Shared request limiter of a provider
+
+        The rate is LLM_REQUESTS_PER_SECOND_<NAME>, falling back to
+        LLM_REQUESTS_PER_SECOND (default 0, unlimited), with bursts of
+        LLM_RATE_LIMIT_BURST requests.
+        """
+        with self._lock:
+            limiter = self._limiters.get(name)
+            if limiter is None:
+                rate = os.environ.get(f'LLM_REQUESTS_PER_SECOND_{name.upper()}',
+                                      os.environ.get('LLM_REQUESTS_PER_SECOND', 0))
+                limiter = self._limiters[name] = AsyncRateLimiter(
+                    float(rate), int(os.environ.get('LLM_RATE_LIMIT_BURST', 1)))
+            return limiter
+
+    def _event_loop(self):
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name='llm-event-loop', daemon=True).start()
+            return self._loop
+
+    def run(self, coroutine, timeout=None):
+        """Run a coroutine on the registry's event loop and wait for its result"""
+        return asyncio.run_coroutine_threadsafe(coroutine, self._event_loop()).result(timeout)
+
+    def _count_request(self, name):
+        with self._lock:
+            self._requests[name] += 1
+
+    def reset(self, name=None):
+        """Drop shared providers so the next get() builds them again, closing their clients"""
+        with self._lock:
+            names = [name] if name else list(self._instances)
+            providers = [self._instances.pop(n) for n in names if n in self._instances]
+        for provider in providers:
+            close = getattr(provider, 'close', None)
+            if close:
+                close()
+            aclose = getattr(provider, 'aclose', None)
+            if aclose and self._loop is not None:
+                self.run(aclose())
+
+    def stats(self):
+        with self._lock:
+            return {
+                'default': self.default,
+                'providers': {
+                    name: {
+                        'active': name in self._instances,
+                        'instances_created': self._created[name],
+                        'http_requests': self._requests[name]
+                    }
+                    for name in sorted(set(self._factories) | set(self._created))
+                }
+            }
+
+
+def _openai_provider():
+    from Providers.OPENAILLMAPI import OPENAILLMAPI
+    return OPENAILLMAPI()
+
+
+def _ollama_provider():
+    from Providers.OllamaLLMAPI import OllamaLLMAPI
+    return OllamaLLMAPI(os.environ.get('OLLAMA_MODEL', 'llama3.1'), os.environ.get('OLLAMA_HOST'))
+
+
+def _fake_provider():
+    from Providers.FakeLLMAPI import FakeLLMAPI
+    return FakeLLMAPI()
+
+
+llm_registry = ProviderRegistry()
+llm_registry.register('openai', _openai_provider)
+llm_registry.register('ollama', _ollama_provider)
+llm_registry.register('fake', _fake_provider)
+
+
+def get_llm(name=None):
+    """Shared provider selected by ``name`` or LLM_PROVIDER (default "openai")"""
+    return llm_registry.get(name)
@@ -0,0 +1,159 @@
+import json
+from logger import CustomLogger
+
+logger = CustomLogger('response_stream')
+
+
+def parse_ai_response(response_text):
+    """Parse and validate an {"Answer": ..., "Dashboard": [...]} response
+
+    Raises json.JSONDecodeError for invalid JSON and ValueError for a wrong structure.
+    """
+    response_json = json.loads(response_text)
+
+    if not isinstance(response_json, dict):
+        logger.error("Response is not a dictionary")
+        raise ValueError("Invalid response structure - not a dictionary")
+
+    if 'Answer' not in response_json or 'Dashboard' not in response_json:
+        logger.error("Missing required keys in response")
+        raise ValueError("Invalid response structure - missing required keys")
+
+    if not isinstance(response_json['Dashboard'], list):
+        logger.error("Dashboard is not an array")
+        raise ValueError("Invalid response structure - Dashboard is not an array")
+
+    return response_json
+
+
+class AnswerStreamParser:
+    """Incremental parser for a streamed {"Answer": ..., "Dashboard": [...]} response
+
+    feed() takes the text deltas as they arrive from the provider and returns
+    the events they complete: ("answer", text) for every newly decoded piece
+    of the Answer string and ("chart", object) for every Dashboard entry
+    whose closing brace has been received. finish() validates the whole
+    response and returns its text.
+    """
+
+    _ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+
+    def __init__(self):
+        self._chunks = []
+        self._stack = []  # Open '{' and '[' outside of strings
+        self._in_string = False
+        self._escape = None  # Pending escape sequence inside a string
+        self._after_colon = False  # Inside a top-level value rather than a key
+        self._key = None  # Current top-level key
+        self._key_chars = None  # Characters of a top-level key being read
+        self._in_answer = False
+        self._dashboard_depth = None  # Stack depth inside the Dashboard array
+        self._chart_chars = None  # Raw text of the Dashboard entry being read
+
+    def feed(self, delta):
+        self._chunks.append(delta)
+        events = []
+        answer = []
+        for char in delta:
+            if self._chart_chars is not None:
+                self._chart_chars.append(char)
+            if self._in_string:
+                self._string_char(char, answer)
+                continue
+
+            if char == '"':
+                self._in_string = True
+                if len(self._stack) == 1:
+                    if not self._after_colon:
+                        self._key_chars = []
+                    elif self._key == 'Answer':
+                        self._in_answer = True
+            elif char in '{[':
+                if (char == '{' and self._dashboard_depth is not None
+                        and len(self._stack) == self._dashboard_depth):
+                    self._chart_chars = [char]
+                elif char == '[' and len(self._stack) == 1 and self._after_colon and self._key == 'Dashboard':
+                    self._dashboard_depth = 2
+                self._stack.append(char)
+            elif char in '}]':
+                if self._stack:
+                    self._stack.pop()
+                if self._chart_chars is not None and len(self._stack) == self._dashboard_depth:
+                    events.extend(self._flush_answer(answer))
+                    chart = self._parse_chart()
+                    if chart is not None:
+                        events.append(("chart", chart))
+                elif self._dashboard_depth is not None and len(self._stack) < self._dashboard_depth:
+                    self._dashboard_depth = None
+            elif len(self._stack) == 1:
+                if char == ':':
+                    self._after_colon = True
+                elif char == ',':
+                    self._after_colon = False
+                    self._key = None
+
+        events.extend(self._flush_answer(answer))
+        return events
+
+    def _string_char(self, char, answer):
+        if self._escape is not None:
+            self._escape += char
+            if self._escape[1] == 'u' and len(self._escape) < 6:
+                return
+            if self._escape[1] == 'u':
+                try:
+                    decoded = chr(int(self._escape[2:], 16))
+                except ValueError:
+                    decoded = ''
+            else:
+                decoded = self._ESCAPES.get(self._escape[1], self._escape[1])
+            self._escape = None
+            self._string_text(decoded, answer)
+        elif char == '\\':
+            self._escape = char
+        elif char == '"':
+            self._in_string = False
+            if self._key_chars is not None:
+                self._key = ''.join(self._key_chars)
+                self._key_chars = None
+            self._in_answer = False
+        else:
+            self._string_text(char, answer)
+
+    def _string_text(self, text, answer):
+        if self._key_chars is not None:
+            self._key_chars.append(text)
+        elif self._in_answer:
+            answer.append(text)
+
+    @staticmethod
+    def _flush_answer(answer):
+        if not answer:
+            return []
+        text = ''.join(answer)
+        answer.clear()
+        return [("answer", text)]
+
+    def _parse_chart(self):
+        raw = ''.join(self._chart_chars)
+        self._chart_chars = None
+        try:
+            chart = json.loads(raw)
+        except json.JSONDecodeError:
+            logger.warning(f"Skipping unparseable dashboard entry: {raw[:200]}")
+            return None
+        return chart
+
+    @property
+    def text(self):
+        return ''.join(self._chunks).strip()
+
+    def finish(self):
+        """Validate the complete response and return its text"""
+        text = self.text
+        # Tolerate a Markdown code fence around the JSON object
+        start, end = text.find('{'), text.rfind('}')
+        if start > 0 or (end != -1 and end < len(text) - 1):
+            text = text[start:end + 1]
+        parse_ai_response(text)
+        return text
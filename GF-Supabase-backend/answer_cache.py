@@ -0,0 +1,128 @@
+import os
+import re
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+from logger import CustomLogger
+
+logger = CustomLogger('answer_cache')
+
+
+def normalize_query(query):
+    """Lower-case, collapse whitespace and drop trailing punctuation"""
+    return re.sub(r'\s+', ' ', query.strip().lower()).rstrip(' ?!.')
+
+
+def chunk_fingerprint(chunk_ids):
+    """Order-independent fingerprint of the retrieved chunk IDs"""
+    return hashlib.sha256(','.join(str(i) for i in sorted(chunk_ids)).encode('utf-8')).hexdigest()
+
+
+class AnswerCache:
+    """In-memory LRU cache of LLM answers for chat and predict
+
+    Entries are keyed by (kind, project_id, normalized query, fingerprint of
+    the retrieved chunk IDs), so an answer is only reused when the same
+    question retrieves exactly the same context. With semantic lookup
+    enabled, a query whose embedding is at least ``similarity_threshold``
+    cosine-similar to a cached query with the same context also hits.
+    Ingesting or deleting a project's data drops all its entries.
+    """
+
+    def __init__(self, max_entries=None, ttl=None, semantic=None, similarity_threshold=None):
+        self.max_entries = max_entries or int(os.environ.get('ANSWER_CACHE_MAX_ENTRIES', 1000))
+        self.ttl = ttl if ttl is not None else float(os.environ.get('ANSWER_CACHE_TTL', 3600))
+        self.semantic = semantic if semantic is not None else \
+            os.environ.get('ANSWER_CACHE_SEMANTIC', 'false').lower() == 'true'
+        self.similarity_threshold = similarity_threshold or float(os.environ.get('ANSWER_CACHE_SIMILARITY', 0.97))
+        self._entries = OrderedDict()  # key -> (expires_at, response, normalized query embedding)
+        self._contexts = {}  # (kind, project_id, fingerprint) -> keys sharing that context
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'semantic_hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0, 'invalidations': 0}
+
+    @staticmethod
+    def _unit(embedding):
+        if embedding is None:
+            return None
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else None
+
+    def _remove(self, key):
+        self._entries.pop(key, None)
+        context = (key[0], key[1], key[3])
+        keys = self._contexts.get(context)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._contexts[context]
+
+    def lookup(self, kind, project_id, query, chunk_ids, query_embedding=None):
+        """Return the cached response for this question and context, or None"""
+        fingerprint = chunk_fingerprint(chunk_ids)
+        key = (kind, int(project_id), normalize_query(query), fingerprint)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > now:
+                self._entries.move_to_end(key)
+                self._stats['hits'] += 1
+                return entry[1]
+            if entry:
+                self._remove(key)
+
+            query_vector = self._unit(query_embedding) if self.semantic else None
+            if query_vector is not None:
+                best_key, best_score = None, self.similarity_threshold
+                for other in self._contexts.get((kind, int(project_id), fingerprint), ()):
+                    expires_at, _, vector = self._entries[other]
+                    if expires_at > now and vector is not None:
+                        score = float(vector @ query_vector)
+                        if score >= best_score:
+                            best_key, best_score = other, score
+                if best_key is not None:
+                    self._entries.move_to_end(best_key)
+                    self._stats['semantic_hits'] += 1
+                    return self._entries[best_key][1]
+
+            self._stats['misses'] += 1
+            return None
+
+    def store(self, kind, project_id, query, chunk_ids, response, query_embedding=None):
+        fingerprint = chunk_fingerprint(chunk_ids)
+        key = (kind, int(project_id), normalize_query(query), fingerprint)
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (time.monotonic() + self.ttl, response, self._unit(query_embedding))
+            self._contexts.setdefault((kind, int(project_id), fingerprint), set()).add(key)
+            self._stats['stores'] += 1
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self._stats['evictions'] += 1
+
+    def invalidate_project(self, project_id):
+        """Drop every cached answer of a project, e.g. after new data was ingested"""
+        with self._lock:
+            keys = [key for key in self._entries if key[1] == int(project_id)]
+            for key in keys:
+                self._remove(key)
+            self._stats['invalidations'] += 1
+        if keys:
+            logger.info(f"Invalidated {len(keys)} cached answers for project {project_id}")
+
+    def stats(self):
+        with self._lock:
+            lookups = self._stats['hits'] + self._stats['semantic_hits'] + self._stats['misses']
+            hits = self._stats['hits'] + self._stats['semantic_hits']
+            return dict(
+                self._stats,
+                entries=len(self._entries),
+                capacity=self.max_entries,
+                semantic_enabled=self.semantic,
+                hit_rate=hits / lookups if lookups else 0.0
+            )
+
+
+answer_cache = AnswerCache()
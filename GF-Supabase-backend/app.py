@@ -1,4 +1,4 @@
-from flask import Flask, request, jsonify, send_file, make_response
+from flask import Flask, request, jsonify, send_file, make_response, Response, stream_with_context
 from werkzeug.utils import secure_filename
 from flask_login import LoginManager, UserMixin
 from tinydb import Query
@@ -6,19 +6,17 @@ from flask_cors import CORS
 import os
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity, get_jwt
-from Providers.OPENAILLMAPI import OPENAILLMAPI
+from Providers.registry import get_llm, llm_registry
+from Providers.response_stream import AnswerStreamParser
 import datetime
 from database import db
 import pandas as pd
-import openpyxl
 import logging
-import numpy as np
 from future import standard_library
 
 import logger
 standard_library.install_aliases()
 from builtins import str
-import io
 from functools import wraps
 from flask_jwt_extended import verify_jwt_in_request
 from flask_cors import cross_origin
@@ -26,12 +24,25 @@ from supabase_manager import supabase_manager
 import json
 from Providers.OllamaLLMAPI import OllamaLLMAPI
 from chart_tracking_agent import ChartTrackingAgent
+from chart_engine import chart_engine, compile_data_spec
+from chart_refresh import ChartRefreshScheduler, chart_dependencies, schema_changes
+from excel_reader import (iter_sheet_rows, iter_row_blocks, serialize_rows, is_chunk_boundary,
+                          ColumnFingerprints, csv_fingerprints)
+from ingestion_jobs import IngestionQueue
+from project_access import ProjectAccessResolver
+from answer_cache import answer_cache
+from project_context import project_context
+from context_assembler import assemble_context
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 app = Flask(__name__)
 CORS(app, supports_credentials=True)
 app.config['SECRET_KEY'] = os.environ.get('FLASK_SECRET_KEY','abc123')
 app.config['UPLOAD_FOLDER'] = 'uploads'
+# Debug mode (and with it the reloader) when started with `python app.py`
+RUN_DEBUG = os.environ.get('FLASK_DEBUG', 'true').lower() == 'true'
+# Let a fronting web server (nginx/Apache) send downloaded files via X-Sendfile
+app.config['USE_X_SENDFILE'] = os.environ.get('USE_X_SENDFILE', 'false').lower() == 'true'
 app.config['JWT_SECRET_KEY'] = os.environ.get('JWT_SECRET_KEY','abc123')
 app.config['JWT_ACCESS_TOKEN_EXPIRES'] = datetime.timedelta(minutes=30)
 app.config['JWT_BLACKLIST_ENABLED'] = True
@@ -46,7 +57,8 @@ CORS(app, resources={
     r"/api/*": {
         "origins": ["http://localhost:3000", "http://localhost:5173"],  # Add your frontend URL
         "methods": ["GET", "POST", "PATCH", "DELETE", "OPTIONS"],
-        "allow_headers": ["Content-Type", "Authorization"],
+        "allow_headers": ["Content-Type", "Authorization", "Range", "If-Range", "If-None-Match", "If-Modified-Since"],
+        "expose_headers": ["Content-Disposition", "Content-Range", "Accept-Ranges", "ETag", "Content-Length"],
         "supports_credentials": True
     }
 })
@@ -224,10 +236,9 @@ def add_project():
     data = request.json
     
     # Check if project name already exists for this company
-    Project = Query()
-    existing_project = db.projects_db.get(
-        (Project.name == data['name'].strip()) & 
-        (Project.company_id == current_company_id)
+    existing_project = db.projects_db.find_one(
+        name=data['name'].strip(),
+        company_id=current_company_id
     )
     
     if existing_project:
@@ -279,60 +290,68 @@ def add_project():
         return jsonify({"error": f"Failed to create project structure: {str(e)}"}), 500
 
 
-def process_excel_to_text(file_path, is_quotation=False, project_name=""):
-    workbook = openpyxl.load_workbook(file_path, data_only=True)
+def process_excel_to_text(file_path, is_quotation=False, project_name="", schema=None):
+    """Chunk a workbook into text, filling ``schema`` (if given) with {sheet: {column: fingerprint}}
+
+    Every sheet starts a new chunk, and within a sheet a chunk ends after a
+    row picked by is_chunk_boundary (once it holds min_chars) or before one
+    that would take it past max_chars. Boundaries therefore follow the rows'
+    content rather than their offsets, and an inserted or edited row only
+    changes the chunk it falls in, so re-uploads re-embed just that chunk.
+    """
     chunks = []
-    current_chunk = []
-    current_length = 0
     max_chars = 8000  # Conservative estimate for ~8k tokens
+    min_chars = max_chars // 2
+    boundary_chars = max_chars // 4  # mean length between content-defined boundaries
     
     # Add header based on file type
     header = f"{'Quotation' if is_quotation else 'Actual'} File for Project: {project_name}"
-    current_chunk.append(header)
+    current_chunk = [header]
+    current_length = len(header)
     
-    # Process each sheet
-    for sheet_name in workbook.sheetnames:
-        df = pd.read_excel(file_path, sheet_name=sheet_name)
-        if not df.empty:
-            sheet_header = f"\nSheet: {sheet_name}"
-            columns_text = f"Columns: {', '.join(df.columns.tolist())}"
-            
-            # Start new chunk with headers
-            if current_length > 0:
-                chunks.append("\n".join(current_chunk))
-                current_chunk = [header, sheet_header, columns_text]
-                current_length = len(header) + len(sheet_header) + len(columns_text)
-            else:
-                current_chunk.extend([sheet_header, columns_text])
-                current_length += len(sheet_header) + len(columns_text)
-            
-            # Process each row
-            for idx, row in df.iterrows():
-                row_text = []
-                for col in df.columns:
-                    value = row[col]
-                    if pd.notna(value):
-                        if isinstance(value, pd.Timestamp):
-                            formatted_value = value.strftime('%Y-%m-%d %H:%M:%S')
-                        elif isinstance(value, (np.integer, np.floating)):
-                            formatted_value = f"{value:g}"
-                        else:
-                            formatted_value = str(value)
-                        row_text.append(f"{col}: {formatted_value}")
-                
-                row_string = " | ".join(row_text)
-                
+    # Stream each sheet once, straight from the workbook
+    for sheet_name, columns, kinds, rows in iter_sheet_rows(file_path):
+        sheet_header = f"\nSheet: {sheet_name}"
+        columns_text = f"Columns: {', '.join(columns)}"
+        
+        # Start new chunk with headers
+        if current_chunk is not None and len(current_chunk) > 1:
+            chunks.append("\n".join(current_chunk))
+            current_chunk = None
+        if current_chunk is None:
+            current_chunk = [header]
+            current_length = len(header)
+        current_chunk.extend([sheet_header, columns_text])
+        current_length += len(sheet_header) + len(columns_text)
+        rows_in_chunk = 0
+        
+        fingerprints = ColumnFingerprints(columns)
+        
+        # Serialize rows column-wise, one bounded block at a time
+        for block in iter_row_blocks(rows):
+            fingerprints.update(block)
+            for row_string in serialize_rows(columns, kinds, block):
                 # If adding this row would exceed the limit, start a new chunk
-                if current_length + len(row_string) > max_chars:
+                if current_chunk is not None and rows_in_chunk and current_length + len(row_string) > max_chars:
                     chunks.append("\n".join(current_chunk))
-                    current_chunk = [header, sheet_header, row_string]
-                    current_length = len(header) + len(sheet_header) + len(row_string)
-                else:
-                    current_chunk.append(row_string)
-                    current_length += len(row_string)
+                    current_chunk = None
+                if current_chunk is None:
+                    current_chunk = [header, sheet_header]
+                    current_length = len(header) + len(sheet_header)
+                    rows_in_chunk = 0
+                current_chunk.append(row_string)
+                current_length += len(row_string)
+                rows_in_chunk += 1
+                
+                if current_length >= min_chars and is_chunk_boundary(row_string, boundary_chars):
+                    chunks.append("\n".join(current_chunk))
+                    current_chunk = None
+        
+        if schema is not None:
+            schema[sheet_name] = fingerprints.digest()
     
     # Add the last chunk if it exists
-    if current_chunk:
+    if current_chunk is not None:
         chunks.append("\n".join(current_chunk))
     
     return chunks
@@ -340,6 +359,132 @@ def process_excel_to_text(file_path, is_quotation=False, project_name=""):
 # Initialize the chart tracking agent
 chart_tracking_agent = ChartTrackingAgent()
 
+# Refreshes only the charts touched by recent uploads, once per burst of uploads
+chart_refresh_scheduler = ChartRefreshScheduler(chart_tracking_agent.update_project_charts)
+
+def run_ingestion_job(job, context):
+    """Parse, embed and store an uploaded file, then refresh the project's charts"""
+    params = job['params']
+    project_id = job['project_id']
+    file_path = params['file_path']
+    filename = params['file_name']
+    is_quotation = params['is_quotation']
+    is_update = params['is_update']
+
+    with context.stage('parse'):
+        schema = {}
+        if params['file_type'] == 'excel':
+            text_chunks = process_excel_to_text(
+                file_path,
+                is_quotation=is_quotation,
+                project_name=params['project_name'],
+                schema=schema
+            )
+            metadatas = [
+                {
+                    "file_name": filename,
+                    "file_type": "excel",
+                    "is_quotation": is_quotation,
+                    "file_path": file_path,
+                    "chunk_index": i,
+                    "total_chunks": len(text_chunks)
+                }
+                for i in range(len(text_chunks))
+            ]
+        else:
+            with open(file_path, 'r') as f:
+                text_chunks = [f.read()]
+            schema = csv_fingerprints(file_path)
+            metadatas = [{
+                "file_name": filename,
+                "file_type": "text",
+                "is_quotation": is_quotation,
+                "file_path": file_path
+            }]
+
+        for chunk, metadata in zip(text_chunks, metadatas):
+            metadata["content_hash"] = supabase_manager.content_hash(chunk)
+
+        # On an update (or a resumed job that may have stored part of its rows)
+        # only chunks whose hash is not stored yet need embedding, only rows
+        # whose content is gone need deleting and kept rows only get their
+        # metadata (chunk_index, total_chunks) brought up to date
+        if is_update or context.resumed:
+            new_indices, stale_ids, kept = supabase_manager.diff_file_documents(
+                project_id, file_path, [metadata["content_hash"] for metadata in metadatas]
+            )
+        else:
+            new_indices, stale_ids, kept = list(range(len(text_chunks))), [], {}
+        moved_metadata = {
+            row['id']: metadatas[index]
+            for index, row in kept.items()
+            if row.get('metadata') != metadatas[index]
+        }
+        new_chunks = [text_chunks[i] for i in new_indices]
+        new_metadatas = [metadatas[i] for i in new_indices]
+
+    with context.stage('embed'):
+        # Encode in large slices so progress can be reported between batched encode calls
+        embeddings = []
+        step = supabase_manager.embedding_batch_size * 16
+        for start in range(0, len(new_chunks), step):
+            embeddings.extend(supabase_manager.get_embeddings(new_chunks[start:start + step]))
+            context.progress('embed', len(embeddings) / len(new_chunks))
+
+    with context.stage('store'):
+        if stale_ids:
+            supabase_manager.delete_documents(stale_ids)
+            logging.info(f"Deleted {len(stale_ids)} stale chunks of {filename} from Supabase")
+        if moved_metadata:
+            supabase_manager.update_document_metadata(moved_metadata)
+
+        inserted = supabase_manager.insert_documents(
+            project_id, new_chunks, embeddings, new_metadatas,
+            progress=lambda done, total: context.progress('store', done / total)
+        )
+
+        # Save file metadata
+        file_info = {
+            "name": filename,
+            "relative_path": params['relative_path'],
+            "addedBy": "System",
+            "dateAdded": datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            "isUpdate": is_update
+        }
+        db.save_file_metadata(project_id, file_info)
+
+        # Answers and context computed from the previous data are no longer valid
+        answer_cache.invalidate_project(project_id)
+        project_context.invalidate(project_id)
+
+    # Now that Supabase is updated, schedule a refresh of the charts reading the changed columns
+    with context.stage('charts'):
+        try:
+            changes = schema_changes(db.save_file_schema(project_id, filename, schema), schema)
+            logging.info(f"Columns changed by {filename}: {changes}")
+            chart_refresh_scheduler.schedule(project_id, filename, changes)
+        except Exception as chart_error:
+            logging.error(f"Error scheduling chart updates: {str(chart_error)}")
+
+    return {
+        "chunks": len(text_chunks),
+        "inserted": inserted,
+        "unchanged": len(text_chunks) - inserted,
+        "deleted": len(stale_ids)
+    }
+
+ingestion_queue = IngestionQueue(run_ingestion_job)
+
+# Pick interrupted jobs up again once per serving process: on import under a WSGI
+# server, in the reloader's child when run directly (its parent only watches files).
+# Only jobs whose lease expired are claimed, so every server process can do this.
+if (os.environ.get('INGESTION_RESUME_ON_START', 'true').lower() == 'true'
+        and (__name__ != '__main__' or not RUN_DEBUG or os.environ.get('WERKZEUG_RUN_MAIN') == 'true')):
+    try:
+        ingestion_queue.resume_pending()
+    except Exception as resume_error:
+        logging.error(f"Error resuming ingestion jobs: {str(resume_error)}")
+
 @app.route('/api/upload', methods=['POST'])
 @jwt_required()
 def api_upload():
@@ -364,28 +509,15 @@ def api_upload():
             logging.warning("No project specified")
             return jsonify({"error": "No project specified"}), 400
         
-        project = db.get_project(int(project_id))
-        if not project:
-            logging.warning(f"Project not found: {project_id}")
-            return jsonify({"error": "Project not found"}), 404
-        
         # Check if the current user has access to the project
-        if current_identity.startswith('user_'):
-            current_user_id = int(current_identity.split('_')[1])
-            if current_user_id not in project.get('assigned_users', []):
-                return jsonify({"error": "Unauthorized access to project"}), 403
-        elif current_identity.startswith('company_'):
-            current_company_id = int(current_identity.split('_')[1])
-            if project['company_id'] != current_company_id:
-                return jsonify({"error": "Unauthorized access to project"}), 403
-        else:
-            return jsonify({"error": "Invalid token"}), 401
+        project, error = authorize_project(int(project_id))
+        if error:
+            return error
         
         project_path = project['path']
         
         # Check if this file already exists
-        existing_files = db.get_project_files(int(project_id))
-        existing_file = next((f for f in existing_files if f['name'] == filename), None)
+        existing_file = db.find_project_file_by_name(int(project_id), filename)
         
         # Determine the save path
         if is_quotation:
@@ -398,13 +530,12 @@ def api_upload():
             rel_path = date_folder
             path = os.path.join(project_path, date_folder)
             
-            # If this is an update, use the existing file's path
+            # If this is an update, overwrite the existing file in place so its
+            # stored chunks can be diffed against the new content
             if is_update and existing_file:
                 rel_path = existing_file['relative_path']
                 path = os.path.join(project_path, rel_path)
-                # Delete the old file
-                if os.path.exists(existing_file['path']):
-                    os.remove(existing_file['path'])
+                filename = os.path.basename(existing_file['path'])
             else:
                 filename = f"{time_str}_{filename}"
         
@@ -412,97 +543,25 @@ def api_upload():
         file_path = os.path.join(path, filename)
         
         try:
-            # First save the file locally
+            # Save the file locally, the rest of the processing runs in the background
             file.save(file_path)
+            db.add_project_file(int(project_id), file_path)
             logging.info(f"File saved to: {file_path}")
             
-            # Process and add to Supabase
-            if file.filename.endswith(('.xlsx', '.xls')):
-                text_chunks = process_excel_to_text(
-                    file_path,
-                    is_quotation=is_quotation,
-                    project_name=project['name']
-                )
-                
-                # Clear any existing documents for this file if it's an update
-                if is_update:
-                    try:
-                        supabase_manager.delete_file(int(project_id), file_path)
-                        logging.info(f"Deleted existing file data from Supabase for update")
-                    except Exception as e:
-                        logging.error(f"Error deleting existing file data: {str(e)}")
-                
-                # Add new chunks to Supabase
-                for i, chunk in enumerate(text_chunks):
-                    metadata = {
-                        "file_name": filename,
-                        "file_type": "excel",
-                        "is_quotation": is_quotation,
-                        "file_path": file_path,
-                        "chunk_index": i,
-                        "total_chunks": len(text_chunks)
-                    }
-                    supabase_manager.add_document(int(project_id), chunk, metadata)
-                
-                # Save file metadata
-                file_info = {
-                    "name": filename,
-                    "relative_path": rel_path,
-                    "addedBy": "System",
-                    "dateAdded": datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                    "isUpdate": is_update
-                }
-                db.save_file_metadata(int(project_id), file_info)
-                
-                # Now that Supabase is updated, trigger chart updates
-                try:
-                    logging.info(f"Initiating chart updates for project {project_id}")
-                    chart_tracking_agent.update_project_charts(int(project_id))
-                    logging.info("Charts updated successfully")
-                except Exception as chart_error:
-                    logging.error(f"Error updating charts: {str(chart_error)}")
-                
-                return jsonify({"message": "File uploaded and processed successfully"}), 200
-                
-            else:
-                with open(file_path, 'r') as f:
-                    file_content = f.read()
-                
-                # Clear any existing documents for this file if it's an update
-                if is_update:
-                    try:
-                        supabase_manager.delete_file(int(project_id), file_path)
-                        logging.info(f"Deleted existing file data from Supabase for update")
-                    except Exception as e:
-                        logging.error(f"Error deleting existing file data: {str(e)}")
-                
-                metadata = {
-                    "file_name": filename,
-                    "file_type": "text",
-                    "is_quotation": is_quotation,
-                    "file_path": file_path
-                }
-                supabase_manager.add_document(int(project_id), file_content, metadata)
-                
-                # Save file metadata
-                file_info = {
-                    "name": filename,
-                    "relative_path": rel_path,
-                    "addedBy": "System",
-                    "dateAdded": datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                    "isUpdate": is_update
-                }
-                db.save_file_metadata(int(project_id), file_info)
-                
-                # Now that Supabase is updated, trigger chart updates
-                try:
-                    logging.info(f"Initiating chart updates for project {project_id}")
-                    chart_tracking_agent.update_project_charts(int(project_id))
-                    logging.info("Charts updated successfully")
-                except Exception as chart_error:
-                    logging.error(f"Error updating charts: {str(chart_error)}")
-                
-                return jsonify({"message": "File uploaded and processed successfully"}), 200
+            job_id = ingestion_queue.submit(int(project_id), {
+                "file_path": file_path,
+                "file_name": filename,
+                "file_type": "excel" if file.filename.endswith(('.xlsx', '.xls')) else "text",
+                "relative_path": rel_path,
+                "is_quotation": is_quotation,
+                "is_update": is_update,
+                "project_name": project['name']
+            }, created_by=current_identity)
+            
+            return jsonify({
+                "message": "File uploaded, processing started",
+                "job_id": job_id
+            }), 202
                 
         except Exception as e:
             logging.error(f"Error processing file: {str(e)}")
@@ -511,10 +570,60 @@ def api_upload():
     logging.warning(f"File type not allowed: {file.filename}")
     return jsonify({"error": "File type not allowed"}), 400
 
+@app.route('/api/jobs/<int:job_id>', methods=['GET'])
+@jwt_required()
+def get_job_status(job_id):
+    job = db.get_job(job_id)
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+    
+    # Check authorization
+    project, error = authorize_project(job['project_id'])
+    if error:
+        return error
+    
+    return jsonify({
+        "id": job['id'],
+        "project_id": job['project_id'],
+        "file_name": job['params'].get('file_name'),
+        "status": job['status'],
+        "stages": job['stages'],
+        "result": job.get('result'),
+        "error": job.get('error'),
+        "attempts": job.get('attempts', 0),
+        "created_at": job['created_at'],
+        "updated_at": job['updated_at']
+    }), 200
+
+def answer_cache_context(project_id, query, results):
+    """Chunk IDs and (for semantic lookups) query embedding identifying an answer in the cache"""
+    chunk_ids = [result['id'] for result in results]
+    # The query embedding is served from the project's embedding cache filled by the search
+    query_embedding = supabase_manager.get_embedding(query, project_id=project_id) if answer_cache.semantic else None
+    return chunk_ids, query_embedding
+
+def relevant_context(results):
+    """Retrieved chunks packed into the LLM_CONTEXT_TOKENS budget, without repeated headers or rows"""
+    relevant_info, tokens, used = assemble_context(results)
+    logging.info(f"Assembled {tokens} context tokens from {len(used)} of {len(results)} chunks")
+    return relevant_info
+
+def cached_llm_answer(kind, project_id, query, results, generate):
+    """Return the cached answer for a question and its retrieved chunks, or generate and cache it
+
+    ``generate`` is called with the assembled chunk content on a cache miss.
+    """
+    chunk_ids, query_embedding = answer_cache_context(project_id, query, results)
+    response = answer_cache.lookup(kind, project_id, query, chunk_ids, query_embedding)
+    if response is None:
+        relevant_info = relevant_context(results)
+        response = generate(relevant_info)
+        answer_cache.store(kind, project_id, query, chunk_ids, response, query_embedding)
+    return response
+
 @app.route('/api/chat', methods=['POST'])
 @jwt_required()
 def chat():
-    current_identity = get_jwt_identity()
     data = request.json
     query = data.get('query')
     project_id = data.get('project')
@@ -526,33 +635,21 @@ def chat():
         logging.warning("\n\nMissing query or project in chat request")
         return jsonify({"error": "Missing query or project"}), 400
     
-    if current_identity.startswith('user_'):
-        current_user_id = int(current_identity.split('_')[1])
-        user_data = db.get_user(current_user_id)
-        if not user_data:
-            return jsonify({"error": "User not found"}), 404
-        
-        project = db.get_project(int(project_id))
-        if not project or project['company_id'] != user_data['company_id']:
-            return jsonify({"error": "Project not found or unauthorized"}), 404
-    elif current_identity.startswith('company_'):
-        current_company_id = int(current_identity.split('_')[1])
-        project = db.get_project(int(project_id))
-        if not project or project['company_id'] != current_company_id:
-            return jsonify({"error": "Project not found or unauthorized"}), 404
-    else:
-        return jsonify({"error": "Invalid token"}), 401
+    # Any user of the owning company may chat with a project
+    project, error = authorize_project(int(project_id), company_scope=True)
+    if error:
+        return error
     
     try:
         # Use Supabase for vector search
         results = supabase_manager.query(int(project_id), query)
         
-        # Combine relevant content
-        relevant_info = "\n".join([result['content'] for result in results])
-        
-        # Use OpenAI for final response
-        openai_llm = OPENAILLMAPI()
-        final_response = openai_llm.get_ai_response(query, relevant_info)
+        # Use OpenAI for final response, unless the same question was already
+        # answered from the same retrieved chunks
+        final_response = cached_llm_answer(
+            'chat', int(project_id), query, results,
+            lambda relevant_info: get_llm().get_ai_response(query, relevant_info)
+        )
         
         return jsonify({"response": final_response}), 200
         
@@ -560,6 +657,84 @@ def chat():
         logging.error(f"Error in chat endpoint: {str(e)}")
         return jsonify({"error": "An error occurred processing your request"}), 500
 
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.route('/api/chat/stream', methods=['POST'])
+@jwt_required()
+def chat_stream():
+    """Chat over server-sent events
+
+    Sends "answer" events with pieces of the Answer text as the model writes
+    them, a "chart" event per Dashboard entry as soon as it is complete, and
+    finally "done" with the full response (same as /api/chat) or "error".
+    """
+    data = request.json
+    query = data.get('query')
+    project_id = data.get('project')
+
+    logging.info(f"\n\nStreaming chat request received for project: {project_id}")
+
+    if not query or not project_id:
+        logging.warning("\n\nMissing query or project in chat request")
+        return jsonify({"error": "Missing query or project"}), 400
+
+    project, error = authorize_project(int(project_id), company_scope=True)
+    if error:
+        return error
+
+    try:
+        results = supabase_manager.query(int(project_id), query)
+        chunk_ids, query_embedding = answer_cache_context(int(project_id), query, results)
+        cached_response = answer_cache.lookup('chat', int(project_id), query, chunk_ids, query_embedding)
+    except Exception as e:
+        logging.error(f"Error in chat stream endpoint: {str(e)}")
+        return jsonify({"error": "An error occurred processing your request"}), 500
+
+    def generate():
+        if cached_response is not None:
+            response_json = json.loads(cached_response)
+            yield sse_event('answer', {"delta": response_json['Answer']})
+            for index, chart in enumerate(response_json['Dashboard']):
+                yield sse_event('chart', {"index": index, "chart": chart})
+            yield sse_event('done', {"response": cached_response, "cached": True})
+            return
+
+        parser = AnswerStreamParser()
+        charts = 0
+        try:
+            relevant_info = relevant_context(results)
+            for delta in get_llm().stream_ai_response(query, relevant_info):
+                for event, payload in parser.feed(delta):
+                    if event == 'answer':
+                        yield sse_event('answer', {"delta": payload})
+                    else:
+                        yield sse_event('chart', {"index": charts, "chart": payload})
+                        charts += 1
+            final_response = parser.finish()
+        except Exception as e:
+            logging.error(f"Error in chat stream endpoint: {str(e)}")
+            yield sse_event('error', {"error": "An error occurred processing your request"})
+            return
+
+        answer_cache.store('chat', int(project_id), query, chunk_ids, final_response, query_embedding)
+        yield sse_event('done', {"response": final_response, "cached": False})
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'  # Keep nginx from buffering the stream
+    })
+
+@app.route('/api/metrics/answer-cache', methods=['GET'])
+@jwt_required()
+def get_answer_cache_metrics():
+    return jsonify(answer_cache.stats()), 200
+
+@app.route('/api/metrics/llm-providers', methods=['GET'])
+@jwt_required()
+def get_llm_provider_metrics():
+    return jsonify(llm_registry.stats()), 200
+
 @app.route('/api/companies', methods=['GET'])
 def get_companies():
     companies = db.get_all_companies()
@@ -571,81 +746,41 @@ def get_companies():
     ]), 200
 
 def process_excel_file(file_path):
-    workbook = openpyxl.load_workbook(file_path, data_only=True)
     sheets_data = {}
 
-    for sheet_name in workbook.sheetnames:
-        df = pd.read_excel(file_path, sheet_name=sheet_name)
+    # Parse every sheet in a single pass over the workbook
+    for sheet_name, df in pd.read_excel(file_path, sheet_name=None).items():
         if not df.empty:
-            # Get all column names and create column nodes
             columns = df.columns.tolist()
-            records = []
+            numeric_columns = [col for col in columns if pd.api.types.is_numeric_dtype(df[col])]
             
-            # Create column relationship metadata
-            column_relationships = {}
-            for col1 in columns:
-                for col2 in columns:
-                    if col1 != col2:
-                        correlation = df[col1].corr(df[col2]) if pd.api.types.is_numeric_dtype(df[col1]) and pd.api.types.is_numeric_dtype(df[col2]) else None
-                        column_relationships[f"{col1}_{col2}"] = {
-                            "source": col1,
-                            "target": col2,
-                            "type": "column_relation",
-                            "correlation": correlation if correlation and not np.isnan(correlation) else None,
-                            "relationship_type": "numerical" if correlation is not None else "categorical"
-                        }
+            # One correlation matrix per sheet, shared by every record of the sheet
+            correlation_matrix = df[numeric_columns].corr()
+            correlation_matrix = correlation_matrix.astype(object).where(correlation_matrix.notna(), None)
             
-            # Process each row while preserving column relationships
-            for _, row in df.iterrows():
-                processed_record = {}
-                value_relationships = {}
-                
-                for col in columns:
-                    value = row[col]
-                    # Handle different data types
-                    if isinstance(value, pd.Timestamp):
-                        processed_value = value.strftime('%Y-%m-%d %H:%M:%S')
-                    elif isinstance(value, np.integer):
-                        processed_value = int(value)
-                    elif isinstance(value, np.floating):
-                        processed_value = float(value)
-                    else:
-                        processed_value = str(value) if pd.notna(value) else None
-                        
-                    if processed_value is not None:
-                        processed_record[col] = processed_value
-                        
-                        # Create value relationships between non-null values
-                        for other_col in columns:
-                            if other_col != col and pd.notna(row[other_col]):
-                                other_value = row[other_col]
-                                if isinstance(other_value, pd.Timestamp):
-                                    other_value = other_value.strftime('%Y-%m-%d %H:%M:%S')
-                                elif isinstance(other_value, (np.integer, np.floating)):
-                                    other_value = float(other_value)
-                                else:
-                                    other_value = str(other_value)
-                                
-                                rel_key = f"{col}_{other_col}_value"
-                                value_relationships[rel_key] = {
-                                    "source": str(processed_value),
-                                    "target": str(other_value),
-                                    "source_column": col,
-                                    "target_column": other_col,
-                                    "type": "value_relation"
-                                }
-                
-                records.append({
-                    "data": processed_record,
-                    "value_relationships": value_relationships,
-                    "column_relationships": column_relationships
-                })
+            # Convert each column once, keeping None for missing values
+            converted_columns = []
+            for col in columns:
+                series = df[col]
+                if pd.api.types.is_datetime64_any_dtype(series):
+                    converted = series.dt.strftime('%Y-%m-%d %H:%M:%S')
+                elif col in numeric_columns:
+                    converted = series.astype(object)
+                else:
+                    converted = series.astype(str)
+                converted_columns.append(converted.astype(object).where(series.notna(), None).tolist())
+            
+            records = [
+                {"data": {col: value for col, value in zip(columns, values) if value is not None}}
+                for values in zip(*converted_columns)
+            ]
             
             sheets_data[sheet_name] = {
                 "records": records,
                 "metadata": {
                     "columns": columns,
-                    "column_relationships": column_relationships,
+                    "numeric_columns": numeric_columns,
+                    "correlation_matrix": correlation_matrix.to_dict(),
                     "total_rows": len(records)
                 }
             }
@@ -654,6 +789,34 @@ def process_excel_file(file_path):
 
     return sheets_data
 
+def get_column_relationship(sheet_metadata, source, target):
+    """Build the relationship between two columns of a sheet from its correlation matrix"""
+    correlation = None
+    numerical = source in sheet_metadata["numeric_columns"] and target in sheet_metadata["numeric_columns"]
+    if numerical:
+        correlation = sheet_metadata["correlation_matrix"][source][target] or None
+    return {
+        "source": source,
+        "target": target,
+        "type": "column_relation",
+        "correlation": correlation,
+        "relationship_type": "numerical" if numerical else "categorical"
+    }
+
+def iter_value_relationships(record):
+    """Yield the value relationships between the non-null cells of a record on demand"""
+    data = record["data"]
+    for col, value in data.items():
+        for other_col, other_value in data.items():
+            if other_col != col:
+                yield {
+                    "source": str(value),
+                    "target": str(other_value),
+                    "source_column": col,
+                    "target_column": other_col,
+                    "type": "value_relation"
+                }
+
 # Add this function to create the upload folder if it doesn't exist
 # def create_upload_folder():
 #     upload_folder = app.config['UPLOAD_FOLDER']
@@ -666,6 +829,19 @@ def debug_token():
     current_identity = get_jwt_identity()
     return jsonify({"message": "Token is valid", "identity": current_identity}), 200
 
+project_access = ProjectAccessResolver(db)
+
+def authorize_project(project_id, company_scope=False):
+    """Check the current identity's access to a project
+
+    Returns (project, None) when access is allowed, otherwise (None, error
+    response). The returned project must be treated as read-only.
+    """
+    decision = project_access.resolve(get_jwt_identity(), project_id, company_scope)
+    if decision.allowed:
+        return decision.project, None
+    return None, (jsonify({"error": decision.error}), decision.status)
+
 def cors_preflight():
     def decorator(f):
         @wraps(f)
@@ -673,7 +849,7 @@ def cors_preflight():
             if request.method == 'OPTIONS':
                 response = make_response()
                 response.headers.add('Access-Control-Allow-Origin', 'http://localhost:5173')  # Or specify your frontend URL
-                response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization')
+                response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization,Range,If-Range,If-None-Match,If-Modified-Since')
                 response.headers.add('Access-Control-Allow-Methods', 'GET,POST,PUT,DELETE,OPTIONS')
                 response.headers.add('Access-Control-Allow-Credentials', 'true')
                 return response
@@ -701,21 +877,9 @@ def jwt_or_options():
 def get_project_details(project_id):
     if request.method == 'OPTIONS':
         return '', 200
-    current_identity = get_jwt_identity()
-    project = db.get_project(project_id)
-    
-    if not project:
-        return jsonify({"error": "Project not found"}), 404
-    
-    # Check authorization
-    if current_identity.startswith('user_'):
-        current_user_id = int(current_identity.split('_')[1])
-        if current_user_id not in project.get('assigned_users', []):
-            return jsonify({"error": "Unauthorized access to project"}), 403
-    elif current_identity.startswith('company_'):
-        current_company_id = int(current_identity.split('_')[1])
-        if project['company_id'] != current_company_id:
-            return jsonify({"error": "Unauthorized access to project"}), 403
+    project, error = authorize_project(project_id)
+    if error:
+        return error
     
     # Get project files
     project_files = db.get_project_files(project_id)
@@ -733,21 +897,9 @@ def get_project_details(project_id):
 def get_project_pl(project_id):
     if request.method == 'OPTIONS':
         return '', 200
-    current_identity = get_jwt_identity()
-    project = db.get_project(project_id)
-    
-    if not project:
-        return jsonify({"error": "Project not found"}), 404
-    
-    # Add authorization check similar to get_project_details
-    if current_identity.startswith('user_'):
-        current_user_id = int(current_identity.split('_')[1])
-        if current_user_id not in project.get('assigned_users', []):
-            return jsonify({"error": "Unauthorized access to project"}), 403
-    elif current_identity.startswith('company_'):
-        current_company_id = int(current_identity.split('_')[1])
-        if project['company_id'] != current_company_id:
-            return jsonify({"error": "Unauthorized access to project"}), 403
+    project, error = authorize_project(project_id)
+    if error:
+        return error
     
     # This is a placeholder. Implement your actual P/L calculation logic
     return jsonify({
@@ -762,21 +914,9 @@ def get_project_pl(project_id):
 def get_project_files(project_id):
     if request.method == 'OPTIONS':
         return '', 200
-    current_identity = get_jwt_identity()
-    project = db.get_project(project_id)
-    
-    if not project:
-        return jsonify({"error": "Project not found"}), 404
-    
-    # Add authorization check
-    if current_identity.startswith('user_'):
-        current_user_id = int(current_identity.split('_')[1])
-        if current_user_id not in project.get('assigned_users', []):
-            return jsonify({"error": "Unauthorized access to project"}), 403
-    elif current_identity.startswith('company_'):
-        current_company_id = int(current_identity.split('_')[1])
-        if project['company_id'] != current_company_id:
-            return jsonify({"error": "Unauthorized access to project"}), 403
+    project, error = authorize_project(project_id)
+    if error:
+        return error
     
     project_files = db.get_project_files(project_id)
     
@@ -802,9 +942,15 @@ def delete_project_file(project_id, file_id):
         success = supabase_manager.delete_file(project_id, file_info['path'])
         
         if success:
-            # Delete the local file if it exists
-            if os.path.exists(file_info['path']):
-                os.remove(file_info['path'])
+            # Delete the local file and its manifest entry
+            db.delete_project_file(project_id, file_id)
+            answer_cache.invalidate_project(project_id)
+            project_context.invalidate(project_id)
+            
+            # Charts that read the file's columns need recomputing without it
+            removed_schema = db.delete_file_schema(project_id, file_info['name'])
+            if removed_schema:
+                chart_refresh_scheduler.schedule(project_id, file_info['name'], schema_changes(removed_schema, {}))
             return jsonify({"message": "File deleted successfully"}), 200
         else:
             return jsonify({"error": "Failed to delete file"}), 500
@@ -819,37 +965,29 @@ def delete_project_file(project_id, file_id):
 def download_project_file(project_id, file_id):
     if request.method == 'OPTIONS':
         return '', 200
-    current_identity = get_jwt_identity()
-    project = db.get_project(project_id)
-    
-    if not project:
-        return jsonify({"error": "Project not found"}), 404
-    
-    # Check authorization
-    if current_identity.startswith('user_'):
-        current_user_id = int(current_identity.split('_')[1])
-        if current_user_id not in project.get('assigned_users', []):
-            return jsonify({"error": "Unauthorized access to project"}), 403
-    elif current_identity.startswith('company_'):
-        current_company_id = int(current_identity.split('_')[1])
-        if project['company_id'] != current_company_id:
-            return jsonify({"error": "Unauthorized access to project"}), 403
+    project, error = authorize_project(project_id)
+    if error:
+        return error
     
     file_data = db.get_project_file(project_id, file_id)
     if file_data:
-        return send_file(
-            io.BytesIO(file_data['content']),
-            mimetype=file_data['mime_type'],
+        # Stream straight from disk (or hand off via X-Sendfile) with Range and
+        # ETag / If-None-Match handling, so repeat downloads get a 304
+        response = send_file(
+            os.path.abspath(file_data['path']),
             as_attachment=True,
-            download_name=file_data['name']
+            download_name=file_data['name'],
+            conditional=True,
+            etag=True
         )
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
     else:
         return jsonify({"error": "File not found"}), 404
 
 @app.route('/api/predict', methods=['POST'])
 @jwt_required()
 def predict():
-    current_identity = get_jwt_identity()
     data = request.json
     query = data.get('query')
     project_id = data.get('project')
@@ -862,33 +1000,19 @@ def predict():
         return jsonify({"error": "Missing query or project"}), 400
     
     # Authorization check
-    if current_identity.startswith('user_'):
-        current_user_id = int(current_identity.split('_')[1])
-        user_data = db.get_user(current_user_id)
-        if not user_data:
-            return jsonify({"error": "User not found"}), 404
-        
-        project = db.get_project(int(project_id))
-        if not project or project['company_id'] != user_data['company_id']:
-            return jsonify({"error": "Project not found or unauthorized"}), 404
-    elif current_identity.startswith('company_'):
-        current_company_id = int(current_identity.split('_')[1])
-        project = db.get_project(int(project_id))
-        if not project or project['company_id'] != current_company_id:
-            return jsonify({"error": "Project not found or unauthorized"}), 404
-    else:
-        return jsonify({"error": "Invalid token"}), 401
+    project, error = authorize_project(int(project_id), company_scope=True)
+    if error:
+        return error
     
     try:
         # Use Supabase for vector search
         results = supabase_manager.query(int(project_id), query)
         
-        # Combine relevant content
-        relevant_info = "\n".join([result['content'] for result in results])
-        
-        # Use OpenAI for prediction
-        openai_llm = OPENAILLMAPI()
-        prediction_response = openai_llm.get_prediction(query, relevant_info)
+        # Use OpenAI for prediction, reusing a cached answer for the same context
+        prediction_response = cached_llm_answer(
+            'predict', int(project_id), query, results,
+            lambda relevant_info: get_llm().get_prediction(query, relevant_info)
+        )
         
         return jsonify(json.loads(prediction_response)), 200
         
@@ -907,6 +1031,15 @@ def save_project_chart(project_id):
         if not all(k in data for k in ['name', 'query', 'chart_data']):
             return jsonify({"error": "Missing required fields"}), 400
 
+        # An optional data spec lets refreshes recompute the chart without the LLM
+        if data.get('data_spec'):
+            try:
+                data['data_spec'] = compile_data_spec(data['data_spec'])
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+            # Record what the chart reads, so uploads only refresh it when that data changes
+            data['dependencies'] = chart_dependencies(data)
+
         # Add user information
         if current_identity.startswith('user_'):
             data['created_by'] = int(current_identity.split('_')[1])
@@ -938,13 +1071,53 @@ def get_project_charts(project_id):
             "query": chart['query'],
             "chart_data": chart['chart_data'],
             "created_at": chart['created_at'],
-            "created_by": chart.get('created_by')
+            "created_by": chart.get('created_by'),
+            "data_spec": chart.get('data_spec')
         } for chart in charts]), 200
 
     except Exception as e:
         logging.error(f"Error retrieving charts: {str(e)}")
         return jsonify({"error": "An unexpected error occurred"}), 500
 
+@app.route('/api/projects/<int:project_id>/charts/<int:chart_id>/data-spec', methods=['PUT'])
+@jwt_required()
+def set_chart_data_spec(project_id, chart_id):
+    """Attach (or with null, remove) a chart's data spec
+
+    A new spec is evaluated straight away, so the chart's data is replaced
+    by the recomputed values and a spec that does not fit the project's
+    data is rejected.
+    """
+    project, error = authorize_project(project_id)
+    if error:
+        return error
+
+    try:
+        chart = db.get_chart(project_id, chart_id)
+        if not chart:
+            return jsonify({"error": "Chart not found"}), 404
+
+        spec = (request.json or {}).get('data_spec')
+        chart_data = chart['chart_data']
+        if spec:
+            try:
+                spec = compile_data_spec(spec)
+                chart_data = chart_engine.apply(
+                    dict(chart_data), spec, chart_engine.evaluate(db.get_project_files(project_id), spec)
+                )
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+
+        # Charts without a spec get their dependencies from the file schemas of each refresh
+        dependencies = chart_dependencies(dict(chart, data_spec=spec)) if spec else None
+        if not db.set_chart_data(project_id, chart_id, chart_data, data_spec=spec or None, dependencies=dependencies):
+            return jsonify({"error": "Failed to update chart"}), 500
+        return jsonify({"id": chart_id, "chart_data": chart_data, "data_spec": spec or None}), 200
+
+    except Exception as e:
+        logging.error(f"Error setting chart data spec: {str(e)}")
+        return jsonify({"error": "An unexpected error occurred"}), 500
+
 @app.route('/api/projects/<int:project_id>/charts/<int:chart_id>', methods=['DELETE'])
 @jwt_required()
 def delete_project_chart(project_id, chart_id):
@@ -1032,7 +1205,6 @@ def remove_chart_from_dashboard(project_id, chart_id):
 @jwt_required()
 def save_dashboard_layout(project_id):
     try:
-        current_identity = get_jwt_identity()
         data = request.json
         
         # Log the received data for debugging
@@ -1053,19 +1225,9 @@ def save_dashboard_layout(project_id):
         data['charts'] = data.get('charts', [])
 
         # Verify project access
-        project = db.get_project(project_id)
-        if not project:
-            return jsonify({"error": "Project not found"}), 404
-
-        # Check authorization
-        if current_identity.startswith('user_'):
-            current_user_id = int(current_identity.split('_')[1])
-            if current_user_id not in project.get('assigned_users', []):
-                return jsonify({"error": "Unauthorized access to project"}), 403
-        elif current_identity.startswith('company_'):
-            current_company_id = int(current_identity.split('_')[1])
-            if project['company_id'] != current_company_id:
-                return jsonify({"error": "Unauthorized access to project"}), 403
+        project, error = authorize_project(project_id)
+        if error:
+            return error
 
         # Save the layout
         layout_id = db.save_dashboard_layout(project_id, data)
@@ -1086,20 +1248,9 @@ def save_dashboard_layout(project_id):
 def get_dashboard_layouts(project_id):
     try:
         # Verify project access and authorization
-        current_identity = get_jwt_identity()
-        project = db.get_project(project_id)
-        if not project:
-            return jsonify({"error": "Project not found"}), 404
-
-        # Check authorization
-        if current_identity.startswith('user_'):
-            current_user_id = int(current_identity.split('_')[1])
-            if current_user_id not in project.get('assigned_users', []):
-                return jsonify({"error": "Unauthorized access to project"}), 403
-        elif current_identity.startswith('company_'):
-            current_company_id = int(current_identity.split('_')[1])
-            if project['company_id'] != current_company_id:
-                return jsonify({"error": "Unauthorized access to project"}), 403
+        project, error = authorize_project(project_id)
+        if error:
+            return error
 
         layouts = db.get_dashboard_layouts(project_id)
         return jsonify(layouts), 200
@@ -1113,20 +1264,9 @@ def get_dashboard_layouts(project_id):
 def get_dashboard_layout(project_id, layout_id):
     try:
         # Verify project access and authorization
-        current_identity = get_jwt_identity()
-        project = db.get_project(project_id)
-        if not project:
-            return jsonify({"error": "Project not found"}), 404
-
-        # Check authorization
-        if current_identity.startswith('user_'):
-            current_user_id = int(current_identity.split('_')[1])
-            if current_user_id not in project.get('assigned_users', []):
-                return jsonify({"error": "Unauthorized access to project"}), 403
-        elif current_identity.startswith('company_'):
-            current_company_id = int(current_identity.split('_')[1])
-            if project['company_id'] != current_company_id:
-                return jsonify({"error": "Unauthorized access to project"}), 403
+        project, error = authorize_project(project_id)
+        if error:
+            return error
 
         layout = db.get_dashboard_layout(project_id, layout_id)
         if layout:
@@ -1348,23 +1488,10 @@ def save_project_prompt(project_id):
             logging.error("Missing content field")
             return jsonify({"error": "Content is required"}), 400
 
-        # Verify project exists
-        project = db.get_project(project_id)
-        if not project:
-            logging.error(f"Project not found: {project_id}")
-            return jsonify({"error": "Project not found"}), 404
-
-        # Check authorization
-        if current_identity.startswith('user_'):
-            current_user_id = int(current_identity.split('_')[1])
-            if current_user_id not in project.get('assigned_users', []):
-                logging.error(f"User {current_user_id} not authorized for project {project_id}")
-                return jsonify({"error": "Unauthorized access to project"}), 403
-        elif current_identity.startswith('company_'):
-            current_company_id = int(current_identity.split('_')[1])
-            if project['company_id'] != current_company_id:
-                logging.error(f"Company {current_company_id} not authorized for project {project_id}")
-                return jsonify({"error": "Unauthorized access to project"}), 403
+        # Verify project exists and check authorization
+        project, error = authorize_project(project_id)
+        if error:
+            return error
 
         # Prepare prompt data
         prompt_data = {
@@ -1397,23 +1524,10 @@ def save_project_prompt(project_id):
 @jwt_required()
 def get_project_prompts(project_id):
     try:
-        current_identity = get_jwt_identity()
-        
-        # Verify project exists
-        project = db.get_project(project_id)
-        if not project:
-            logging.error(f"Project not found: {project_id}")
-            return jsonify({"error": "Project not found"}), 404
-
-        # Check authorization
-        if current_identity.startswith('user_'):
-            current_user_id = int(current_identity.split('_')[1])
-            if current_user_id not in project.get('assigned_users', []):
-                return jsonify({"error": "Unauthorized access to project"}), 403
-        elif current_identity.startswith('company_'):
-            current_company_id = int(current_identity.split('_')[1])
-            if project['company_id'] != current_company_id:
-                return jsonify({"error": "Unauthorized access to project"}), 403
+        # Verify project exists and check authorization
+        project, error = authorize_project(project_id)
+        if error:
+            return error
 
         prompts = db.get_project_prompts(project_id)
         return jsonify(prompts), 200
@@ -1426,23 +1540,10 @@ def get_project_prompts(project_id):
 @jwt_required()
 def delete_project_prompt(project_id, prompt_id):
     try:
-        current_identity = get_jwt_identity()
-        
-        # Verify project exists
-        project = db.get_project(project_id)
-        if not project:
-            logging.error(f"Project not found: {project_id}")
-            return jsonify({"error": "Project not found"}), 404
-
-        # Check authorization
-        if current_identity.startswith('user_'):
-            current_user_id = int(current_identity.split('_')[1])
-            if current_user_id not in project.get('assigned_users', []):
-                return jsonify({"error": "Unauthorized access to project"}), 403
-        elif current_identity.startswith('company_'):
-            current_company_id = int(current_identity.split('_')[1])
-            if project['company_id'] != current_company_id:
-                return jsonify({"error": "Unauthorized access to project"}), 403
+        # Verify project exists and check authorization
+        project, error = authorize_project(project_id)
+        if error:
+            return error
 
         if db.delete_prompt(project_id, prompt_id):
             return jsonify({"message": "Prompt deleted successfully"}), 200
@@ -1457,5 +1558,5 @@ def delete_project_prompt(project_id, prompt_id):
 if __name__ == '__main__':
     logging.info("Starting the application")
     migrate_existing_users()  # Add this line
-    app.run(debug=True)
+    app.run(debug=RUN_DEBUG)
 
@@ -0,0 +1,261 @@
+"""Deterministic chart refreshes from declarative data specs
+
+A saved chart may carry a ``data_spec`` describing how its numbers are
+derived from the project's uploaded spreadsheets:
+
+    {
+        "file": "actuals.xlsx",          # optional, default every spreadsheet of the project
+        "sheet": "Materials",            # optional, default the first sheet
+        "group_by": "Category",
+        "value": "Total Cost",           # optional when aggregate is "count"
+        "aggregate": "sum",              # sum, mean, median, min, max or count
+        "secondary_value": "CO2e (kg)",  # optional, fills Y_axis_data_secondary
+        "filters": [{"column": "Supplier", "op": "==", "value": "Helios Energy"}],
+        "date_grain": "month",           # optional, buckets a date group_by column
+        "sort": "label",                 # label, value_desc or value_asc
+        "limit": 12                      # optional, keep the first N groups
+    }
+
+ChartDataEngine re-evaluates the spec with pandas against the files on
+disk, so a refresh is reproducible and needs no LLM call.
+"""
+import os
+import threading
+from collections import OrderedDict
+import pandas as pd
+from logger import CustomLogger
+
+logger = CustomLogger('chart_engine')
+
+AGGREGATES = ('sum', 'mean', 'median', 'min', 'max', 'count')
+FILTER_OPS = ('==', '!=', '>', '>=', '<', '<=', 'in', 'not_in', 'contains')
+DATE_GRAINS = {'day': 'D', 'week': 'W', 'month': 'M', 'quarter': 'Q', 'year': 'Y'}
+SORTS = ('label', 'value_desc', 'value_asc')
+EXCEL_EXTENSIONS = ('.xlsx', '.xlsm', '.xls')
+TABULAR_EXTENSIONS = EXCEL_EXTENSIONS + ('.csv',)
+LABEL_VALUE_TYPES = ('PieChart', 'DonutChart')
+
+
+def compile_data_spec(spec):
+    """Validate a data spec and return it normalized with defaults filled in
+
+    Raises ValueError describing the first problem found.
+    """
+    if not isinstance(spec, dict):
+        raise ValueError("data_spec must be an object")
+    group_by = spec.get('group_by')
+    if not group_by or not isinstance(group_by, str):
+        raise ValueError("data_spec.group_by must name a column")
+    aggregate = spec.get('aggregate', 'sum')
+    if aggregate not in AGGREGATES:
+        raise ValueError(f"data_spec.aggregate must be one of {', '.join(AGGREGATES)}")
+    value = spec.get('value')
+    if aggregate != 'count' and (not value or not isinstance(value, str)):
+        raise ValueError("data_spec.value must name a column unless aggregate is count")
+    date_grain = spec.get('date_grain')
+    if date_grain is not None and date_grain not in DATE_GRAINS:
+        raise ValueError(f"data_spec.date_grain must be one of {', '.join(DATE_GRAINS)}")
+    sort = spec.get('sort', 'label')
+    if sort not in SORTS:
+        raise ValueError(f"data_spec.sort must be one of {', '.join(SORTS)}")
+    limit = spec.get('limit')
+    if limit is not None and (not isinstance(limit, int) or isinstance(limit, bool) or limit < 1):
+        raise ValueError("data_spec.limit must be a positive integer")
+
+    filters = []
+    for condition in spec.get('filters') or []:
+        if not isinstance(condition, dict) or not condition.get('column'):
+            raise ValueError("each data_spec filter needs a column")
+        op = condition.get('op', '==')
+        if op not in FILTER_OPS:
+            raise ValueError(f"filter op must be one of {', '.join(FILTER_OPS)}")
+        if op in ('in', 'not_in') and not isinstance(condition.get('value'), list):
+            raise ValueError(f"filter op {op} needs a list value")
+        filters.append({'column': condition['column'], 'op': op, 'value': condition.get('value')})
+
+    return {
+        'file': spec.get('file'),
+        'sheet': spec.get('sheet'),
+        'group_by': group_by,
+        'value': value,
+        'aggregate': aggregate,
+        'secondary_value': spec.get('secondary_value'),
+        'filters': filters,
+        'date_grain': date_grain,
+        'sort': sort,
+        'limit': limit
+    }
+
+
+def _json_number(value):
+    return None if pd.isna(value) else float(value)
+
+
+def _table_cell(value):
+    """Table cell text of a _json_number value at full precision (whole numbers without a decimal point)"""
+    if value is None:
+        return ""
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+class ChartDataEngine:
+    """Evaluates compiled data specs against a project's spreadsheets
+
+    Parsed sheets are kept in a small LRU keyed by path, sheet, mtime and
+    size, so refreshing many charts over the same workbook parses it once
+    and an overwritten file is picked up on the next refresh.
+    """
+
+    def __init__(self, max_sheets=None):
+        self.max_sheets = max_sheets or int(os.environ.get('CHART_ENGINE_CACHE_SHEETS', 32))
+        self._frames = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _read_sheet(self, path, sheet):
+        """DataFrame of one sheet (CSV files have a single unnamed sheet), or None if it does not exist"""
+        stat = os.stat(path)
+        is_csv = path.lower().endswith('.csv')
+        key = (path, None if is_csv else sheet, stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            if key in self._frames:
+                self._frames.move_to_end(key)
+                return self._frames[key]
+
+        if is_csv:
+            frame = pd.read_csv(path)
+        else:
+            try:
+                frame = pd.read_excel(path, sheet_name=sheet if sheet is not None else 0)
+            except ValueError:
+                # pandas raises ValueError for a sheet name the workbook does not have
+                frame = None
+
+        with self._lock:
+            self._frames[key] = frame
+            while len(self._frames) > self.max_sheets:
+                self._frames.popitem(last=False)
+        return frame
+
+    def load_frame(self, files, spec):
+        """Concatenate the spec's sheet from every matching project file"""
+        frames = []
+        for file_info in files:
+            if spec['file'] and file_info['name'] != spec['file']:
+                continue
+            if not file_info['path'].lower().endswith(TABULAR_EXTENSIONS):
+                continue
+            frame = self._read_sheet(file_info['path'], spec['sheet'])
+            if frame is not None and not frame.empty:
+                frames.append(frame)
+        if not frames:
+            raise ValueError(f"No data found for file {spec['file'] or '*'} sheet {spec['sheet'] or '(first)'}")
+        return frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+
+    @staticmethod
+    def _apply_filters(frame, filters):
+        for condition in filters:
+            column, op, value = condition['column'], condition['op'], condition['value']
+            if column not in frame.columns:
+                raise ValueError(f"Filter column {column} not found")
+            series = frame[column]
+            if op in ('>', '>=', '<', '<='):
+                series = pd.to_numeric(series, errors='coerce')
+            if op == '==':
+                mask = series == value
+            elif op == '!=':
+                mask = series != value
+            elif op == '>':
+                mask = series > value
+            elif op == '>=':
+                mask = series >= value
+            elif op == '<':
+                mask = series < value
+            elif op == '<=':
+                mask = series <= value
+            elif op == 'in':
+                mask = series.isin(value)
+            elif op == 'not_in':
+                mask = ~series.isin(value)
+            else:
+                mask = series.astype(str).str.contains(str(value), case=False, regex=False, na=False)
+            frame = frame[mask.to_numpy()]
+        return frame
+
+    @staticmethod
+    def _aggregate(groups, column, aggregate):
+        if aggregate == 'count':
+            return groups.size()
+        return groups[column].agg(aggregate)
+
+    def evaluate(self, files, spec):
+        """Return {'labels': [...], 'values': [...], 'secondary': [...] or None} for a compiled spec"""
+        frame = self._apply_filters(self.load_frame(files, spec), spec['filters'])
+
+        columns = [spec['group_by']] + [c for c in (spec['value'], spec['secondary_value']) if c]
+        missing = [column for column in columns if column not in frame.columns]
+        if missing:
+            raise ValueError(f"Columns not found: {', '.join(missing)}")
+
+        frame = frame.copy()
+        for column in columns[1:]:
+            frame[column] = pd.to_numeric(frame[column], errors='coerce')
+        key = frame[spec['group_by']]
+        if spec['date_grain']:
+            key = pd.to_datetime(key, errors='coerce').dt.to_period(DATE_GRAINS[spec['date_grain']])
+        groups = frame.groupby(key, sort=True)
+
+        result = pd.DataFrame({'value': self._aggregate(groups, spec['value'], spec['aggregate'])})
+        if spec['secondary_value']:
+            aggregate = 'sum' if spec['aggregate'] == 'count' else spec['aggregate']
+            result['secondary'] = self._aggregate(groups, spec['secondary_value'], aggregate)
+        if spec['sort'] != 'label':
+            result = result.sort_values('value', ascending=spec['sort'] == 'value_asc', kind='stable')
+        if spec['limit']:
+            result = result.head(spec['limit'])
+
+        return {
+            'labels': [str(label) for label in result.index],
+            'values': [_json_number(value) for value in result['value'].to_numpy()],
+            'secondary': ([_json_number(value) for value in result['secondary'].to_numpy()]
+                          if spec['secondary_value'] else None)
+        }
+
+    @staticmethod
+    def apply(chart_data, spec, result):
+        """Write an evaluation result into the fields the chart's Type renders"""
+        chart_type = chart_data.get('Type')
+        if chart_type in LABEL_VALUE_TYPES:
+            chart_data['Labels'] = result['labels']
+            chart_data['Values'] = result['values']
+        elif chart_type == 'Table':
+            headers = [spec['group_by'], spec['value'] or 'Count']
+            if result['secondary'] is not None:
+                headers.append(spec['secondary_value'])
+            chart_data['Column_headers'] = headers
+            rows = zip(result['labels'], result['values'], result['secondary'] or [None] * len(result['labels']))
+            chart_data['Row_data'] = [
+                [label, _table_cell(value)]
+                + ([_table_cell(secondary)] if result['secondary'] is not None else [])
+                for label, value, secondary in rows
+            ]
+        else:
+            chart_data['X_axis_data'] = result['labels']
+            chart_data['Y_axis_data'] = result['values']
+            if result['secondary'] is not None:
+                chart_data['Y_axis_data_secondary'] = result['secondary']
+        return chart_data
+
+    def refresh(self, files, chart):
+        """Recompute a chart's data from its spec, returning the new chart_data
+
+        Prediction charts are left to the LLM, since their forecast is not
+        part of the spec.
+        """
+        spec = chart.get('data_spec')
+        chart_data = dict(chart['chart_data'])
+        if not spec or chart_data.get('is_prediction'):
+            return None
+        return self.apply(chart_data, spec, self.evaluate(files, spec))
+
+
+chart_engine = ChartDataEngine()
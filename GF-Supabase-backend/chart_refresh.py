@@ -0,0 +1,151 @@
+"""Change-scoped, coalesced chart refreshes
+
+Every saved chart records the files, sheets and columns it depends on.
+Ingesting a file compares its column fingerprints with the previous
+upload of the same file, and only charts depending on a changed column
+are refreshed. Changes arriving within CHART_REFRESH_DEBOUNCE seconds of
+each other are merged into one refresh pass per project.
+"""
+import os
+import re
+import time
+import atexit
+import threading
+from logger import CustomLogger
+
+logger = CustomLogger('chart_refresh')
+
+ANY = '*'
+UNNAMED_SHEET = ''  # CSV files have a single sheet without a name
+LABEL_FIELDS = ('X_axis_label', 'Y_axis_label', 'Column_headers', 'Labels')
+
+
+def chart_dependencies(chart, file_schemas=()):
+    """Files, sheets and columns a chart reads, each a sorted list or [ANY]
+
+    A data spec names them exactly. For a chart produced by the LLM, the
+    known columns of the project mentioned in its name, query or labels
+    are taken as its columns; with no such mention it depends on
+    everything. Those columns change as files are uploaded, so they are
+    worked out again from the current ``file_schemas`` at every refresh
+    rather than stored with the chart.
+    """
+    spec = chart.get('data_spec')
+    if spec:
+        columns = {spec['group_by'], spec.get('value'), spec.get('secondary_value')}
+        columns.update(condition['column'] for condition in spec.get('filters') or [])
+        return {
+            'files': [spec['file']] if spec.get('file') else [ANY],
+            'sheets': [spec['sheet']] if spec.get('sheet') else [ANY],
+            'columns': sorted(column for column in columns if column)
+        }
+
+    chart_data = chart.get('chart_data') or {}
+    texts = [chart.get('name'), chart.get('query'), chart_data.get('Name')]
+    for field in LABEL_FIELDS:
+        value = chart_data.get(field)
+        texts.extend(value if isinstance(value, list) else [value])
+    text = ' '.join(str(t) for t in texts if t).lower()
+
+    columns = set()
+    for file_schema in file_schemas:
+        for sheet_columns in file_schema['sheets'].values():
+            for column in sheet_columns:
+                if re.search(r'(?<!\w)' + re.escape(column.lower()) + r'(?!\w)', text):
+                    columns.add(column)
+    return {'files': [ANY], 'sheets': [ANY], 'columns': sorted(columns) or [ANY]}
+
+
+def schema_changes(previous, current):
+    """{sheet: set of columns} that differ between two {sheet: {column: fingerprint}} schemas"""
+    previous = previous or {}
+    changes = {}
+    for sheet in set(previous) | set(current):
+        old, new = previous.get(sheet, {}), current.get(sheet, {})
+        columns = {column for column in set(old) | set(new) if old.get(column) != new.get(column)}
+        if columns:
+            changes[sheet] = columns
+    return changes
+
+
+def merge_changes(pending, file_name, changes):
+    """Fold one file's {sheet: columns} changes into {file: {sheet: columns}}"""
+    sheets = pending.setdefault(file_name, {})
+    for sheet, columns in changes.items():
+        sheets.setdefault(sheet, set()).update(columns)
+    return pending
+
+
+def chart_affected(dependencies, changes):
+    """Whether any change in {file: {sheet: columns}} touches the dependencies"""
+    for file_name, sheets in changes.items():
+        if ANY not in dependencies['files'] and file_name not in dependencies['files']:
+            continue
+        for sheet, columns in sheets.items():
+            if sheet != UNNAMED_SHEET and ANY not in dependencies['sheets'] and sheet not in dependencies['sheets']:
+                continue
+            if ANY in dependencies['columns'] or columns & set(dependencies['columns']):
+                return True
+    return False
+
+
+class ChartRefreshScheduler:
+    """Coalesces a project's data changes into one delayed refresh
+
+    Each change restarts the project's timer, so a burst of uploads is
+    refreshed once, CHART_REFRESH_DEBOUNCE seconds (default 5) after the
+    last one, but never later than CHART_REFRESH_MAX_DELAY seconds
+    (default 30) after the first. ``refresh`` is called with the project
+    ID and the merged {file: {sheet: columns}} changes on a timer thread.
+    The timers are daemon threads, so they do not hold up shutdown and are
+    killed at exit; flush(), registered with atexit, runs the refreshes
+    still pending then so they are not lost.
+    """
+
+    def __init__(self, refresh, debounce=None, max_delay=None):
+        self.refresh = refresh
+        self.debounce = debounce if debounce is not None else float(os.environ.get('CHART_REFRESH_DEBOUNCE', 5))
+        self.max_delay = max_delay if max_delay is not None else float(os.environ.get('CHART_REFRESH_MAX_DELAY', 30))
+        self._pending = {}  # project_id -> (changes, first change time, timer)
+        self._refreshing = {}  # project_id -> lock held while its refresh runs
+        self._lock = threading.Lock()
+        atexit.register(self.flush)
+
+    def schedule(self, project_id, file_name, changes):
+        if not changes:
+            logger.info(f"No column of {file_name} changed, charts of project {project_id} are up to date")
+            return
+        with self._lock:
+            pending, first, timer = self._pending.get(project_id, ({}, None, None))
+            if timer is not None:
+                timer.cancel()
+            now = time.monotonic()
+            first = first if first is not None else now
+            delay = max(0.0, min(self.debounce, first + self.max_delay - now))
+            timer = threading.Timer(delay, self._fire, args=(project_id,))
+            timer.daemon = True
+            self._pending[project_id] = (merge_changes(pending, file_name, changes), first, timer)
+            timer.start()
+
+    def _fire(self, project_id):
+        with self._lock:
+            entry = self._pending.pop(project_id, None)
+            refreshing = self._refreshing.setdefault(project_id, threading.Lock())
+        if entry is None:
+            return
+        # Changes arriving during a refresh wait for it rather than running alongside
+        with refreshing:
+            try:
+                self.refresh(project_id, entry[0])
+            except Exception as e:
+                logger.error(f"Error refreshing charts of project {project_id}: {str(e)}")
+
+    def flush(self, project_id=None):
+        """Run pending refreshes now; registered to run at exit"""
+        with self._lock:
+            project_ids = [project_id] if project_id is not None else list(self._pending)
+            for pid in project_ids:
+                if pid in self._pending:
+                    self._pending[pid][2].cancel()
+        for pid in project_ids:
+            self._fire(pid)
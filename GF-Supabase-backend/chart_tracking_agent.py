@@ -1,28 +1,38 @@
 from logger import CustomLogger
 from database import db
-from supabase_manager import supabase_manager
-from Providers.OPENAILLMAPI import OPENAILLMAPI
+from project_context import project_context
+from Providers.registry import get_llm, llm_registry
+from chart_engine import chart_engine
+from chart_refresh import chart_dependencies, chart_affected
+import os
 import json
+import asyncio
 import logging
 import datetime
 
 logger = CustomLogger('chart_tracking')
 
 class ChartTrackingAgent:
-    def __init__(self):
-        self.openai_llm = OPENAILLMAPI()
+    def __init__(self, max_concurrency=None):
+        # Charts refreshed in parallel; the provider's rate limiter applies on top
+        self.max_concurrency = max_concurrency or int(os.environ.get('CHART_REFRESH_CONCURRENCY', 8))
+
+    @property
+    def openai_llm(self):
+        # The process-wide provider, sharing its connection pool with the chat endpoints
+        return get_llm()
         
-    def _create_update_prompt(self, chart_data, project_data):
-        """Create a dynamic prompt for updating chart values"""
+    def _create_update_prompt(self, chart_data):
+        """Create a dynamic prompt for updating chart values
+
+        The project data is sent once, as the relevant data ahead of this prompt.
+        """
         prompt = f"""
-You are a data visualization expert. You need to update an existing chart with new data while maintaining its original structure and type.
+You are a data visualization expert. You need to update an existing chart with the new project data given above while maintaining its original structure and type.
 
 Original Chart Configuration:
 {json.dumps(chart_data, indent=2)}
 
-New Project Data:
-{project_data}
-
 Requirements:
 1. Keep the same chart type, name, and structure
 2. Update only the numerical values and data points
@@ -65,8 +75,57 @@ Please update the chart values while keeping all other properties unchanged.
             logger.error(f"Error updating chart values: {str(e)}")
             raise
 
-    def update_project_charts(self, project_id):
-        """Update all saved charts for a project with new data"""
+    def _recompute_spec_charts(self, project_id, charts):
+        """Refresh the charts that have a data spec, returning (updated charts, charts left for the LLM)"""
+        if not any(chart.get('data_spec') for chart in charts):
+            return [], charts
+
+        files = db.get_project_files(project_id)
+        updated_charts = []
+        remaining = []
+        for chart in charts:
+            try:
+                chart_data = chart_engine.refresh(files, chart)
+            except Exception as e:
+                logger.warning(f"Data spec of chart {chart.doc_id} failed, falling back to the LLM: {str(e)}")
+                chart_data = None
+            if chart_data is None:
+                remaining.append(chart)
+            elif db.set_chart_data(project_id, chart.doc_id, chart_data):
+                logger.info(f"Recomputed chart {chart.doc_id} from its data spec")
+                updated_charts.append(dict(chart, chart_data=chart_data))
+            else:
+                logger.error(f"Failed to update chart {chart.doc_id}")
+        return updated_charts, remaining
+
+    async def _refresh_charts(self, project_id, charts, project_data):
+        """LLM responses for all charts, in order, with exceptions in place of failed ones
+
+        At most max_concurrency requests are in flight, so the wall time
+        approaches that of the slowest chart rather than the sum of all.
+        """
+        llm = self.openai_llm
+        limiter = llm_registry.rate_limiter(llm_registry.default)
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def refresh(chart):
+            async with semaphore:
+                await limiter.acquire()
+                logger.info(f"Updating chart {chart.doc_id} for project {project_id}")
+                prompt = self._create_update_prompt(chart)
+                return await llm.aget_ai_response(prompt, project_data)
+
+        return await asyncio.gather(*(refresh(chart) for chart in charts), return_exceptions=True)
+
+    def update_project_charts(self, project_id, changes=None):
+        """Update the saved charts of a project with new data
+
+        With ``changes`` ({file: {sheet: changed columns}}) only the charts
+        depending on one of those columns are updated, otherwise all of
+        them. Charts with a data_spec are recomputed directly from the project's
+        spreadsheets; only the others (or a spec that fails to evaluate)
+        go to the LLM.
+        """
         try:
             # Get all saved charts for the project
             charts = db.get_project_charts(project_id)
@@ -74,30 +133,42 @@ Please update the chart values while keeping all other properties unchanged.
                 logger.info(f"No charts found for project {project_id}")
                 return
 
-            # Get latest project data using Supabase
-            latest_data = supabase_manager.query(
-                project_id=project_id,
-                query_text="all project data",
-                top_k=50
-            )
+            if changes is not None:
+                # Dependencies of charts without a spec follow the project's current columns
+                file_schemas = db.get_file_schemas(project_id)
+                affected = [
+                    chart for chart in charts
+                    if chart_affected(
+                        chart['dependencies'] if chart.get('data_spec') and chart.get('dependencies')
+                        else chart_dependencies(chart, file_schemas),
+                        changes
+                    )
+                ]
+                logger.info(f"{len(affected)} of {len(charts)} charts of project {project_id} depend on the changed data")
+                charts = affected
+                if not charts:
+                    return []
+
+            updated_charts, charts = self._recompute_spec_charts(project_id, charts)
+            if not charts:
+                return updated_charts
+
+            # Latest project data, retrieved once per ingest and shared by every chart
+            project_data = project_context.get(project_id).text
 
-            # Combine all relevant data
-            project_data = "\n".join([doc['content'] for doc in latest_data])
+            # Ask the LLM about every chart at once, then save the results in this thread
+            responses = llm_registry.run(self._refresh_charts(project_id, charts, project_data))
 
-            updated_charts = []
-            for chart in charts:
+            for chart, response in zip(charts, responses):
                 try:
-                    logger.info(f"Updating chart {chart.doc_id} for project {project_id}")
-                    
-                    # Create prompt for this specific chart
-                    prompt = self._create_update_prompt(chart, project_data)
-                    response = self.openai_llm.get_ai_response(prompt, project_data)
-                    
+                    if isinstance(response, Exception):
+                        raise response
+
                     # Update chart with new values while maintaining structure
                     updated_chart = self._update_chart_values(chart, response)
                     
                     # Save the updated chart
-                    success = db.update_chart(project_id, chart.doc_id, updated_chart)
+                    success = db.set_chart_data(project_id, chart.doc_id, updated_chart['chart_data'])
                     
                     if success:
                         logger.info(f"Successfully updated chart {chart.doc_id}")
@@ -0,0 +1,145 @@
+"""Token-budgeted prompt context built from retrieved chunks
+
+Chunks produced by process_excel_to_text all repeat their file header and
+sheet header, and overlapping uploads repeat whole rows. The assembler
+takes the chunks best score first, drops rows that are near-duplicates of
+one already written under the same file and sheet, writes each header
+just before the first row kept under it and stops once the token budget
+is used up.
+"""
+import os
+import re
+import threading
+from logger import CustomLogger
+
+logger = CustomLogger('context_assembler')
+
+# Tokenizer of gpt-4o; token counts only need to be close for other models
+ENCODING_NAME = 'o200k_base'
+FILE_HEADER = re.compile(r'^(Quotation|Actual) File for Project: ')
+SHEET_PREFIX = 'Sheet: '
+COLUMNS_PREFIX = 'Columns: '
+# Default budget of the context sent with chat and predict questions
+DEFAULT_TOKEN_BUDGET = int(os.environ.get('LLM_CONTEXT_TOKENS', 8000))
+NUMBER = re.compile(r'(?<![\w.])-?\d+(?:\.\d+)?(?:e[+-]?\d+)?')
+INTEGER = re.compile(r'-?\d+')
+MIDNIGHT = re.compile(r' 00:00:00\b')
+
+_encoding = None
+_encoding_lock = threading.Lock()
+
+
+def _get_encoding():
+    """The tiktoken encoding, or False when it cannot be loaded (e.g. offline without a cached BPE file)"""
+    global _encoding
+    if _encoding is None:
+        with _encoding_lock:
+            if _encoding is None:
+                try:
+                    import tiktoken
+                    _encoding = tiktoken.get_encoding(ENCODING_NAME)
+                except Exception as e:
+                    logger.warning(f"tiktoken unavailable, estimating 4 characters per token: {str(e)}")
+                    _encoding = False
+    return _encoding
+
+
+def count_tokens(text):
+    encoding = _get_encoding()
+    if encoding:
+        return len(encoding.encode(text, disallowed_special=()))
+    return (len(text) + 3) // 4
+
+
+def _number_key(match):
+    """Integers as written; other numbers by float value, so 1200.0 and 1200 are equal"""
+    text = match.group()
+    if INTEGER.fullmatch(text):
+        return text
+    value = float(text)
+    return str(int(value)) if value.is_integer() and abs(value) < 2 ** 53 else repr(value)
+
+
+def row_key(row):
+    """Key shared by near-duplicate rows
+
+    Case and spacing are ignored, a midnight time on a date is dropped and
+    numbers only match when they are equal, so "Total Cost: 1200.0" and
+    "total cost: 1200" collide but invoices 1234567 and 1234568 do not.
+    """
+    row = MIDNIGHT.sub('', ' '.join(row.lower().split()))
+    return NUMBER.sub(_number_key, row)
+
+
+def assemble_context(results, token_budget=None):
+    """Pack retrieved results into at most ``token_budget`` tokens (default LLM_CONTEXT_TOKENS)
+
+    ``results`` are dicts with a 'content' key, taken in descending
+    'similarity' when they have one and in the given order otherwise.
+    The last result that fits only partly is cut at a line boundary.
+    Returns (text, tokens, results that contributed at least one row).
+    """
+    token_budget = token_budget or DEFAULT_TOKEN_BUDGET
+    results = sorted(results, key=lambda result: -(result.get('similarity') or 0.0))
+    lines = []
+    used = []
+    tokens = 0
+    seen_rows = set()  # (file header, sheet header, row key)
+    seen_columns = set()
+    written_file = written_sheet = None  # headers the rows written last belong to
+
+    def add(new_lines):
+        """Write the lines if all of them fit in the budget"""
+        nonlocal tokens
+        cost = sum(count_tokens(line) + 1 for line in new_lines)  # + the newline joining each line
+        if tokens + cost > token_budget:
+            return False
+        lines.extend(new_lines)
+        tokens += cost
+        return True
+
+    for result in results:
+        contributed = False
+        file_header = sheet_header = columns = None
+        for line in result['content'].split('\n'):
+            stripped = line.strip()
+            if not stripped:
+                continue
+            if FILE_HEADER.match(stripped):
+                file_header, sheet_header, columns = stripped, None, None
+                continue
+            if stripped.startswith(SHEET_PREFIX):
+                sheet_header, columns = stripped, None
+                continue
+            if stripped.startswith(COLUMNS_PREFIX):
+                columns = stripped
+                continue
+            key = (file_header, sheet_header, row_key(stripped))
+            if key in seen_rows:
+                continue
+
+            # Headers of the row, unless the previous row written shares them
+            headers = []
+            if file_header != written_file and file_header:
+                headers.append(file_header)
+            if (file_header != written_file or sheet_header != written_sheet) and sheet_header:
+                headers.append(sheet_header)
+            if columns and (file_header, sheet_header, columns) not in seen_columns:
+                headers.append(columns)
+            if not add(headers + [stripped]):
+                break
+            written_file, written_sheet = file_header, sheet_header
+            if columns:
+                seen_columns.add((file_header, sheet_header, columns))
+            seen_rows.add(key)
+            contributed = True
+        else:
+            if contributed:
+                used.append(result)
+            continue
+        # The budget ran out part-way through this result
+        if contributed:
+            used.append(result)
+        break
+
+    return '\n'.join(lines), tokens, used
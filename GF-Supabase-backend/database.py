@@ -1,33 +1,85 @@
-from tinydb import TinyDB, Query
+from tinydb import Query
 import os
+import time
 from datetime import datetime
 import json
 import logging
+import threading
 from logger import CustomLogger
+from indexed_table import IndexedTable
+from sqlite_table import SQLiteStore, migrate_json_file
+from file_manifest import FileManifest
 from error_handler import NotFoundError, ValidationError
 from werkzeug.security import check_password_hash, generate_password_hash
 
 logger = CustomLogger('database')
 
+# Table name -> (TinyDB file, indexed fields, indexed list fields)
+TABLES = {
+    'companies': ('companies.json', ['email', 'name'], []),
+    'users': ('users.json', ['email', 'company_id'], []),
+    'projects': ('projects.json', ['company_id', 'name'], ['assigned_users']),
+    'charts': ('charts.json', ['project_id', 'is_pinned'], []),
+    'prompts': ('prompts.json', ['project_id'], []),
+    'dashboard_layouts': ('dashboard_layouts.json', ['project_id'], []),
+    'jobs': ('jobs.json', ['status'], []),
+    'file_schemas': ('file_schemas.json', ['project_id', 'file_name'], []),
+}
+
 class Database:
     def __init__(self):
         logger.info("Initializing database")
-        # First initialize all TinyDB instances
-        self.companies_db = TinyDB('companies.json')
-        self.users_db = TinyDB('users.json')
-        self.projects_db = TinyDB('projects.json')
-        self.charts_db = TinyDB('charts.json')
-        self.prompts_db = TinyDB('prompts.json')
-        self.dashboard_layouts_db = TinyDB('dashboard_layouts.json')
+        # Storage engine: TinyDB JSON files (default) or a single SQLite file
+        self.backend = os.environ.get('DATABASE_BACKEND', 'tinydb').lower()
+        if self.backend == 'sqlite':
+            sqlite_path = os.environ.get('SQLITE_DB_PATH', 'greenfinance.db')
+            is_new = not os.path.exists(sqlite_path)
+            self.sqlite_store = SQLiteStore(sqlite_path)
+        elif self.backend == 'tinydb':
+            # First initialize/validate the database files
+            self._init_database_files()
+        else:
+            raise ValueError(f"Unknown database backend: {self.backend}")
         
-        # Then initialize/validate the database files
-        self._init_database_files()
+        # Then open every table with indexes on the fields we look up by
+        self.companies_db = self._open_table('companies')
+        self.users_db = self._open_table('users')
+        self.projects_db = self._open_table('projects')
+        self.charts_db = self._open_table('charts')
+        self.prompts_db = self._open_table('prompts')
+        self.dashboard_layouts_db = self._open_table('dashboard_layouts')
+        self.jobs_db = self._open_table('jobs')
+        self.file_schemas_db = self._open_table('file_schemas')
+        self._jobs_lock = threading.Lock()
+        self._file_manifests = {}  # Project folder -> FileManifest
+        self._file_manifests_lock = threading.Lock()
+        
+        if self.backend == 'sqlite' and is_new:
+            # One-shot import of the existing JSON files into a fresh SQLite database
+            self.migrate_json_files()
         
         # Finally, update user settings if needed
         self._init_user_settings()
         
         logger.info("Database initialization complete")
 
+    def _open_table(self, name):
+        filename, indexes, multi_indexes = TABLES[name]
+        if self.backend == 'sqlite':
+            return self.sqlite_store.table(name, indexes, multi_indexes)
+        # TinyDB tables are kept in memory with hash indexes
+        return IndexedTable(filename, indexes, multi_indexes)
+
+    def migrate_json_files(self, json_dir='.'):
+        """Copy the TinyDB JSON files into the empty SQLite tables, keeping document IDs"""
+        if self.backend != 'sqlite':
+            raise ValueError("Migration target must be the sqlite backend")
+        total = 0
+        for name, (filename, _, _) in TABLES.items():
+            total += migrate_json_file(os.path.join(json_dir, filename), getattr(self, f"{name}_db"))
+        logger.info(f"Migrated {total} documents into {self.sqlite_store.path}")
+        return total
+
     def _init_database_files(self):
         """Initialize database files with empty JSON if needed"""
         files = [
@@ -36,7 +88,9 @@ class Database:
             'projects.json',
             'charts.json',
             'prompts.json',
-            'dashboard_layouts.json'
+            'dashboard_layouts.json',
+            'jobs.json',
+            'file_schemas.json'
         ]
         
         for filename in files:
@@ -97,41 +151,34 @@ class Database:
             return None
 
     def get_company_projects(self, company_id):
-        Project = Query()
-        return self.projects_db.search(Project.company_id == company_id)
+        return self.projects_db.find(company_id=company_id)
 
     def get_user_projects(self, user_id):
-        Project = Query()
-        return self.projects_db.search(Project.assigned_users.any([user_id]))
+        return self.projects_db.find(assigned_users=user_id)
 
     def company_exists_by_email(self, email):
-        Company = Query()
-        return self.companies_db.contains(Company.email == email)
+        return bool(self.companies_db.find_ids(email=email))
 
     def company_exists_by_name(self, name):
-        Company = Query()
-        return self.companies_db.contains(Company.name == name)
+        return bool(self.companies_db.find_ids(name=name))
 
     def create_company(self, company_data):
         return self.companies_db.insert(company_data)
 
     def get_company_by_email(self, email):
-        Company = Query()
-        result = self.companies_db.get(Company.email == email)
+        result = self.companies_db.find_one(email=email)
         if result:
             result['id'] = result.doc_id  # Add the document ID to the result
         return result
 
     def user_exists_by_email(self, email):
-        User = Query()
-        return self.users_db.contains(User.email == email)
+        return bool(self.users_db.find_ids(email=email))
 
     def create_user(self, user_data):
         return self.users_db.insert(user_data)
 
     def get_user_by_email(self, email):
-        User = Query()
-        return self.users_db.get(User.email == email)
+        return self.users_db.find_one(email=email)
 
     def get_all_companies(self):
         return self.companies_db.all()
@@ -139,126 +186,51 @@ class Database:
     def create_project(self, project_data):
         return self.projects_db.insert(project_data)
 
+    def _get_file_manifest(self, project):
+        """Get the cached file manifest of a project folder"""
+        with self._file_manifests_lock:
+            manifest = self._file_manifests.get(project['path'])
+            if manifest is None:
+                manifest = self._file_manifests[project['path']] = FileManifest(project['path'])
+            return manifest
+
     def get_project_files(self, project_id):
         project = self.get_project(project_id)
         if not project or 'path' not in project:
             return []
+        return self._get_file_manifest(project).list_files()
 
-        metadata_path = os.path.join(project['path'], 'files_metadata')
-        metadata_file = os.path.join(metadata_path, 'files_metadata.json')
-        
-        # Load existing metadata
-        if os.path.exists(metadata_file):
-            with open(metadata_file, 'r') as f:
-                try:
-                    metadata = json.load(f)
-                except json.JSONDecodeError:
-                    print("\nError decoding metadata file")
-                    metadata = {}
-        else:
-            print("\nNo metadata file exists")
-            metadata = {}
-
-        files_list = []
-        file_id = 1
-
-        for root, dirs, files in os.walk(project['path']):
-            if 'RAG_cache' in root or 'files_metadata' in root:
-                continue
-
-            for file in files:
-                file_path = os.path.join(root, file)
-                file_stat = os.stat(file_path)
-                rel_path = os.path.relpath(root, project['path'])
-                
-                # Get the original filename from metadata or extract it
-                file_identifier = f"{rel_path}_{file}"
-                file_metadata = metadata.get(file_identifier, {})
-                
-                # Extract original filename by removing timestamp prefix
-                original_filename = file
-                if '_' in file and len(file.split('_', 1)) == 2:
-                    time_part, name_part = file.split('_', 1)
-                    if len(time_part) == 8 and time_part.replace('-', '').isdigit():
-                        original_filename = name_part
-
-                # Get the proper date from metadata or use file system date
-                date_added = file_metadata.get('dateAdded')
-                if not date_added:
-                    date_added = datetime.fromtimestamp(file_stat.st_ctime).strftime('%Y-%m-%d')
-
-                # Format the last updated date
-                last_updated = datetime.fromtimestamp(file_stat.st_mtime).strftime('%Y-%m-%d')
-
-                files_list.append({
-                    "id": file_id,
-                    "name": original_filename,  # Use the extracted original filename
-                    "path": file_path,
-                    "relative_path": rel_path,
-                    "addedBy": file_metadata.get('addedBy', 'System'),
-                    "dateAdded": date_added,
-                    "lastUpdated": last_updated,
-                    "size": file_stat.st_size
-                })
-                file_id += 1
-
-        return files_list
+    def add_project_file(self, project_id, file_path, added_by=None):
+        """Record a file saved into the project folder and return its file ID"""
+        project = self.get_project(project_id)
+        if not project or 'path' not in project:
+            return None
+        return self._get_file_manifest(project).add_file(file_path, added_by=added_by)
 
     def delete_project_file(self, project_id, file_id):
         project = self.get_project(project_id)
-        if not project:
+        if not project or 'path' not in project:
             return False
 
-        files = self.get_project_files(project_id)
-        file_to_delete = next((f for f in files if f['id'] == file_id), None)
-        
-        if not file_to_delete:
-            return False
-        
         try:
-            # Delete the actual file
-            if os.path.exists(file_to_delete['path']):
-                os.remove(file_to_delete['path'])
-                
-            # Delete metadata entry
-            metadata_path = os.path.join(project['path'], 'files_metadata')
-            metadata_file = os.path.join(metadata_path, 'files_metadata.json')
-            
-            if os.path.exists(metadata_file):
-                with open(metadata_file, 'r') as f:
-                    try:
-                        metadata = json.load(f)
-                    except json.JSONDecodeError:
-                        metadata = {}
-                        
-                # Create the file identifier
-                file_identifier = f"{file_to_delete['relative_path']}_{file_to_delete['name']}"
-                
-                # Remove the file's metadata if it exists
-                if file_identifier in metadata:
-                    del metadata[file_identifier]
-                    
-                # Save updated metadata
-                with open(metadata_file, 'w') as f:
-                    json.dump(metadata, f, indent=4)
-                    
-            # Clean up empty directories
-            dir_path = os.path.dirname(file_to_delete['path'])
-            if os.path.exists(dir_path) and not os.listdir(dir_path):
-                try:
-                    os.rmdir(dir_path)
-                except OSError:
-                    pass  # Ignore if directory cannot be removed
-                
-            return True
-            
+            # Deletes the file, its metadata and the directory if left empty
+            return self._get_file_manifest(project).remove_file(int(file_id)) is not None
         except (OSError, IOError) as e:
             logging.error(f"Error deleting file: {str(e)}")
             return False
 
     def get_project_file(self, project_id, file_id):
-        files = self.get_project_files(project_id)
-        return next((f for f in files if f['id'] == file_id), None)
+        project = self.get_project(project_id)
+        if not project or 'path' not in project:
+            return None
+        return self._get_file_manifest(project).get_file(int(file_id))
+
+    def find_project_file_by_name(self, project_id, name):
+        """Get the first project file with the given original file name"""
+        project = self.get_project(project_id)
+        if not project or 'path' not in project:
+            return None
+        return self._get_file_manifest(project).find_by_name(name)
 
     def save_file_metadata(self, project_id, file_info):
         logger.info(f"Saving file metadata for project {project_id}", {
@@ -272,42 +244,13 @@ class Database:
                 logger.error(f"Project not found: {project_id}")
                 return False
 
-            metadata_path = os.path.join(project['path'], 'files_metadata')
-            metadata_file = os.path.join(metadata_path, 'files_metadata.json')
-            
-            os.makedirs(metadata_path, exist_ok=True)
-            
-            # Load existing metadata
-            if os.path.exists(metadata_file):
-                with open(metadata_file, 'r') as f:
-                    try:
-                        metadata = json.load(f)
-                    except json.JSONDecodeError:
-                        metadata = {}
-            else:
-                metadata = {}
-            
-            # Create a unique identifier for the file
-            file_identifier = f"{file_info['relative_path']}_{file_info['name']}"
-            
-            # If this is an update, remove the old metadata entry
-            if file_info.get('isUpdate'):
-                original_name = file_info['name'].split('_', 1)[1] if '_' in file_info['name'] else file_info['name']
-                old_entries = [k for k in metadata.keys() 
-                              if k.endswith(original_name) and k != file_identifier]
-                for old_entry in old_entries:
-                    metadata.pop(old_entry, None)
-            
-            # Store metadata with all necessary information
-            metadata[file_identifier] = {
-                "dateAdded": file_info['dateAdded'],
-                "addedBy": file_info['addedBy'],
-                "originalName": file_info['name']
-            }
-            
-            # Save updated metadata
-            with open(metadata_file, 'w') as f:
-                json.dump(metadata, f, indent=4)
+            # An update overwrites the file in place, so it keeps its entry and ID
+            file_path = os.path.join(project['path'], file_info['relative_path'], file_info['name'])
+            self._get_file_manifest(project).add_file(
+                file_path,
+                added_by=file_info['addedBy'],
+                date_added=file_info['dateAdded']
+            )
             
             logger.info("File metadata saved successfully")
             return True
@@ -319,9 +262,30 @@ class Database:
             })
             return False
 
+    def get_file_schemas(self, project_id):
+        """Sheets and column fingerprints of every ingested file of a project"""
+        return self.file_schemas_db.find(project_id=project_id)
+
+    def save_file_schema(self, project_id, file_name, sheets):
+        """Record the {sheet: {column: fingerprint}} of an ingested file, returning the previous one or None"""
+        previous = self.file_schemas_db.find_one(project_id=project_id, file_name=file_name)
+        if previous:
+            self.file_schemas_db.update({'sheets': sheets}, doc_ids=[previous.doc_id])
+            return previous['sheets']
+        self.file_schemas_db.insert({'project_id': project_id, 'file_name': file_name, 'sheets': sheets})
+        return None
+
+    def delete_file_schema(self, project_id, file_name):
+        """Forget a deleted file's schema, returning it or None"""
+        previous = self.file_schemas_db.find_one(project_id=project_id, file_name=file_name)
+        if not previous:
+            return None
+        self.file_schemas_db.remove(doc_ids=[previous.doc_id])
+        return previous['sheets']
+
     def create_charts_table(self):
         """Initialize the charts table in the database"""
-        self.charts_db = TinyDB('charts.json')
+        self.charts_db = self._open_table('charts')
 
     def save_chart(self, project_id, chart_data):
         """Save a chart for a project"""
@@ -335,6 +299,10 @@ class Database:
                 'created_by': chart_data.get('created_by'),
                 'is_pinned': False  # Add default value for is_pinned
             }
+            if chart_data.get('data_spec'):
+                chart['data_spec'] = chart_data['data_spec']
+            if chart_data.get('dependencies'):
+                chart['dependencies'] = chart_data['dependencies']
             chart_id = self.charts_db.insert(chart)
             return chart_id
         except Exception as e:
@@ -344,20 +312,24 @@ class Database:
     def get_project_charts(self, project_id):
         """Get all charts for a project"""
         try:
-            Chart = Query()
-            charts = self.charts_db.search(Chart.project_id == project_id)
-            return charts
+            return self.charts_db.find(project_id=project_id)
         except Exception as e:
             logger.error(f"Error retrieving charts: {str(e)}")
             return []
 
+    def get_chart(self, project_id, chart_id):
+        """Get one chart of a project, or None"""
+        chart = self.charts_db.get(doc_id=int(chart_id))
+        if chart and chart.get('project_id') == project_id:
+            return chart
+        return None
+
     def delete_chart(self, project_id, chart_id):
         """Delete a chart from a project"""
         try:
-            Chart = Query()
             self.charts_db.remove(
-                (Chart.doc_id == chart_id) & 
-                (Chart.project_id == project_id)
+                Query().project_id == project_id,
+                doc_ids=[int(chart_id)]
             )
             return True
         except Exception as e:
@@ -419,6 +391,23 @@ class Database:
             logger.error(f"Error updating chart: {str(e)}")
             return False
 
+    def set_chart_data(self, project_id, chart_id, chart_data, **fields):
+        """Replace a chart's chart_data (and any other given fields) as one update"""
+        try:
+            existing_chart = self.charts_db.get(doc_id=int(chart_id))
+            if not existing_chart or existing_chart.get('project_id') != project_id:
+                logger.error(f"Chart {chart_id} not found in project {project_id}")
+                return False
+
+            self.charts_db.update(
+                dict(fields, chart_data=chart_data, last_updated=datetime.now().isoformat()),
+                doc_ids=[int(chart_id)]
+            )
+            return True
+        except Exception as e:
+            logger.error(f"Error updating chart: {str(e)}")
+            return False
+
     def verify_chart_update(self, project_id, chart_id, expected_values):
         """Verify that the chart was updated correctly"""
         try:
@@ -473,10 +462,10 @@ class Database:
     def unpin_chart(self, project_id, chart_id):
         """Unpin a chart from the project dashboard"""
         try:
-            Chart = Query()
             self.charts_db.update(
                 {'is_pinned': False},
-                (Chart.doc_id == chart_id) & (Chart.project_id == project_id)
+                Query().project_id == project_id,
+                doc_ids=[int(chart_id)]
             )
             return True
         except Exception as e:
@@ -486,11 +475,7 @@ class Database:
     def get_pinned_charts(self, project_id):
         """Get all pinned charts for a project"""
         try:
-            Chart = Query()
-            return self.charts_db.search(
-                (Chart.project_id == project_id) & 
-                (Chart.is_pinned == True)
-            )
+            return self.charts_db.find(project_id=project_id, is_pinned=True)
         except Exception as e:
             logger.error(f"Error retrieving pinned charts: {str(e)}")
             return []
@@ -533,8 +518,7 @@ class Database:
     def get_dashboard_layouts(self, project_id):
         """Get all dashboard layouts with full chart data"""
         try:
-            Layout = Query()
-            layouts = self.dashboard_layouts_db.search(Layout.project_id == project_id)
+            layouts = self.dashboard_layouts_db.find(project_id=project_id)
             
             formatted_layouts = []
             for layout in layouts:
@@ -748,8 +732,7 @@ class Database:
     def get_project_prompts(self, project_id):
         """Get all prompts for a project"""
         try:
-            Prompt = Query()
-            prompts = self.prompts_db.search(Prompt.project_id == project_id)
+            prompts = self.prompts_db.find(project_id=project_id)
             return [dict(prompt, id=prompt.doc_id) for prompt in prompts]
             
         except Exception as e:
@@ -759,10 +742,9 @@ class Database:
     def delete_prompt(self, project_id, prompt_id):
         """Delete a prompt from a project"""
         try:
-            Prompt = Query()
             result = self.prompts_db.remove(
-                (Prompt.doc_id == prompt_id) & 
-                (Prompt.project_id == project_id)
+                Query().project_id == project_id,
+                doc_ids=[int(prompt_id)]
             )
             return bool(result)
             
@@ -770,4 +752,89 @@ class Database:
             logger.error(f"Error deleting prompt: {str(e)}")
             return False
 
+    def create_job(self, job_data):
+        """Persist a new background job and return its ID"""
+        with self._jobs_lock:
+            now = datetime.now().isoformat()
+            job = dict(job_data, created_at=now, updated_at=now)
+            return self.jobs_db.insert(job)
+
+    def get_job(self, job_id):
+        """Get a background job by ID"""
+        with self._jobs_lock:
+            job = self.jobs_db.get(doc_id=int(job_id))
+            return dict(job, id=job.doc_id) if job else None
+
+    def update_job(self, job_id, fields):
+        """Update top-level fields of a background job"""
+        with self._jobs_lock:
+            self.jobs_db.update(
+                dict(fields, updated_at=datetime.now().isoformat()),
+                doc_ids=[int(job_id)]
+            )
+
+    def update_job_stage(self, job_id, stage, fields):
+        """Update the progress record of a single job stage"""
+        def apply(job):
+            job['stages'].setdefault(stage, {}).update(fields)
+            job['updated_at'] = datetime.now().isoformat()
+
+        with self._jobs_lock:
+            self.jobs_db.update(apply, doc_ids=[int(job_id)])
+
+    def get_incomplete_jobs(self):
+        """Get jobs that were queued or running, oldest first"""
+        with self._jobs_lock:
+            jobs = self.jobs_db.find(status='queued') + self.jobs_db.find(status='running')
+            return [dict(job, id=job.doc_id) for job in sorted(jobs, key=lambda job: job.doc_id)]
+
+    def claim_job(self, job_id, owner, lease_seconds, fields=None):
+        """Take over a queued or running job whose lease has expired
+
+        The check and the update run as one write, so of several processes
+        claiming the same job only one succeeds. Returns whether it was claimed.
+        """
+        claimed = []
+
+        def apply(job):
+            now = time.time()
+            if job.get('status') not in ('queued', 'running') or (job.get('lease_expires_at') or 0) > now:
+                return
+            job.update(fields or {})
+            job['owner'] = owner
+            job['lease_expires_at'] = now + lease_seconds
+            job['updated_at'] = datetime.now().isoformat()
+            claimed.append(job_id)
+
+        with self._jobs_lock:
+            self.jobs_db.update(apply, doc_ids=[int(job_id)])
+        return bool(claimed)
+
+    def renew_job_lease(self, job_id, owner, lease_seconds):
+        """Extend the lease of a queued or running job still held by owner, returning whether it is"""
+        renewed = []
+
+        def apply(job):
+            if job.get('owner') == owner and job.get('status') in ('queued', 'running'):
+                job['lease_expires_at'] = time.time() + lease_seconds
+                renewed.append(job_id)
+
+        with self._jobs_lock:
+            self.jobs_db.update(apply, doc_ids=[int(job_id)])
+        return bool(renewed)
+
+    def prune_jobs(self, before):
+        """Delete completed and failed jobs last updated before an ISO timestamp, returning how many"""
+        with self._jobs_lock:
+            jobs = self.jobs_db.find(status='completed') + self.jobs_db.find(status='failed')
+            ids = [job.doc_id for job in jobs if job.get('updated_at', '') < before]
+            if ids:
+                self.jobs_db.remove(doc_ids=ids)
+            return len(ids)
+
 db = Database()
+
+if __name__ == '__main__':
+    # Usage: DATABASE_BACKEND=sqlite SQLITE_DB_PATH=greenfinance.db python database.py
+    # Migrates the JSON files in the current directory if the tables are still empty
+    db.migrate_json_files()
@@ -0,0 +1,289 @@
+import os
+import re
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+from filelock import FileLock
+from logger import CustomLogger
+
+logger = CustomLogger('embedding_cache')
+
+INDEX_VERSION = 2
+KEY_BYTES = 32  # sha256 digest of the text, stored beside each slot
+
+
+class EmbeddingCache:
+    """LRU cache of embeddings kept on disk
+
+    Vectors live in a memory-mapped float32 matrix with one row per slot,
+    and a second memory-mapped array holds the sha256 of the text cached in
+    each slot, checked on every read so a slot reused by another process is
+    never served for the wrong text. Which key sits in which slot, in LRU
+    order, is recorded in a JSON snapshot plus an append-only journal of
+    [key, slot] lines: puts and hits append a line each instead of
+    rewriting the whole index, and the journal is folded back into the
+    snapshot once it grows past ``max_entries`` lines. Once ``max_entries``
+    slots are used the least recently used entry is evicted and its slot
+    reused.
+
+    Every change to the files holds embeddings_<model>.json.lock, and the
+    index is reloaded when another process changed the snapshot or
+    journal, so several server processes can share a project's cache.
+    """
+
+    def __init__(self, cache_dir: str, model_name: str, dim: int, max_entries: int = None):
+        self.model_name = model_name
+        self.dim = dim
+        self.max_entries = max_entries or int(os.environ.get('EMBEDDING_CACHE_MAX_ENTRIES', 10000))
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(cache_dir, exist_ok=True)
+        file_stem = re.sub(r'[^A-Za-z0-9_.-]', '_', model_name)
+        self.matrix_path = os.path.join(cache_dir, f"embeddings_{file_stem}.f32")
+        self.keys_path = os.path.join(cache_dir, f"embeddings_{file_stem}.keys")
+        self.index_path = os.path.join(cache_dir, f"embeddings_{file_stem}.json")
+        self.journal_path = os.path.join(cache_dir, f"embeddings_{file_stem}.log")
+        self._file_lock = FileLock(f"{self.index_path}.lock")
+
+        self._entries = OrderedDict()  # key -> slot, least recently used first
+        self._slots = {}  # slot -> key
+        self._free = set()
+        self._index_mtime = None
+        self._journal_offset = 0
+        self._journal_lines = 0
+        self._matrix = None
+        self._keys = None
+        self._matrix_inode = None
+
+        with self._file_lock:
+            if not self._load():
+                self._create()
+                self._load()
+
+    def _create(self):
+        """Start an empty cache, replacing files that are missing or made with other settings
+
+        New files are swapped in with os.replace, so processes still mapping
+        the old ones keep reading valid (if stale) memory until they reload.
+        """
+        for path, dtype, width in ((self.matrix_path, np.float32, self.dim), (self.keys_path, np.uint8, KEY_BYTES)):
+            tmp_path = f"{path}.tmp"
+            np.memmap(tmp_path, dtype=dtype, mode='w+', shape=(self.max_entries, width)).flush()
+            os.replace(tmp_path, path)
+        open(self.journal_path, 'w').close()
+        self._write_snapshot([])
+
+    def _write_snapshot(self, entries):
+        tmp_path = f"{self.index_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({
+                'version': INDEX_VERSION,
+                'model': self.model_name,
+                'dim': self.dim,
+                'capacity': self.max_entries,
+                'entries': entries
+            }, f)
+        os.replace(tmp_path, self.index_path)
+
+    def _load(self):
+        """Load the snapshot and replay the journal, returning False if they are missing or incompatible
+
+        Called with the file lock held.
+        """
+        expected_sizes = {
+            self.matrix_path: self.max_entries * self.dim * 4,
+            self.keys_path: self.max_entries * KEY_BYTES,
+        }
+        try:
+            if any(os.path.getsize(path) != size for path, size in expected_sizes.items()):
+                logger.info(f"Embedding cache {self.index_path} does not match current settings, rebuilding")
+                return False
+            index_mtime = os.stat(self.index_path).st_mtime_ns
+            with open(self.index_path, 'r') as f:
+                index = json.load(f)
+        except FileNotFoundError:
+            return False
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning(f"Discarding unreadable embedding cache index {self.index_path}: {str(e)}")
+            return False
+        if (index.get('version') != INDEX_VERSION or index.get('model') != self.model_name
+                or index.get('dim') != self.dim or index.get('capacity') != self.max_entries):
+            logger.info(f"Embedding cache {self.index_path} does not match current settings, rebuilding")
+            return False
+
+        self._entries.clear()
+        self._slots.clear()
+        self._free = set(range(self.max_entries))
+        for key, slot in index.get('entries', []):
+            self._assign(key, slot)
+        self._index_mtime = index_mtime
+        self._journal_offset = 0
+        self._journal_lines = 0
+        self._replay_journal()
+        self._map_files()
+        return True
+
+    def _map_files(self):
+        """Memory-map the matrix and key files, again if another process replaced them"""
+        matrix_inode = os.stat(self.matrix_path).st_ino
+        if matrix_inode != self._matrix_inode:
+            self._matrix = np.memmap(self.matrix_path, dtype=np.float32, mode='r+',
+                                     shape=(self.max_entries, self.dim))
+            self._keys = np.memmap(self.keys_path, dtype=np.uint8, mode='r+', shape=(self.max_entries, KEY_BYTES))
+            self._matrix_inode = matrix_inode
+
+    def _replay_journal(self):
+        """Apply the journal lines appended since the last read"""
+        try:
+            with open(self.journal_path, 'rb') as f:
+                f.seek(self._journal_offset)
+                data = f.read()
+        except FileNotFoundError:
+            return
+        # A line still being written by another process is picked up next time
+        end = data.rfind(b'\n') + 1
+        for line in data[:end].splitlines():
+            try:
+                key, slot = json.loads(line)
+            except (ValueError, TypeError):
+                continue
+            if 0 <= slot < self.max_entries:
+                self._assign(key, slot)
+            self._journal_lines += 1
+        self._journal_offset += end
+
+    def _assign(self, key, slot):
+        """Record key as held in slot and as the most recently used entry"""
+        previous_key = self._slots.get(slot)
+        if previous_key is not None and previous_key != key:
+            del self._entries[previous_key]
+        previous_slot = self._entries.pop(key, None)
+        if previous_slot is not None and previous_slot != slot:
+            del self._slots[previous_slot]
+            self._free.add(previous_slot)
+        self._entries[key] = slot
+        self._slots[slot] = key
+        self._free.discard(slot)
+
+    def _refresh(self):
+        """Catch up with changes other processes made to the index files"""
+        try:
+            index_mtime = os.stat(self.index_path).st_mtime_ns
+            journal_size = os.path.getsize(self.journal_path)
+        except FileNotFoundError:
+            index_mtime, journal_size = None, 0
+        if index_mtime == self._index_mtime and journal_size == self._journal_offset:
+            return
+        with self._file_lock:
+            self._refresh_locked()
+
+    def _refresh_locked(self):
+        try:
+            index_mtime = os.stat(self.index_path).st_mtime_ns
+            journal_size = os.path.getsize(self.journal_path)
+        except FileNotFoundError:
+            index_mtime, journal_size = None, 0
+        if index_mtime != self._index_mtime or journal_size < self._journal_offset:
+            # The journal was compacted into a new snapshot, or the cache rebuilt
+            if not self._load():
+                self._create()
+                self._load()
+        elif journal_size > self._journal_offset:
+            self._replay_journal()
+
+    def _append(self, assignments):
+        """Persist (key, slot) assignments to the journal, compacting it when it gets long
+
+        Called with the file lock held, right after _refresh_locked.
+        """
+        lines = ''.join(json.dumps([key, slot]) + '\n' for key, slot in assignments).encode('utf-8')
+        with open(self.journal_path, 'ab') as f:
+            f.write(lines)
+        self._journal_offset += len(lines)
+        self._journal_lines += len(assignments)
+        if self._journal_lines > self.max_entries:
+            self._write_snapshot(list(self._entries.items()))
+            open(self.journal_path, 'w').close()
+            self._index_mtime = os.stat(self.index_path).st_mtime_ns
+            self._journal_offset = 0
+            self._journal_lines = 0
+
+    def key(self, text: str) -> str:
+        return f"{self.model_name}:{hashlib.sha256(text.encode('utf-8')).hexdigest()}"
+
+    def _digest(self, key):
+        return np.frombuffer(bytes.fromhex(key.rsplit(':', 1)[1]), dtype=np.uint8)
+
+    def get_many(self, texts):
+        """Return the cached vector for each text, or None where it is not cached"""
+        with self._lock:
+            self._refresh()
+            results = []
+            used = []
+            for text in texts:
+                key = self.key(text)
+                slot = self._entries.get(key)
+                vector = None
+                if slot is not None:
+                    digest = self._digest(key)
+                    # Checked around the copy: a writer clears the slot's key before overwriting it
+                    if np.array_equal(self._keys[slot], digest):
+                        vector = np.array(self._matrix[slot])
+                        if not np.array_equal(self._keys[slot], digest):
+                            vector = None
+                if vector is None:
+                    self.misses += 1
+                else:
+                    self.hits += 1
+                    used.append(key)
+                results.append(vector)
+
+            if used:
+                with self._file_lock:
+                    self._refresh_locked()
+                    touched = [(key, self._entries[key]) for key in used if key in self._entries]
+                    for key, slot in touched:
+                        self._entries.move_to_end(key)
+                    self._append(touched)
+            return results
+
+    def get(self, text: str):
+        return self.get_many([text])[0]
+
+    def put_many(self, texts, vectors):
+        """Store vectors for texts, evicting least recently used entries as needed"""
+        with self._lock, self._file_lock:
+            self._refresh_locked()
+            assignments = []
+            for text, vector in zip(texts, vectors):
+                key = self.key(text)
+                slot = self._entries.get(key)
+                if slot is None:
+                    slot = self._free.pop() if self._free else next(iter(self._entries.values()))
+                self._keys[slot] = 0
+                self._matrix[slot] = np.asarray(vector, dtype=np.float32)
+                self._keys[slot] = self._digest(key)
+                self._assign(key, slot)
+                assignments.append((key, slot))
+            if assignments:
+                self._matrix.flush()
+                self._keys.flush()
+                self._append(assignments)
+
+    def put(self, text: str, vector):
+        self.put_many([text], [vector])
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'capacity': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0
+            }
@@ -0,0 +1,284 @@
+import csv
+import datetime
+import hashlib
+import re
+from itertools import islice
+import numpy as np
+import pandas as pd
+import openpyxl
+from logger import CustomLogger
+
+logger = CustomLogger('excel_reader')
+
+DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+ROW_BLOCK_SIZE = 5000
+
+# pd.read_excel's default na_values, plus the Excel error codes openpyxl
+# returns as text in read-only mode (pandas reads error cells as NaN)
+NA_VALUES = frozenset([
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+    '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null',
+    '#NULL!', '#DIV/0!', '#VALUE!', '#REF!', '#NAME?', '#NUM!',
+])
+TRUE_VALUES = frozenset(['True', 'TRUE', 'true'])
+FALSE_VALUES = frozenset(['False', 'FALSE', 'false'])
+INT_PATTERN = re.compile(r'\s*[+-]?\d+\s*')
+
+
+def _is_blank(value):
+    return value is None or value == ''
+
+
+def _column_names(header_row):
+    """Build column names from the header row the same way pandas does"""
+    names = []
+    seen = {}
+    for index, value in enumerate(header_row):
+        name = f"Unnamed: {index}" if _is_blank(value) else str(value)
+        # Mangle duplicate names as "name.1", "name.2", ... like pd.read_excel
+        if name in seen:
+            seen[name] += 1
+            candidate = f"{name}.{seen[name]}"
+            while candidate in seen:
+                seen[name] += 1
+                candidate = f"{name}.{seen[name]}"
+            seen[candidate] = 0
+            name = candidate
+        else:
+            seen[name] = 0
+        names.append(name)
+    return names
+
+
+def _cell_value(value):
+    """A cell as pd.read_excel sees it: None for empty or NA cells, whole floats as int"""
+    if value is None or (isinstance(value, str) and value in NA_VALUES):
+        return None
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def _cell_class(value):
+    """Which column dtypes a non-empty cell value is compatible with"""
+    if isinstance(value, bool):
+        return 'bool'
+    if isinstance(value, int):
+        return 'int'
+    if isinstance(value, float):
+        return 'float'
+    if isinstance(value, datetime.datetime):
+        return 'datetime'
+    if isinstance(value, str):
+        if value in TRUE_VALUES or value in FALSE_VALUES:
+            return 'boolstr'
+        if '_' not in value:
+            try:
+                float(value)
+            except ValueError:
+                return 'object'
+            return 'int' if INT_PATTERN.fullmatch(value) else 'float'
+    return 'object'
+
+
+def _column_kind(classes, has_blanks):
+    """The dtype pd.read_excel infers for a column, from the classes of its cells"""
+    if not classes:
+        return 'float'
+    if classes <= {'int', 'float', 'bool'}:
+        if classes == {'bool'} and not has_blanks:
+            return 'bool'
+        return 'float' if has_blanks or 'float' in classes else 'int'
+    if classes <= {'bool', 'boolstr'} and not has_blanks:
+        return 'bool'
+    if classes == {'datetime'}:
+        return 'datetime'
+    return 'object'
+
+
+def _convert_cell(value, kind):
+    """Convert a raw cell to the value pandas holds for it in a column of this kind"""
+    value = _cell_value(value)
+    if value is None or kind == 'object' or kind == 'datetime':
+        return value
+    if kind == 'int':
+        return int(value)
+    if kind == 'float':
+        return float(value)
+    return value if isinstance(value, bool) else value in TRUE_VALUES
+
+
+def _scan_sheet(worksheet):
+    """Measure a sheet without keeping any of it
+
+    Returns (header_row, kinds, row_count): the first row, the inferred kind
+    of every column and the number of data rows up to the last non-blank one.
+    The column count is the widest row once trailing blank cells are dropped
+    and each kind is one of 'int', 'float', 'bool', 'datetime' or 'object',
+    the dtypes pd.read_excel would give the columns.
+    """
+    header_row = None
+    width = 0
+    row_count = 0
+    classes = []
+    filled = []
+    for index, row in enumerate(worksheet.iter_rows(values_only=True)):
+        if index == 0:
+            header_row = row
+        row_width = len(row)
+        while row_width and _is_blank(row[row_width - 1]):
+            row_width -= 1
+        if not row_width:
+            continue
+        width = max(width, row_width)
+        if not index:
+            continue
+        row_count = index
+        if len(classes) < row_width:
+            classes.extend(set() for _ in range(row_width - len(classes)))
+            filled.extend(0 for _ in range(row_width - len(filled)))
+        for column, value in enumerate(row[:row_width]):
+            value = _cell_value(value)
+            if value is not None:
+                classes[column].add(_cell_class(value))
+                filled[column] += 1
+    classes.extend(set() for _ in range(width - len(classes)))
+    filled.extend(0 for _ in range(width - len(filled)))
+    kinds = [_column_kind(column_classes, count < row_count) for column_classes, count in zip(classes, filled)]
+    return header_row, kinds, row_count
+
+
+def iter_sheet_rows(file_path):
+    """Stream every sheet of a workbook
+
+    Yields (sheet_name, columns, kinds, rows) for each sheet that has at
+    least one data row. Each sheet is read twice from openpyxl in read-only
+    mode: a scan that finds the column count, the column kinds and the last
+    data row, then ``rows``, a generator of row tuples padded to that width
+    with every cell converted for its column's kind (None for empty cells).
+    Blank rows between data rows are kept and a blank header row gives
+    "Unnamed: <i>" columns, matching pd.read_excel, and no sheet is
+    materialised in memory. Each ``rows`` generator must be consumed before
+    advancing to the next sheet.
+    """
+    workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        for worksheet in workbook.worksheets:
+            header_row, kinds, row_count = _scan_sheet(worksheet)
+            if not row_count:
+                logger.info(f"Sheet {worksheet.title} in {file_path} has no data rows. Skipping.")
+                continue
+            width = len(kinds)
+            columns = _column_names((header_row + (None,) * width)[:width])
+
+            def rows(worksheet=worksheet, kinds=kinds, row_count=row_count):
+                padding = (None,) * len(kinds)
+                row_iter = worksheet.iter_rows(values_only=True)
+                for row in islice(row_iter, 1, row_count + 1):
+                    yield tuple(_convert_cell(value, kind) for value, kind in zip(row + padding, kinds))
+
+            yield worksheet.title, columns, kinds, rows()
+    finally:
+        workbook.close()
+
+
+def iter_row_blocks(rows, block_size=ROW_BLOCK_SIZE):
+    """Group a row stream into lists of at most block_size rows"""
+    rows = iter(rows)
+    while True:
+        block = list(islice(rows, block_size))
+        if not block:
+            return
+        yield block
+
+
+class ColumnFingerprints:
+    """Running content hash of every column of a sheet
+
+    Fed the same row blocks as the chunker, so a changed, added or
+    removed column can be told apart from one that is byte-for-byte the
+    same as in the previous upload.
+    """
+
+    def __init__(self, columns):
+        self.columns = columns
+        self._hashes = [hashlib.blake2b(digest_size=16) for _ in columns]
+
+    def update(self, block):
+        for index, column_hash in enumerate(self._hashes):
+            column_hash.update(repr([row[index] for row in block]).encode('utf-8'))
+
+    def digest(self):
+        return {column: column_hash.hexdigest() for column, column_hash in zip(self.columns, self._hashes)}
+
+
+def csv_fingerprints(file_path):
+    """Column fingerprints of a CSV file, under the unnamed sheet ''"""
+    with open(file_path, 'r', newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if not header:
+            return {}
+        columns = _column_names(header)
+        fingerprints = ColumnFingerprints(columns)
+        padding = [''] * len(columns)
+        for block in iter_row_blocks(reader):
+            fingerprints.update([(row + padding)[:len(columns)] for row in block])
+    return {'': fingerprints.digest()}
+
+
+def _format_column(values, kind, numeric_frame):
+    """Format a whole column at once
+
+    Returns an object array holding the formatted text of every cell, or None
+    for empty cells, the way the old pd.read_excel/iterrows loop printed it.
+    iterrows hands out rows of the frame's common dtype, so when every column
+    is numeric all cells print with %g, and otherwise each value prints with
+    str() except datetime columns, which are strftime'd.
+    """
+    values = np.array(values, dtype=object)
+    formatted = np.full(len(values), None, dtype=object)
+    mask = np.array([value is not None for value in values], dtype=bool)
+    present = values[mask]
+    if not len(present):
+        return formatted
+    if numeric_frame:
+        formatted[mask] = np.char.mod('%g', present.astype(float)).astype(object)
+    elif kind == 'datetime':
+        formatted[mask] = pd.DatetimeIndex(present).strftime(DATETIME_FORMAT).to_numpy(dtype=object)
+    else:
+        formatted[mask] = [str(value) for value in present]
+    return formatted
+
+
+def is_chunk_boundary(row_string, mean_chars):
+    """Whether a content-defined chunk ends after this row
+
+    The decision depends only on the row's text, with a probability
+    proportional to its length, so on average a boundary follows every
+    ``mean_chars`` characters and inserting a row moves no boundary but
+    those next to it.
+    """
+    digest = hashlib.blake2b(row_string.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') < len(row_string) / mean_chars * 2 ** 64
+
+
+def serialize_rows(columns, kinds, rows):
+    """Serialize rows to "col: value | col: value" text, one column at a time
+
+    Each column is formatted once (datetime columns with strftime, numeric
+    frames with a vectorized %g, empty masks computed once per column) and
+    the formatted columns are then joined row-wise, skipping empty cells.
+    """
+    numeric_frame = all(kind in ('int', 'float') for kind in kinds)
+    labelled_columns = []
+    for index, (col, kind) in enumerate(zip(columns, kinds)):
+        formatted = _format_column([row[index] for row in rows], kind, numeric_frame)
+        present = ~pd.isna(formatted)
+        labelled = np.full(len(formatted), None, dtype=object)
+        labelled[present] = np.char.add(f"{col}: ", formatted[present].astype(str)).astype(object)
+        labelled_columns.append(labelled)
+    return [
+        " | ".join([part for part in parts if part is not None])
+        for parts in zip(*labelled_columns)
+    ]
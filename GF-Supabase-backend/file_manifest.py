@@ -0,0 +1,284 @@
+import os
+import json
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from filelock import FileLock
+from logger import CustomLogger
+
+logger = CustomLogger('file_manifest')
+
+MANIFEST_DIR = 'files_metadata'
+MANIFEST_FILE = 'manifest.json'
+LEGACY_METADATA_FILE = 'files_metadata.json'
+SKIPPED_DIRS = ('RAG_cache', 'files_metadata')
+
+
+def original_filename(stored_name):
+    """Strip the "HH-MM-SS_" prefix added to uploaded actuals files"""
+    if '_' in stored_name and len(stored_name.split('_', 1)) == 2:
+        time_part, name_part = stored_name.split('_', 1)
+        if len(time_part) == 8 and time_part.replace('-', '').isdigit():
+            return name_part
+    return stored_name
+
+
+class FileManifest:
+    """Persistent listing of the files in a project folder
+
+    Kept in files_metadata/manifest.json with a stable, monotonically
+    increasing ID per file. Uploads and deletes update it incrementally; to
+    catch anything changed behind its back it records the mtime of every
+    directory and only rescans directories whose mtime moved, so listing a
+    project costs one stat per directory instead of one per file.
+
+    Every read-modify-write of the manifest holds manifest.json.lock, so
+    several server processes can share a project without losing entries.
+    """
+
+    def __init__(self, project_path):
+        self.project_path = project_path
+        self.manifest_path = os.path.join(project_path, MANIFEST_DIR, MANIFEST_FILE)
+        self._lock = threading.RLock()
+        self._file_lock = FileLock(f"{self.manifest_path}.lock")
+        self._next_id = 1
+        self._files = {}  # file ID -> entry
+        self._paths = {}  # "relative_path/file" -> file ID
+        self._names = {}  # original file name -> file IDs
+        self._dirs = {}  # relative directory -> mtime_ns when last scanned
+        self._manifest_mtime = None
+
+    @contextmanager
+    def _locked(self):
+        """Hold the thread lock and the cross-process manifest lock"""
+        with self._lock:
+            os.makedirs(os.path.dirname(self.manifest_path), exist_ok=True)
+            with self._file_lock:
+                yield
+
+    @staticmethod
+    def _key(relative_path, stored_name):
+        return f"{relative_path}/{stored_name}"
+
+    def _relative_dir(self, file_path):
+        return os.path.relpath(os.path.dirname(os.path.abspath(file_path)), os.path.abspath(self.project_path))
+
+    def _load(self):
+        """Load the manifest from disk, building it from a full scan the first time"""
+        try:
+            with open(self.manifest_path, 'r') as f:
+                manifest = json.load(f)
+            self._next_id = manifest['next_id']
+            self._files = {int(file_id): entry for file_id, entry in manifest['files'].items()}
+            self._dirs = manifest['dirs']
+            self._paths = {self._key(e['relative_path'], e['file']): file_id for file_id, e in self._files.items()}
+            self._names = {}
+            for file_id, entry in self._files.items():
+                self._names.setdefault(original_filename(entry['file']), set()).add(file_id)
+            self._manifest_mtime = os.stat(self.manifest_path).st_mtime_ns
+            return
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Rebuilding unreadable file manifest {self.manifest_path}: {str(e)}")
+
+        self._files, self._paths, self._names, self._dirs = {}, {}, {}, {}
+        self._scan_dir('.', self._legacy_metadata())
+        self._save()
+        logger.info(f"Built file manifest for {self.project_path} with {len(self._files)} files")
+
+    def _legacy_metadata(self):
+        """files_metadata.json entries keyed by "<relative dir>_<file name>" """
+        legacy_file = os.path.join(self.project_path, MANIFEST_DIR, LEGACY_METADATA_FILE)
+        if not os.path.exists(legacy_file):
+            return {}
+        try:
+            with open(legacy_file, 'r') as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError):
+            logger.warning(f"Ignoring unreadable metadata file {legacy_file}")
+            return {}
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.manifest_path), exist_ok=True)
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({
+                'next_id': self._next_id,
+                'files': self._files,
+                'dirs': self._dirs
+            }, f)
+        os.replace(tmp_path, self.manifest_path)
+        self._manifest_mtime = os.stat(self.manifest_path).st_mtime_ns
+
+    def _upsert(self, relative_path, stored_name, stat, added_by=None, date_added=None):
+        key = self._key(relative_path, stored_name)
+        file_id = self._paths.get(key)
+        if file_id is None:
+            file_id = self._next_id
+            self._next_id += 1
+            self._paths[key] = file_id
+            self._names.setdefault(original_filename(stored_name), set()).add(file_id)
+            self._files[file_id] = {
+                'relative_path': relative_path,
+                'file': stored_name,
+                'addedBy': added_by or 'System',
+                'dateAdded': date_added or datetime.fromtimestamp(stat.st_ctime).strftime('%Y-%m-%d')
+            }
+        entry = self._files[file_id]
+        entry['size'] = stat.st_size
+        entry['mtime'] = stat.st_mtime
+        if added_by:
+            entry['addedBy'] = added_by
+        if date_added:
+            entry['dateAdded'] = date_added
+        return file_id
+
+    def _drop(self, file_id):
+        entry = self._files.pop(file_id)
+        self._paths.pop(self._key(entry['relative_path'], entry['file']), None)
+        ids = self._names.get(original_filename(entry['file']))
+        if ids:
+            ids.discard(file_id)
+            if not ids:
+                del self._names[original_filename(entry['file'])]
+
+    def _scan_dir(self, relative_path, legacy=None):
+        """Re-read one directory, picking up new subdirectories recursively"""
+        dir_path = os.path.normpath(os.path.join(self.project_path, relative_path))
+        try:
+            mtime = os.stat(dir_path).st_mtime_ns
+            entries = list(os.scandir(dir_path))
+        except FileNotFoundError:
+            self._forget_dir(relative_path)
+            return
+
+        present = set()
+        for entry in entries:
+            if entry.is_dir():
+                if entry.name in SKIPPED_DIRS:
+                    continue
+                child = os.path.normpath(os.path.join(relative_path, entry.name))
+                if child not in self._dirs:
+                    self._scan_dir(child, legacy)
+            elif entry.is_file():
+                present.add(entry.name)
+                file_metadata = (legacy or {}).get(f"{relative_path}_{entry.name}", {})
+                self._upsert(relative_path, entry.name, entry.stat(),
+                             file_metadata.get('addedBy'), file_metadata.get('dateAdded'))
+
+        for file_id in [i for i, e in self._files.items() if e['relative_path'] == relative_path and e['file'] not in present]:
+            self._drop(file_id)
+        self._dirs[relative_path] = mtime
+
+    def _forget_dir(self, relative_path):
+        if relative_path == '.':
+            self._files, self._paths, self._names, self._dirs = {}, {}, {}, {}
+            return
+        prefix = relative_path + os.sep
+        for directory in [d for d in self._dirs if d == relative_path or d.startswith(prefix)]:
+            del self._dirs[directory]
+        for file_id in [i for i, e in self._files.items()
+                        if e['relative_path'] == relative_path or e['relative_path'].startswith(prefix)]:
+            self._drop(file_id)
+
+    def _validate(self):
+        """Bring the manifest up to date, rescanning only directories whose mtime changed"""
+        try:
+            manifest_mtime = os.stat(self.manifest_path).st_mtime_ns
+        except FileNotFoundError:
+            manifest_mtime = None
+        if self._manifest_mtime is None or manifest_mtime != self._manifest_mtime:
+            # First use, or another process rewrote the manifest
+            self._load()
+
+        changed = False
+        for relative_path, recorded in list(self._dirs.items()):
+            if relative_path not in self._dirs:
+                continue  # Forgotten along with a removed parent
+            try:
+                mtime = os.stat(os.path.join(self.project_path, relative_path)).st_mtime_ns
+            except FileNotFoundError:
+                mtime = None
+            if mtime != recorded:
+                self._scan_dir(relative_path)
+                changed = True
+        if changed:
+            self._save()
+
+    def _entry_dict(self, file_id):
+        entry = self._files[file_id]
+        return {
+            "id": file_id,
+            "name": original_filename(entry['file']),
+            "path": os.path.join(self.project_path, entry['relative_path'], entry['file']),
+            "relative_path": entry['relative_path'],
+            "addedBy": entry['addedBy'],
+            "dateAdded": entry['dateAdded'],
+            "lastUpdated": datetime.fromtimestamp(entry['mtime']).strftime('%Y-%m-%d'),
+            "size": entry['size']
+        }
+
+    def list_files(self):
+        with self._locked():
+            self._validate()
+            return [self._entry_dict(file_id) for file_id in sorted(self._files)]
+
+    def _lookup(self, file_id):
+        """Resolve a file ID with one stat of the file, validating the manifest only on a miss"""
+        if self._manifest_mtime is not None and file_id in self._files:
+            entry = self._entry_dict(file_id)
+            if os.path.exists(entry['path']):
+                return entry
+        self._validate()
+        return self._entry_dict(file_id) if file_id in self._files else None
+
+    def get_file(self, file_id):
+        with self._locked():
+            return self._lookup(file_id)
+
+    def find_by_name(self, name):
+        """First file (lowest ID) whose original name matches, or None"""
+        with self._locked():
+            self._validate()
+            ids = self._names.get(name)
+            return self._entry_dict(min(ids)) if ids else None
+
+    def add_file(self, file_path, added_by=None, date_added=None):
+        """Record a file just written by the app and return its ID"""
+        with self._locked():
+            self._validate()
+            relative_path = self._relative_dir(file_path)
+            stored_name = os.path.basename(file_path)
+            file_id = self._upsert(relative_path, stored_name, os.stat(file_path), added_by, date_added)
+            self._record_dir(relative_path)
+            self._save()
+            return file_id
+
+    def remove_file(self, file_id):
+        """Delete a file and its manifest entry, removing its directory if it is left empty"""
+        with self._locked():
+            entry = self._lookup(file_id)
+            if entry is None:
+                return None
+            if os.path.exists(entry['path']):
+                os.remove(entry['path'])
+            self._drop(file_id)
+
+            dir_path = os.path.dirname(entry['path'])
+            if entry['relative_path'] != '.' and os.path.exists(dir_path) and not os.listdir(dir_path):
+                try:
+                    os.rmdir(dir_path)
+                except OSError:
+                    pass  # Ignore if directory cannot be removed
+            self._record_dir(entry['relative_path'])
+            self._save()
+            return entry
+
+    def _record_dir(self, relative_path):
+        """Accept the current mtime of a directory (and its parent) changed by the app itself"""
+        for directory in {relative_path, os.path.dirname(relative_path) or '.'}:
+            try:
+                self._dirs[directory] = os.stat(os.path.join(self.project_path, directory)).st_mtime_ns
+            except FileNotFoundError:
+                self._forget_dir(directory)
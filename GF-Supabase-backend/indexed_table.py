@@ -0,0 +1,241 @@
+import os
+import copy
+import threading
+from collections import defaultdict
+from tinydb import TinyDB
+from tinydb.table import Document
+from logger import CustomLogger
+
+logger = CustomLogger('indexed_table')
+
+
+class IndexedTable:
+    """In-memory, indexed view of a TinyDB table
+
+    Every document is loaded once at start-up and kept in memory together
+    with hash indexes on the configured fields, so reads cost one stat of
+    the TinyDB file: when its mtime moved (another process wrote to it) the
+    table is reloaded first. Writes go to memory and through to the TinyDB
+    file, keeping the indexes in sync. ``multi_indexes`` are fields holding
+    lists (e.g. assigned_users) that are indexed by each of their elements.
+
+    The TinyDB methods used across the app (get, search, contains, all,
+    insert, update, remove) are supported with the same signatures; find()
+    and find_one() are the indexed lookups by field equality.
+    """
+
+    def __init__(self, path, indexes=(), multi_indexes=()):
+        self.path = path
+        self._table = TinyDB(path).table('_default')
+        self._lock = threading.RLock()
+        self._indexes = {field: defaultdict(set) for field in indexes}
+        self._multi_indexes = {field: defaultdict(set) for field in multi_indexes}
+        self._docs = {}
+        self._mtime = None  # mtime_ns of the file when the in-memory copy matched it
+        # Incremented on every write so callers can invalidate derived caches
+        self.version = 0
+        self.reload()
+
+    def reload(self):
+        """(Re)load every document and rebuild the indexes from disk"""
+        with self._lock:
+            self._mtime = self._file_mtime()
+            # TinyDB caches the next doc ID and query results, both stale if another process wrote
+            self._table._next_id = None
+            self._table.clear_cache()
+            self._docs = {doc.doc_id: dict(doc) for doc in self._table.all()}
+            for index in list(self._indexes.values()) + list(self._multi_indexes.values()):
+                index.clear()
+            for doc_id, doc in self._docs.items():
+                self._index(doc_id, doc)
+            self.version += 1
+        logger.info(f"Loaded {len(self._docs)} documents from {self.path}")
+
+    def _file_mtime(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _refresh(self):
+        """Reload if the file changed since it was last read or written by this table"""
+        if self._file_mtime() != self._mtime:
+            self.reload()
+
+    def _write(self, write):
+        """Run a write to the TinyDB file, keeping track of its mtime
+
+        The new mtime is only adopted when nobody else wrote to the file
+        since this table last matched it, so such a write still triggers a
+        reload on the next read.
+        """
+        in_sync = self._file_mtime() == self._mtime
+        result = write()
+        if in_sync:
+            self._mtime = self._file_mtime()
+        return result
+
+    def _index(self, doc_id, doc):
+        for field, index in self._indexes.items():
+            value = doc.get(field)
+            try:
+                index[value].add(doc_id)
+            except TypeError:
+                pass  # Unhashable values are only found by scanning
+        for field, index in self._multi_indexes.items():
+            for value in doc.get(field) or []:
+                try:
+                    index[value].add(doc_id)
+                except TypeError:
+                    pass
+
+    def _unindex(self, doc_id, doc):
+        for field, index in self._indexes.items():
+            try:
+                ids = index.get(doc.get(field))
+            except TypeError:
+                continue
+            if ids is not None:
+                ids.discard(doc_id)
+                if not ids:
+                    del index[doc.get(field)]
+        for field, index in self._multi_indexes.items():
+            for value in doc.get(field) or []:
+                try:
+                    ids = index.get(value)
+                except TypeError:
+                    continue
+                if ids is not None:
+                    ids.discard(doc_id)
+                    if not ids:
+                        del index[value]
+
+    def _document(self, doc_id):
+        return Document(copy.deepcopy(self._docs[doc_id]), doc_id)
+
+    def _matching_ids(self, cond=None, doc_ids=None):
+        if doc_ids is not None:
+            ids = [int(doc_id) for doc_id in doc_ids if int(doc_id) in self._docs]
+        else:
+            ids = sorted(self._docs)
+        if cond is not None:
+            ids = [doc_id for doc_id in ids if cond(self._docs[doc_id])]
+        return ids
+
+    def find_ids(self, **criteria):
+        """Doc IDs of documents whose fields equal every given value, in insertion order"""
+        with self._lock:
+            self._refresh()
+            candidates = None
+            unindexed = {}
+            for field, value in criteria.items():
+                index = self._indexes.get(field) or self._multi_indexes.get(field)
+                if index is None:
+                    unindexed[field] = value
+                    continue
+                try:
+                    ids = index.get(value, set())
+                except TypeError:
+                    unindexed[field] = value
+                    continue
+                candidates = set(ids) if candidates is None else candidates & ids
+                if not candidates:
+                    return []
+            ids = sorted(candidates) if candidates is not None else sorted(self._docs)
+            if unindexed:
+                ids = [
+                    doc_id for doc_id in ids
+                    if all(self._docs[doc_id].get(field) == value for field, value in unindexed.items())
+                ]
+            return ids
+
+    def find(self, **criteria):
+        """Documents matching every field=value criterion, using the indexes"""
+        with self._lock:
+            return [self._document(doc_id) for doc_id in self.find_ids(**criteria)]
+
+    def find_one(self, **criteria):
+        with self._lock:
+            ids = self.find_ids(**criteria)
+            return self._document(ids[0]) if ids else None
+
+    def get(self, cond=None, doc_id=None, doc_ids=None):
+        with self._lock:
+            self._refresh()
+            if doc_id is not None:
+                doc_id = int(doc_id)
+                return self._document(doc_id) if doc_id in self._docs else None
+            if doc_ids is not None:
+                return [self._document(i) for i in self._matching_ids(doc_ids=doc_ids)]
+            ids = self._matching_ids(cond)
+            return self._document(ids[0]) if ids else None
+
+    def search(self, cond):
+        with self._lock:
+            self._refresh()
+            return [self._document(doc_id) for doc_id in self._matching_ids(cond)]
+
+    def contains(self, cond=None, doc_id=None):
+        with self._lock:
+            self._refresh()
+            if doc_id is not None:
+                return int(doc_id) in self._docs
+            return bool(self._matching_ids(cond))
+
+    def all(self):
+        with self._lock:
+            self._refresh()
+            return [self._document(doc_id) for doc_id in sorted(self._docs)]
+
+    def __len__(self):
+        with self._lock:
+            self._refresh()
+            return len(self._docs)
+
+    def insert(self, document):
+        with self._lock:
+            self._refresh()
+            doc = copy.deepcopy(dict(document))
+            doc_id = self._write(lambda: self._table.insert(doc))
+            self._docs[doc_id] = doc
+            self._index(doc_id, doc)
+            self.version += 1
+            return doc_id
+
+    def update(self, fields, cond=None, doc_ids=None):
+        """Update matching documents with a dict of fields or a callable applied to each"""
+        with self._lock:
+            self._refresh()
+            ids = self._matching_ids(cond, doc_ids)
+            for doc_id in ids:
+                doc = copy.deepcopy(self._docs[doc_id])
+                if callable(fields):
+                    fields(doc)
+                else:
+                    doc.update(copy.deepcopy(fields))
+                self._unindex(doc_id, self._docs[doc_id])
+                self._docs[doc_id] = doc
+                self._index(doc_id, doc)
+            if ids:
+                if callable(fields):
+                    # Write back the documents exactly as the callable left them
+                    for doc_id in ids:
+                        def replace(stored, doc=copy.deepcopy(self._docs[doc_id])):
+                            stored.clear()
+                            stored.update(doc)
+                        self._write(lambda: self._table.update(replace, doc_ids=[doc_id]))
+                else:
+                    self._write(lambda: self._table.update(copy.deepcopy(fields), doc_ids=ids))
+                self.version += 1
+            return ids
+
+    def remove(self, cond=None, doc_ids=None):
+        with self._lock:
+            self._refresh()
+            ids = self._matching_ids(cond, doc_ids)
+            if ids:
+                self._write(lambda: self._table.remove(doc_ids=ids))
+                for doc_id in ids:
+                    self._unindex(doc_id, self._docs.pop(doc_id))
+                self.version += 1
+            return ids
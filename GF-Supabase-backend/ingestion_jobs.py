@@ -0,0 +1,197 @@
+import os
+import queue
+import socket
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from logger import CustomLogger
+from database import db
+
+logger = CustomLogger('ingestion_jobs')
+
+STAGES = ['parse', 'embed', 'store', 'charts']
+
+
+class JobContext:
+    """Progress reporter handed to the job handler for a single run"""
+
+    def __init__(self, job_id, resumed=False):
+        self.job_id = job_id
+        self.resumed = resumed
+        self.timings = {}
+
+    @contextmanager
+    def stage(self, name):
+        """Mark a stage as running for the duration of the block"""
+        start = time.perf_counter()
+        db.update_job_stage(self.job_id, name, {
+            'status': 'running',
+            'progress': 0.0,
+            'started_at': datetime.now().isoformat(),
+            'finished_at': None,
+            'error': None
+        })
+        try:
+            yield self
+        except Exception as e:
+            db.update_job_stage(self.job_id, name, {
+                'status': 'failed',
+                'finished_at': datetime.now().isoformat(),
+                'error': str(e)
+            })
+            raise
+        duration = time.perf_counter() - start
+        self.timings[name] = duration
+        db.update_job_stage(self.job_id, name, {
+            'status': 'completed',
+            'progress': 1.0,
+            'finished_at': datetime.now().isoformat(),
+            'duration': duration
+        })
+
+    def progress(self, name, fraction):
+        """Report partial progress (0.0 - 1.0) for a running stage"""
+        db.update_job_stage(self.job_id, name, {'progress': round(min(max(fraction, 0.0), 1.0), 3)})
+
+
+class IngestionQueue:
+    """Runs upload processing on a pool of local worker threads
+
+    Jobs are persisted in the jobs table so that anything still queued or
+    running when the process stops is picked up again by resume_pending().
+
+    Every queue has its own owner ID, and the jobs it holds carry a lease
+    (lease_expires_at) that a heartbeat thread renews every third of
+    INGESTION_LEASE_SECONDS. resume_pending() only claims jobs whose lease
+    has expired, i.e. whose process is gone, so every server process can
+    call it; the heartbeat also calls it periodically to adopt jobs of
+    processes that died later, and deletes finished jobs older than
+    INGESTION_JOB_RETENTION_DAYS.
+    """
+
+    def __init__(self, handler, num_workers=None):
+        self.handler = handler
+        self.num_workers = num_workers or int(os.environ.get('INGESTION_WORKERS', 2))
+        self.lease_seconds = float(os.environ.get('INGESTION_LEASE_SECONDS', 60))
+        self.retention = timedelta(days=float(os.environ.get('INGESTION_JOB_RETENTION_DAYS', 7)))
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._queue = queue.Queue()
+        self._workers = []
+        self._held = set()  # IDs of the jobs this queue has queued or is running
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Start the worker threads if they are not running yet"""
+        with self._lock:
+            if self._workers:
+                return
+            for i in range(self.num_workers):
+                worker = threading.Thread(target=self._work, name=f"ingestion-worker-{i}", daemon=True)
+                worker.start()
+                self._workers.append(worker)
+            heartbeat = threading.Thread(target=self._heartbeat, name="ingestion-heartbeat", daemon=True)
+            heartbeat.start()
+            self._workers.append(heartbeat)
+            logger.info(f"Started {self.num_workers} ingestion workers as {self.owner}")
+
+    def submit(self, project_id, params, created_by=None):
+        """Persist a new ingestion job and queue it, returning the job ID"""
+        job_id = db.create_job({
+            'type': 'ingestion',
+            'project_id': project_id,
+            'created_by': created_by,
+            'status': 'queued',
+            'params': params,
+            'stages': {stage: {'status': 'pending', 'progress': 0.0} for stage in STAGES},
+            'attempts': 0,
+            'result': None,
+            'error': None,
+            'owner': self.owner,
+            'lease_expires_at': time.time() + self.lease_seconds
+        })
+        logger.info(f"Queued ingestion job {job_id} for project {project_id}", {
+            'file_name': params.get('file_name')
+        })
+        self.start()
+        self._hold(job_id)
+        return job_id
+
+    def _hold(self, job_id):
+        with self._lock:
+            self._held.add(job_id)
+        self._queue.put(job_id)
+
+    def _release(self, job_id):
+        with self._lock:
+            self._held.discard(job_id)
+
+    def resume_pending(self):
+        """Claim and re-queue queued or in-flight jobs whose owner stopped renewing their lease"""
+        resumed = 0
+        for job in db.get_incomplete_jobs():
+            if (job.get('lease_expires_at') or 0) > time.time():
+                continue  # Held by a live process
+            # Intermediate results are not persisted, so a resumed job runs every stage again
+            stages = {stage: {'status': 'pending', 'progress': 0.0} for stage in STAGES}
+            if db.claim_job(job['id'], self.owner, self.lease_seconds, {'status': 'queued', 'stages': stages}):
+                self._hold(job['id'])
+                resumed += 1
+        if resumed:
+            logger.info(f"Resuming {resumed} ingestion jobs")
+        self.start()
+        return resumed
+
+    def _heartbeat(self):
+        """Renew the leases of held jobs, adopt expired ones and prune old finished jobs"""
+        last_prune = None
+        while True:
+            time.sleep(self.lease_seconds / 3)
+            try:
+                with self._lock:
+                    held = list(self._held)
+                for job_id in held:
+                    if not db.renew_job_lease(job_id, self.owner, self.lease_seconds):
+                        logger.warning(f"Lost the lease of ingestion job {job_id}")
+                        self._release(job_id)
+                self.resume_pending()
+                if last_prune is None or time.monotonic() - last_prune > 3600:
+                    last_prune = time.monotonic()
+                    pruned = db.prune_jobs((datetime.now() - self.retention).isoformat())
+                    if pruned:
+                        logger.info(f"Pruned {pruned} finished ingestion jobs")
+            except Exception as e:
+                logger.error(f"Error in ingestion heartbeat: {str(e)}")
+
+    def _work(self):
+        while True:
+            job_id = self._queue.get()
+            try:
+                self._run(job_id)
+            finally:
+                self._release(job_id)
+                self._queue.task_done()
+
+    def _run(self, job_id):
+        job = db.get_job(job_id)
+        if not job:
+            logger.warning(f"Ingestion job {job_id} no longer exists")
+            return
+        if job.get('owner') != self.owner:
+            logger.warning(f"Ingestion job {job_id} was taken over by {job.get('owner')}")
+            return
+
+        attempts = job.get('attempts', 0) + 1
+        db.update_job(job_id, {'status': 'running', 'attempts': attempts, 'error': None})
+        context = JobContext(job_id, resumed=attempts > 1)
+        try:
+            result = self.handler(job, context)
+            db.update_job(job_id, {
+                'status': 'completed',
+                'result': dict(result or {}, timings=context.timings)
+            })
+            logger.info(f"Ingestion job {job_id} completed", {'timings': context.timings})
+        except Exception as e:
+            logger.error(f"Ingestion job {job_id} failed: {str(e)}")
+            db.update_job(job_id, {'status': 'failed', 'error': str(e)})
@@ -0,0 +1,109 @@
+import os
+import time
+import threading
+from flask import g
+from logger import CustomLogger
+
+logger = CustomLogger('project_access')
+
+
+class AccessDecision:
+    """Outcome of checking an identity against a project"""
+
+    def __init__(self, project=None, status=200, error=None):
+        self.project = project
+        self.status = status
+        self.error = error
+
+    @property
+    def allowed(self):
+        return self.status == 200
+
+
+class ProjectAccessResolver:
+    """Resolves a JWT identity's access to a project in a single lookup
+
+    Decisions are memoised per request in flask.g and across requests in a
+    short-TTL cache keyed by (identity, project_id, scope). Cached entries
+    are also dropped as soon as the projects or users table changes.
+
+    By default users must be assigned to the project and companies must own
+    it. With company_scope=True (chat and predict) any user of the owning
+    company is allowed, and a missing or foreign project is reported as 404.
+    """
+
+    def __init__(self, database, ttl=None, max_entries=10000):
+        self.db = database
+        self.ttl = ttl if ttl is not None else float(os.environ.get('PROJECT_ACCESS_CACHE_TTL', 30))
+        self.max_entries = max_entries
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def _tables_version(self):
+        return (self.db.projects_db.version, self.db.users_db.version)
+
+    def _decide(self, identity, project_id, company_scope):
+        if identity.startswith('user_'):
+            user_id = int(identity.split('_')[1])
+            project = self.db.get_project(project_id)
+            if company_scope:
+                user_data = self.db.get_user(user_id)
+                if not user_data:
+                    return AccessDecision(status=404, error="User not found")
+                if not project or project['company_id'] != user_data['company_id']:
+                    return AccessDecision(status=404, error="Project not found or unauthorized")
+                return AccessDecision(project)
+            if not project:
+                return AccessDecision(status=404, error="Project not found")
+            if user_id not in project.get('assigned_users', []):
+                return AccessDecision(status=403, error="Unauthorized access to project")
+            return AccessDecision(project)
+
+        if identity.startswith('company_'):
+            company_id = int(identity.split('_')[1])
+            project = self.db.get_project(project_id)
+            if company_scope:
+                if not project or project['company_id'] != company_id:
+                    return AccessDecision(status=404, error="Project not found or unauthorized")
+                return AccessDecision(project)
+            if not project:
+                return AccessDecision(status=404, error="Project not found")
+            if project['company_id'] != company_id:
+                return AccessDecision(status=403, error="Unauthorized access to project")
+            return AccessDecision(project)
+
+        return AccessDecision(status=401, error="Invalid token")
+
+    def resolve(self, identity, project_id, company_scope=False):
+        """Return the AccessDecision of an identity for a project (the project is read-only)"""
+        key = (identity, int(project_id), company_scope)
+
+        request_cache = g.setdefault('project_access', {})
+        if key in request_cache:
+            return request_cache[key]
+
+        version = self._tables_version()
+        now = time.monotonic()
+        with self._lock:
+            cached = self._cache.get(key)
+        if cached and cached[0] > now and cached[1] == version:
+            decision = cached[2]
+        else:
+            decision = self._decide(identity, int(project_id), company_scope)
+            with self._lock:
+                if len(self._cache) >= self.max_entries:
+                    self._cache = {k: v for k, v in self._cache.items() if v[0] > now and v[1] == version}
+                self._cache[key] = (now + self.ttl, version, decision)
+
+        if not decision.allowed:
+            logger.warning(f"Project access denied for {identity} on project {project_id}: {decision.error}")
+        request_cache[key] = decision
+        return decision
+
+    def invalidate(self, project_id=None):
+        """Drop cached decisions for one project, or all of them"""
+        with self._lock:
+            if project_id is None:
+                self._cache.clear()
+            else:
+                self._cache = {k: v for k, v in self._cache.items() if k[1] != int(project_id)}
@@ -0,0 +1,90 @@
+import os
+import threading
+from collections import namedtuple
+from logger import CustomLogger
+from supabase_manager import supabase_manager
+from context_assembler import assemble_context
+
+logger = CustomLogger('project_context')
+
+# The query used to pull a broad sample of a project's data
+ALL_PROJECT_DATA_QUERY = "all project data"
+
+ContextSnapshot = namedtuple('ContextSnapshot', ['version', 'text', 'tokens', 'chunk_ids'])
+
+
+class ProjectContextSnapshots:
+    """Full-project LLM context, built once per ingest version
+
+    The chart tracker (and any other agent that needs an overview of a
+    whole project) asks for the snapshot instead of running its own
+    retrieval. The snapshot is the top PROJECT_CONTEXT_TOP_K matches for
+    ALL_PROJECT_DATA_QUERY, deduplicated and packed into
+    PROJECT_CONTEXT_TOKENS tokens. The query vector is embedded once per
+    process. invalidate() is called whenever a project's documents
+    change, and the next get() rebuilds it; concurrent callers wait for
+    that single rebuild.
+    """
+
+    def __init__(self, top_k=None, token_budget=None):
+        self.top_k = top_k or int(os.environ.get('PROJECT_CONTEXT_TOP_K', 50))
+        self.token_budget = token_budget or int(os.environ.get('PROJECT_CONTEXT_TOKENS', 12000))
+        self._versions = {}  # project_id -> ingest version
+        self._snapshots = {}  # project_id -> ContextSnapshot
+        self._build_locks = {}
+        self._query_vector = None
+        self._lock = threading.Lock()
+
+    def query_vector(self):
+        if self._query_vector is None:
+            vector = supabase_manager.get_embedding(ALL_PROJECT_DATA_QUERY)
+            with self._lock:
+                self._query_vector = vector
+        return self._query_vector
+
+    def version(self, project_id):
+        with self._lock:
+            return self._versions.get(int(project_id), 0)
+
+    def invalidate(self, project_id):
+        """Mark a project's documents as changed"""
+        with self._lock:
+            project_id = int(project_id)
+            self._versions[project_id] = self._versions.get(project_id, 0) + 1
+            self._snapshots.pop(project_id, None)
+
+    def get(self, project_id):
+        """The project's ContextSnapshot for its current ingest version"""
+        project_id = int(project_id)
+        with self._lock:
+            snapshot = self._snapshots.get(project_id)
+            version = self._versions.get(project_id, 0)
+            build_lock = self._build_locks.setdefault(project_id, threading.Lock())
+        if snapshot and snapshot.version == version:
+            return snapshot
+
+        with build_lock:
+            with self._lock:
+                snapshot = self._snapshots.get(project_id)
+                version = self._versions.get(project_id, 0)
+            if snapshot and snapshot.version == version:
+                return snapshot
+
+            matches = supabase_manager.store.match(project_id, self.query_vector(), ALL_PROJECT_DATA_QUERY, self.top_k)
+            text, tokens, used = assemble_context(matches, self.token_budget)
+            snapshot = ContextSnapshot(version, text, tokens, [match.get('id') for match in used])
+            logger.info(f"Built context snapshot of project {project_id}", {
+                'version': version,
+                'matches': len(matches),
+                'chunks_used': len(used),
+                'tokens': tokens
+            })
+
+            with self._lock:
+                # Keep it only if no ingest happened while it was being built
+                if self._versions.get(project_id, 0) == version:
+                    self._snapshots[project_id] = snapshot
+            return snapshot
+
+
+project_context = ProjectContextSnapshots()
@@ -0,0 +1,453 @@
+"""Benchmark of the /api/chat retrieval hot path
+
+Builds synthetic projects whose chunks look like process_excel_to_text
+output, loads them into a LocalVectorStore and replays a query workload
+through the same steps as the chat endpoint: SupabaseManager.query (query
+embedding through the project's embedding cache, hybrid match and
+dedup), context assembly and the LLM call (stubbed). Reports p50/p95/p99
+latency per stage, throughput and recall@k against an exact brute-force
+ranking, optionally as JSON so runs can be compared across releases.
+
+    python retrieval_benchmark.py --chunks 10000 --queries 500 --output bench.json
+
+--index runs the same workload over an ANN index sized like the pgvector
+one (see vector_index.py); comparing the retrieve latency and recall@k of
+"none", "ivfflat" and "hnsw" runs shows what an index and its ef_search /
+probes settings trade away. Projects below VECTOR_INDEX_MIN_ROWS rows are
+scanned exactly, as match_documents does (set VECTOR_INDEX_MIN_ROWS=0 to
+put small projects through the index too). The local store builds one
+index per larger project while pgvector filters one table-wide index by
+project_id after the scan, so the recall reported for an index is an
+upper bound of production recall.
+
+    python retrieval_benchmark.py --chunks 100000 --index hnsw --ef-search 200
+"""
+import os
+import json
+import time
+import zlib
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from text_search import tokenize, to_tsvector
+from vector_store import LocalVectorStore, hybrid_scores, FUSION_METHODS
+from vector_index import METHODS
+from embedding_cache import EmbeddingCache
+from supabase_manager import SupabaseManager
+from context_assembler import assemble_context
+
+STAGES = ['embed', 'retrieve', 'assemble', 'llm', 'total']
+
+CATEGORIES = ['Concrete', 'Steel', 'Timber', 'Glazing', 'Insulation', 'Roofing', 'Electrical', 'Plumbing',
+              'HVAC', 'Solar PV', 'Landscaping', 'Labour', 'Scaffolding', 'Waste Removal', 'Consultancy']
+ITEMS = ['Ready-mix C30', 'Rebar 12mm', 'Glulam beam', 'Triple glazed unit', 'Mineral wool batt',
+         'Green roof membrane', 'LED panel', 'Copper pipe 22mm', 'Heat pump 8kW', 'PV module 400W',
+         'Inverter 5kW', 'Rainwater tank', 'Site foreman', 'Skip hire', 'Energy audit', 'Recycled aggregate',
+         'Low carbon cement', 'Cross laminated timber', 'Battery storage 10kWh', 'Smart meter']
+SUPPLIERS = ['Northwind Materials', 'Greenbuild Supply', 'Helios Energy', 'Apex Steelworks', 'Evergreen Timber',
+             'ClearView Glass', 'Aqua Systems', 'Volt Electrical', 'Terra Landscapes', 'EcoWaste Ltd']
+SHEETS = {
+    'Materials': ['Date', 'Category', 'Item', 'Supplier', 'Quantity', 'Unit Cost', 'Total Cost', 'CO2e (kg)'],
+    'Labour': ['Date', 'Category', 'Item', 'Hours', 'Rate', 'Total Cost'],
+    'Energy': ['Date', 'Item', 'Supplier', 'kWh', 'Tariff', 'Total Cost', 'CO2e (kg)'],
+}
+QUERY_TEMPLATES = [
+    "What is the total cost of {item}?",
+    "How much did we spend on {category} in {month}?",
+    "Show {category} costs by supplier",
+    "Which items did {supplier} deliver?",
+    "What are the CO2e emissions of {item} from {supplier}?",
+    "Compare quotation and actual costs for {category}",
+]
+
+
+class HashingEmbedder:
+    """Deterministic stand-in for the SentenceTransformer model
+
+    Tokens are hashed into a fixed number of signed dimensions (feature
+    hashing), so texts sharing words get similar vectors without loading a
+    model. It exposes the encode() interface used by SupabaseManager.
+    """
+
+    def __init__(self, dim=384):
+        self.dim = dim
+        self._slots = {}
+
+    def get_sentence_embedding_dimension(self):
+        return self.dim
+
+    def _slot(self, token):
+        slot = self._slots.get(token)
+        if slot is None:
+            h = zlib.crc32(token.encode('utf-8'))
+            slot = self._slots[token] = (h % self.dim, 1.0 if h & 0x80000000 else -1.0)
+        return slot
+
+    def encode(self, texts, batch_size=None, show_progress_bar=False):
+        embeddings = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            slots = [self._slot(token) for token in tokenize(text)]
+            if slots:
+                index, sign = zip(*slots)
+                np.add.at(embeddings[i], list(index), sign)
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return embeddings / norms
+
+
+class StubLLM:
+    """Replaces OPENAILLMAPI.get_ai_response with a canned reply after a fixed delay"""
+
+    def __init__(self, latency_ms=0.0):
+        self.latency = latency_ms / 1000.0
+
+    def get_ai_response(self, prompt, relevant_data=None):
+        if self.latency:
+            time.sleep(self.latency)
+        return json.dumps({
+            "Answer": f"Stub answer from {len(relevant_data or '')} characters of context",
+            "Dashboard": []
+        })
+
+
+def load_embedder(name, dim):
+    if name == 'hashing':
+        return HashingEmbedder(dim)
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(name)
+
+
+def _synthetic_row(rng, columns, day):
+    values = {
+        'Date': (datetime(2024, 1, 1) + timedelta(days=day)).strftime('%Y-%m-%d %H:%M:%S'),
+        'Category': CATEGORIES[rng.integers(len(CATEGORIES))],
+        'Item': ITEMS[rng.integers(len(ITEMS))],
+        'Supplier': SUPPLIERS[rng.integers(len(SUPPLIERS))],
+        'Quantity': f"{rng.integers(1, 500):g}",
+        'Unit Cost': f"{rng.uniform(1, 2000):g}",
+        'Hours': f"{rng.integers(1, 60):g}",
+        'Rate': f"{rng.uniform(20, 120):g}",
+        'kWh': f"{rng.uniform(10, 50000):g}",
+        'Tariff': f"{rng.uniform(0.1, 0.4):g}",
+        'Total Cost': f"{rng.uniform(10, 250000):g}",
+        'CO2e (kg)': f"{rng.uniform(0, 10000):g}",
+    }
+    return " | ".join(f"{col}: {values[col]}" for col in columns)
+
+
+def synthetic_project_chunks(num_chunks, project_name, chunk_chars=8000, seed=0):
+    """Generate chunks laid out like process_excel_to_text output
+
+    Files alternate between quotation and actual workbooks with the sheets
+    above, and rows are packed into chunks of at most ``chunk_chars``
+    characters with the same headers the real chunker repeats.
+    """
+    rng = np.random.default_rng(seed)
+    chunks = []
+    file_index = 0
+    while len(chunks) < num_chunks:
+        header = f"{'Quotation' if file_index % 2 else 'Actual'} File for Project: {project_name}"
+        current_chunk = [header]
+        current_length = 0
+        for sheet_name, columns in SHEETS.items():
+            sheet_header = f"\nSheet: {sheet_name}"
+            columns_text = f"Columns: {', '.join(columns)}"
+            if current_length > 0:
+                chunks.append("\n".join(current_chunk))
+                current_chunk = [header, sheet_header, columns_text]
+                current_length = len(header) + len(sheet_header) + len(columns_text)
+            else:
+                current_chunk.extend([sheet_header, columns_text])
+                current_length += len(sheet_header) + len(columns_text)
+
+            for day in range(int(rng.integers(50, 2000))):
+                row_string = _synthetic_row(rng, columns, day)
+                if current_length + len(row_string) > chunk_chars:
+                    chunks.append("\n".join(current_chunk))
+                    current_chunk = [header, sheet_header, row_string]
+                    current_length = len(header) + len(sheet_header) + len(row_string)
+                else:
+                    current_chunk.append(row_string)
+                    current_length += len(row_string)
+        chunks.append("\n".join(current_chunk))
+        file_index += 1
+    return chunks[:num_chunks]
+
+
+def synthetic_queries(num_queries, seed=0):
+    rng = np.random.default_rng(seed)
+    months = [datetime(2024, month, 1).strftime('%B') for month in range(1, 13)]
+    return [
+        QUERY_TEMPLATES[rng.integers(len(QUERY_TEMPLATES))].format(
+            item=ITEMS[rng.integers(len(ITEMS))],
+            category=CATEGORIES[rng.integers(len(CATEGORIES))],
+            supplier=SUPPLIERS[rng.integers(len(SUPPLIERS))],
+            month=months[rng.integers(len(months))]
+        )
+        for _ in range(num_queries)
+    ]
+
+
+def percentiles(samples):
+    samples = np.asarray(samples) * 1000.0
+    if not len(samples):
+        return {}
+    return {
+        'p50': float(np.percentile(samples, 50)),
+        'p95': float(np.percentile(samples, 95)),
+        'p99': float(np.percentile(samples, 99)),
+        'mean': float(samples.mean()),
+        'max': float(samples.max())
+    }
+
+
+class RetrievalBenchmark:
+    def __init__(self, args):
+        self.args = args
+        self.embedder = load_embedder(args.embedder, args.dim)
+        index_params = {name: getattr(args, name) for name in ('ef_search', 'probes') if getattr(args, name)}
+        self.store = LocalVectorStore(args.store_path, index=args.index, index_params=index_params,
+                                      fusion=args.fusion, rrf_k=args.rrf_k)
+        self.llm = StubLLM(args.llm_latency_ms)
+        self.project_ids = list(range(1, args.projects + 1))
+
+        # Queries go through the manager the chat endpoint uses, with a throwaway
+        # embedding cache per project in place of the projects' RAG_cache folders
+        self.manager = SupabaseManager(store=self.store, embedding_model=self.embedder)
+        if args.embedding_cache:
+            cache_dir = tempfile.mkdtemp(prefix='retrieval_benchmark_')
+            for project_id in self.project_ids:
+                self.manager.embedding_caches[project_id] = EmbeddingCache(
+                    os.path.join(cache_dir, str(project_id)), self.manager.embedding_model_name,
+                    self.embedder.get_sentence_embedding_dimension()
+                )
+        # Time spent in get_embedding by the query running on this thread
+        self._embed_time = threading.local()
+        get_embedding = self.manager.get_embedding
+
+        def timed_get_embedding(*a, **kw):
+            start = time.perf_counter()
+            try:
+                return get_embedding(*a, **kw)
+            finally:
+                self._embed_time.seconds = time.perf_counter() - start
+        self.manager.get_embedding = timed_get_embedding
+        # Exact reference data per project for recall@k: (ids, normalized embeddings, tsvectors)
+        self.reference = {}
+
+    def ingest(self):
+        """Generate, embed and insert every project, returning the timings"""
+        timings = {'generate': 0.0, 'embed': 0.0, 'insert': 0.0}
+        for project_id in self.project_ids:
+            start = time.perf_counter()
+            chunks = synthetic_project_chunks(self.args.chunks, f"Benchmark {project_id}",
+                                              self.args.chunk_chars, seed=self.args.seed + project_id)
+            timings['generate'] += time.perf_counter() - start
+
+            ids = []
+            embeddings = []
+            for offset in range(0, len(chunks), self.args.batch_size):
+                batch = chunks[offset:offset + self.args.batch_size]
+                start = time.perf_counter()
+                batch_embeddings = np.asarray(self.embedder.encode(batch, batch_size=self.args.batch_size), dtype=np.float32)
+                timings['embed'] += time.perf_counter() - start
+
+                start = time.perf_counter()
+                inserted = self.store.insert([
+                    {
+                        'project_id': project_id,
+                        'content': chunk,
+                        'embedding': embedding,
+                        'metadata': {'file_path': f"benchmark/{project_id}/actuals.xlsx"}
+                    }
+                    for chunk, embedding in zip(batch, batch_embeddings)
+                ])
+                timings['insert'] += time.perf_counter() - start
+                ids.extend(row['id'] for row in inserted)
+                if self.args.recall_queries:
+                    embeddings.append(batch_embeddings)
+
+            if self.args.recall_queries:
+                normalized = np.vstack(embeddings)
+                norms = np.linalg.norm(normalized, axis=1, keepdims=True)
+                norms[norms == 0] = 1.0
+                self.reference[project_id] = (ids, normalized / norms, [to_tsvector(chunk) for chunk in chunks])
+        return timings
+
+    def run_query(self, project_id, query):
+        """Run one query through the chat hot path, returning (stage timings, matched ids)"""
+        timings = {}
+        start = time.perf_counter()
+        matches = self.manager.query(project_id, query, self.args.top_k)
+        timings['embed'] = self._embed_time.seconds
+        timings['retrieve'] = time.perf_counter() - start - timings['embed']
+
+        mark = time.perf_counter()
+        relevant_info = assemble_context(matches, self.args.context_tokens)[0]
+        timings['assemble'] = time.perf_counter() - mark
+
+        mark = time.perf_counter()
+        self.llm.get_ai_response(query, relevant_info)
+        timings['llm'] = time.perf_counter() - mark
+
+        timings['total'] = time.perf_counter() - start
+        return timings, [doc['id'] for doc in matches]
+
+    def exact_top_k(self, project_id, query):
+        ids, normalized, tsvectors = self.reference[project_id]
+        query_embedding = self.embedder.encode([query])[0]
+        scores = hybrid_scores(normalized, tsvectors, query_embedding, query)
+        count = min(self.args.top_k, len(scores))
+        top = np.argpartition(-scores, count - 1)[:count]
+        return [ids[i] for i in top]
+
+    def run(self):
+        args = self.args
+        ingest = self.ingest()
+        workload = [
+            (self.project_ids[i % len(self.project_ids)], query)
+            for i, query in enumerate(synthetic_queries(args.warmup + args.queries, seed=args.seed))
+        ]
+        warmup, workload = workload[:args.warmup], workload[args.warmup:]
+
+        # Warm-up queries build the per-project matrices and indexes and are not measured
+        start = time.perf_counter()
+        for project_id in self.project_ids:
+            self.store.match(project_id, self.embedder.encode(['warm up'])[0].tolist(), 'warm up', args.top_k)
+        for project_id, query in warmup:
+            self.run_query(project_id, query)
+        ingest['warmup'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        if args.concurrency > 1:
+            with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+                results = list(executor.map(lambda item: self.run_query(*item), workload))
+        else:
+            results = [self.run_query(project_id, query) for project_id, query in workload]
+        wall = time.perf_counter() - start
+
+        recalls = []
+        for (project_id, query), (_, ids) in list(zip(workload, results))[:args.recall_queries]:
+            expected = self.exact_top_k(project_id, query)
+            if expected:
+                recalls.append(len(set(ids) & set(expected)) / len(expected))
+
+        return {
+            'label': args.label,
+            'timestamp': datetime.now().isoformat(),
+            'git_revision': git_revision(),
+            'python': platform.python_version(),
+            'config': {
+                'projects': args.projects,
+                'chunks_per_project': args.chunks,
+                'chunk_chars': args.chunk_chars,
+                'queries': args.queries,
+                'top_k': args.top_k,
+                'concurrency': args.concurrency,
+                'embedder': args.embedder,
+                'dim': self.embedder.get_sentence_embedding_dimension(),
+                'llm_latency_ms': args.llm_latency_ms,
+                'context_tokens': args.context_tokens,
+                'index': args.index,
+                'index_scope': 'per_project',  # pgvector: table-wide, filtered by project_id after the scan
+                'ef_search': args.ef_search,
+                'probes': args.probes,
+                'fusion': args.fusion,
+                'embedding_cache': args.embedding_cache,
+                'seed': args.seed
+            },
+            'ingest_seconds': ingest,
+            'latency_ms': {stage: percentiles([timings[stage] for timings, _ in results]) for stage in STAGES},
+            'throughput_qps': len(results) / wall if wall else 0.0,
+            'recall_at_k': float(np.mean(recalls)) if recalls else None,
+            'recall_queries': len(recalls),
+            'embedding_cache_hit_rate': self._cache_hit_rate()
+        }
+
+    def _cache_hit_rate(self):
+        caches = list(self.manager.embedding_caches.values())
+        lookups = sum(cache.hits + cache.misses for cache in caches)
+        return sum(cache.hits for cache in caches) / lookups if lookups else None
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(report):
+    config = report['config']
+    print(f"\nRetrieval benchmark {report['label'] or 'run'} ({report['git_revision'] or 'unknown revision'})")
+    print(f"{config['projects']} project(s) x {config['chunks_per_project']} chunks, "
+          f"{config['queries']} queries, top_k={config['top_k']}, concurrency={config['concurrency']}, "
+          f"index={config['index']}, fusion={config['fusion']}")
+    print("Ingest: " + ", ".join(f"{name} {seconds:.2f}s" for name, seconds in report['ingest_seconds'].items()))
+    print(f"\n{'stage':<10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'mean ms':>10}")
+    for stage, stats in report['latency_ms'].items():
+        if stats:
+            print(f"{stage:<10}{stats['p50']:>10.2f}{stats['p95']:>10.2f}{stats['p99']:>10.2f}{stats['mean']:>10.2f}")
+    print(f"\nThroughput: {report['throughput_qps']:.1f} queries/s")
+    if report['embedding_cache_hit_rate'] is not None:
+        print(f"Query embedding cache hit rate: {report['embedding_cache_hit_rate']:.1%}")
+    if report['recall_at_k'] is not None:
+        print(f"Recall@{config['top_k']}: {report['recall_at_k']:.3f} over {report['recall_queries']} queries")
+        if config['index'] != 'none':
+            print("  (per-project index; pgvector post-filters a table-wide one, so production recall can be lower)")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the chat retrieval hot path on synthetic projects")
+    parser.add_argument('--projects', type=int, default=1, help="number of synthetic projects")
+    parser.add_argument('--chunks', type=int, default=1000, help="chunks per project (1k - 1M)")
+    parser.add_argument('--chunk-chars', type=int, default=8000,
+                        help="maximum chunk size; lower it to keep million-chunk runs in memory")
+    parser.add_argument('--queries', type=int, default=200, help="measured queries")
+    parser.add_argument('--warmup', type=int, default=10, help="unmeasured warm-up queries")
+    parser.add_argument('--top-k', type=int, default=5)
+    parser.add_argument('--concurrency', type=int, default=1, help="queries run in parallel")
+    parser.add_argument('--recall-queries', type=int, default=50,
+                        help="queries checked against an exact brute-force ranking (0 to skip)")
+    parser.add_argument('--embedder', default='hashing',
+                        help="'hashing' for the built-in deterministic embedder or a SentenceTransformer model name")
+    parser.add_argument('--dim', type=int, default=384, help="dimension of the hashing embedder")
+    parser.add_argument('--batch-size', type=int, default=500, help="chunks embedded and inserted per batch")
+    parser.add_argument('--context-tokens', type=int, default=None,
+                        help="token budget of the assembled context (default LLM_CONTEXT_TOKENS)")
+    parser.add_argument('--no-embedding-cache', dest='embedding_cache', action='store_false',
+                        help="embed every query instead of going through a per-project embedding cache")
+    parser.add_argument('--index', choices=METHODS, default='none',
+                        help="ANN index of the local store ('none' scans every row exactly)")
+    parser.add_argument('--ef-search', type=int, default=None, help="HNSW search width (default from the index size)")
+    parser.add_argument('--probes', type=int, default=None, help="IVFFlat lists probed (default sqrt(lists))")
+    parser.add_argument('--fusion', choices=FUSION_METHODS, default='weighted',
+                        help="hybrid score; recall@k is always measured against the exact weighted ranking")
+    parser.add_argument('--rrf-k', type=int, default=60, help="rank constant of --fusion rrf")
+    parser.add_argument('--llm-latency-ms', type=float, default=0.0, help="simulated LLM response time")
+    parser.add_argument('--store-path', default=':memory:', help="SQLite file of the local vector store")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--label', default=None, help="name of this run, e.g. the release being measured")
+    parser.add_argument('--output', default=None, help="write the report as JSON to this file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = RetrievalBenchmark(args).run()
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.output}")
+    return report
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,265 @@
+import os
+import re
+import json
+import sqlite3
+import threading
+from tinydb.table import Document
+from logger import CustomLogger
+
+logger = CustomLogger('sqlite_table')
+
+_FIELD_PATTERN = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+
+class SQLiteStore:
+    """One SQLite database file in WAL mode holding every metadata table
+
+    Readers never block the writer in WAL mode, so several Flask workers can
+    share the file; writes within this process are serialised by a lock.
+    Every write to a table also bumps that table's row in _table_versions in
+    the same transaction, so each table has its own version.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA busy_timeout=30000")
+        self._writes = 0
+        self._table_versions = {}
+        self._table_versions_at = None
+        with self.transaction() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS _table_versions (name TEXT PRIMARY KEY, version INTEGER NOT NULL)")
+
+    def table(self, name, indexes=(), multi_indexes=()):
+        return SQLiteTable(self, name, indexes, multi_indexes)
+
+    @property
+    def version(self):
+        """Changes whenever this or any other connection commits to the file"""
+        with self.lock:
+            return self._writes + self.conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def table_version(self, name):
+        """Changes whenever a write to this table commits, from any connection
+
+        The versions are only re-read when the store version moved.
+        """
+        with self.lock:
+            version = self.version
+            if version != self._table_versions_at:
+                self._table_versions = dict(self.conn.execute("SELECT name, version FROM _table_versions").fetchall())
+                self._table_versions_at = version
+            return self._table_versions.get(name, 0)
+
+    def transaction(self):
+        return _Transaction(self)
+
+
+class _Transaction:
+    def __init__(self, store):
+        self.store = store
+
+    def __enter__(self):
+        self.store.lock.acquire()
+        try:
+            self.store.conn.execute("BEGIN IMMEDIATE")
+        except BaseException:
+            # __exit__ does not run when __enter__ raises, e.g. SQLITE_BUSY after the timeout
+            self.store.lock.release()
+            raise
+        return self.store.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None:
+                self.store.conn.execute("COMMIT")
+                self.store._writes += 1
+            else:
+                self.store.conn.execute("ROLLBACK")
+        finally:
+            self.store.lock.release()
+
+
+class SQLiteTable:
+    """A metadata table stored as JSON documents in SQLite
+
+    Same interface as IndexedTable. Each row holds one document keyed by its
+    doc_id; ``indexes`` become expression indexes on json_extract of the
+    field and every ``multi_indexes`` list field gets a side table of
+    (value, doc_id) pairs, so find() is an index lookup and writes only touch
+    the affected rows. Lookups by TinyDB query condition scan the table.
+    """
+
+    def __init__(self, store, name, indexes=(), multi_indexes=()):
+        for identifier in [name, *indexes, *multi_indexes]:
+            if not _FIELD_PATTERN.match(identifier):
+                raise ValueError(f"Invalid table or field name: {identifier}")
+        self.store = store
+        self.name = name
+        self.indexes = list(indexes)
+        self.multi_indexes = list(multi_indexes)
+        with store.transaction() as conn:
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {name} (doc_id INTEGER PRIMARY KEY AUTOINCREMENT, doc TEXT NOT NULL)")
+            for field in self.indexes:
+                conn.execute(f"CREATE INDEX IF NOT EXISTS {name}_{field}_idx ON {name} (json_extract(doc, '$.{field}'))")
+            for field in self.multi_indexes:
+                conn.execute(f"CREATE TABLE IF NOT EXISTS {name}__{field} (value, doc_id INTEGER NOT NULL)")
+                conn.execute(f"CREATE INDEX IF NOT EXISTS {name}__{field}_value_idx ON {name}__{field} (value)")
+                conn.execute(f"CREATE INDEX IF NOT EXISTS {name}__{field}_doc_idx ON {name}__{field} (doc_id)")
+
+    @property
+    def version(self):
+        return self.store.table_version(self.name)
+
+    def _bump_version(self, conn):
+        conn.execute(
+            "INSERT INTO _table_versions (name, version) VALUES (?, 1) "
+            "ON CONFLICT (name) DO UPDATE SET version = version + 1",
+            (self.name,)
+        )
+
+    def _rows(self, sql, params=()):
+        with self.store.lock:
+            return self.store.conn.execute(sql, params).fetchall()
+
+    @staticmethod
+    def _document(row):
+        return Document(json.loads(row[1]), row[0])
+
+    def _index_multi(self, conn, doc_id, doc):
+        for field in self.multi_indexes:
+            conn.execute(f"DELETE FROM {self.name}__{field} WHERE doc_id = ?", (doc_id,))
+            values = doc.get(field) or []
+            if isinstance(values, list):
+                conn.executemany(
+                    f"INSERT INTO {self.name}__{field} (value, doc_id) VALUES (?, ?)",
+                    [(value, doc_id) for value in values if isinstance(value, (str, int, float))]
+                )
+
+    def _matching_ids(self, cond=None, doc_ids=None):
+        if doc_ids is not None:
+            ids = sorted({int(doc_id) for doc_id in doc_ids})
+            if not ids:
+                return []
+            placeholders = ', '.join('?' * len(ids))
+            rows = self._rows(f"SELECT doc_id, doc FROM {self.name} WHERE doc_id IN ({placeholders}) ORDER BY doc_id", ids)
+        else:
+            rows = self._rows(f"SELECT doc_id, doc FROM {self.name} ORDER BY doc_id")
+        if cond is None:
+            return [row[0] for row in rows]
+        return [row[0] for row in rows if cond(json.loads(row[1]))]
+
+    def find_ids(self, **criteria):
+        """Doc IDs of documents whose fields equal every given value, in insertion order"""
+        clauses = []
+        params = []
+        for field, value in criteria.items():
+            if not _FIELD_PATTERN.match(field):
+                raise ValueError(f"Invalid field name: {field}")
+            if field in self.multi_indexes:
+                clauses.append(f"doc_id IN (SELECT doc_id FROM {self.name}__{field} WHERE value = ?)")
+            else:
+                clauses.append(f"json_extract(doc, '$.{field}') IS ?")
+            params.append(value)
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        return [row[0] for row in self._rows(f"SELECT doc_id FROM {self.name}{where} ORDER BY doc_id", params)]
+
+    def find(self, **criteria):
+        ids = self.find_ids(**criteria)
+        return self.get(doc_ids=ids) if ids else []
+
+    def find_one(self, **criteria):
+        ids = self.find_ids(**criteria)
+        return self.get(doc_id=ids[0]) if ids else None
+
+    def get(self, cond=None, doc_id=None, doc_ids=None):
+        if doc_id is not None:
+            rows = self._rows(f"SELECT doc_id, doc FROM {self.name} WHERE doc_id = ?", (int(doc_id),))
+            return self._document(rows[0]) if rows else None
+        if doc_ids is not None:
+            ids = sorted({int(i) for i in doc_ids})
+            if not ids:
+                return []
+            placeholders = ', '.join('?' * len(ids))
+            rows = self._rows(f"SELECT doc_id, doc FROM {self.name} WHERE doc_id IN ({placeholders}) ORDER BY doc_id", ids)
+            return [self._document(row) for row in rows]
+        for document in self.all():
+            if cond(document):
+                return document
+        return None
+
+    def search(self, cond):
+        return [document for document in self.all() if cond(document)]
+
+    def contains(self, cond=None, doc_id=None):
+        if doc_id is not None:
+            return bool(self._rows(f"SELECT 1 FROM {self.name} WHERE doc_id = ?", (int(doc_id),)))
+        return self.get(cond) is not None
+
+    def all(self):
+        return [self._document(row) for row in self._rows(f"SELECT doc_id, doc FROM {self.name} ORDER BY doc_id")]
+
+    def __len__(self):
+        return self._rows(f"SELECT COUNT(*) FROM {self.name}")[0][0]
+
+    def insert(self, document, doc_id=None):
+        doc = dict(document)
+        with self.store.transaction() as conn:
+            cursor = conn.execute(
+                f"INSERT INTO {self.name} (doc_id, doc) VALUES (?, ?)",
+                (doc_id, json.dumps(doc))
+            )
+            self._index_multi(conn, cursor.lastrowid, doc)
+            self._bump_version(conn)
+            return cursor.lastrowid
+
+    def update(self, fields, cond=None, doc_ids=None):
+        """Update matching documents with a dict of fields or a callable applied to each"""
+        with self.store.transaction() as conn:
+            ids = self._matching_ids(cond, doc_ids)
+            for document in (self.get(doc_ids=ids) if ids else []):
+                doc = dict(document)
+                if callable(fields):
+                    fields(doc)
+                else:
+                    doc.update(fields)
+                conn.execute(f"UPDATE {self.name} SET doc = ? WHERE doc_id = ?", (json.dumps(doc), document.doc_id))
+                self._index_multi(conn, document.doc_id, doc)
+            if ids:
+                self._bump_version(conn)
+            return ids
+
+    def remove(self, cond=None, doc_ids=None):
+        with self.store.transaction() as conn:
+            ids = self._matching_ids(cond, doc_ids)
+            if ids:
+                placeholders = ', '.join('?' * len(ids))
+                conn.execute(f"DELETE FROM {self.name} WHERE doc_id IN ({placeholders})", ids)
+                for field in self.multi_indexes:
+                    conn.execute(f"DELETE FROM {self.name}__{field} WHERE doc_id IN ({placeholders})", ids)
+                self._bump_version(conn)
+            return ids
+
+
+def migrate_json_file(json_path, table):
+    """Copy every document of a TinyDB JSON file into an empty table, keeping doc_ids"""
+    if len(table):
+        logger.warning(f"Table {table.name} already has documents, skipping migration of {json_path}")
+        return 0
+    if not os.path.exists(json_path):
+        return 0
+    with open(json_path, 'r') as f:
+        try:
+            data = json.load(f)
+        except json.JSONDecodeError:
+            logger.error(f"Cannot migrate corrupted database file: {json_path}")
+            return 0
+    documents = data.get('_default', {})
+    for doc_id, document in sorted(documents.items(), key=lambda item: int(item[0])):
+        table.insert(document, doc_id=int(doc_id))
+    logger.info(f"Migrated {len(documents)} documents from {json_path} to {table.name}")
+    return len(documents)
+
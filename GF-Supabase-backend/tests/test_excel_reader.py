@@ -0,0 +1,116 @@
+import datetime
+import os
+import sys
+
+import numpy as np
+import openpyxl
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from excel_reader import iter_sheet_rows, iter_row_blocks, serialize_rows  # noqa: E402
+
+
+def legacy_sheet_rows(file_path):
+    """The row text of the old process_excel_to_text (pd.read_excel + iterrows)"""
+    sheets = []
+    for sheet_name in openpyxl.load_workbook(file_path, data_only=True).sheetnames:
+        df = pd.read_excel(file_path, sheet_name=sheet_name)
+        if df.empty:
+            continue
+        rows = []
+        for idx, row in df.iterrows():
+            row_text = []
+            for col in df.columns:
+                value = row[col]
+                if pd.notna(value):
+                    if isinstance(value, pd.Timestamp):
+                        formatted_value = value.strftime('%Y-%m-%d %H:%M:%S')
+                    elif isinstance(value, (np.integer, np.floating)):
+                        formatted_value = f"{value:g}"
+                    else:
+                        formatted_value = str(value)
+                    row_text.append(f"{col}: {formatted_value}")
+            rows.append(" | ".join(row_text))
+        sheets.append((sheet_name, f"Columns: {', '.join(df.columns.tolist())}", rows))
+    return sheets
+
+
+def streamed_sheet_rows(file_path, block_size=2):
+    sheets = []
+    for sheet_name, columns, kinds, rows in iter_sheet_rows(file_path):
+        row_strings = []
+        for block in iter_row_blocks(rows, block_size):
+            row_strings.extend(serialize_rows(columns, kinds, block))
+        sheets.append((sheet_name, f"Columns: {', '.join(columns)}", row_strings))
+    return sheets
+
+
+def write_workbook(path, sheets):
+    workbook = openpyxl.Workbook()
+    workbook.remove(workbook.active)
+    for title, rows in sheets.items():
+        worksheet = workbook.create_sheet(title)
+        for row_number, row in enumerate(rows, start=1):
+            for column_number, value in enumerate(row, start=1):
+                if value is not None:
+                    worksheet.cell(row=row_number, column=column_number, value=value)
+    workbook.save(path)
+    return str(path)
+
+
+SHEETS = {
+    'Mixed': [
+        ['Category', 'Total Cost', 'Qty', 'Invoice', 'When', 'Flag', 'Code', 'Note'],
+        ['Solar', 1234567.89, 5, 12345678, datetime.datetime(2024, 1, 5), True, '00123', 'N/A'],
+        ['Wind', 2500000.0, None, 'INV-9', datetime.datetime(2024, 1, 6, 13, 5), False, '456', ''],
+        ['Hydro', 3.0, 7, 4.0, None, None, '#DIV/0!', '  pad '],
+    ],
+    'Floats': [['a', 'b'], [1, 2.5], [12345678, 3], [0.000012345, -7]],
+    'Ints': [['a', 'b'], [1, 2], [12345678, 3]],
+    'Strings': [
+        ['a', 'b', 'c', 'd', 'e', 'f', 'g', 'h', 'i'],
+        ['1.50', '1e3', ' 7 ', 'abc', '5', True, 'inf', 'NA', datetime.datetime(2024, 1, 1)],
+        ['2', 'x', '8', 'NULL', '6.0', 2, '-INF', 'n/a', 'str'],
+        [None, None, None, None, None, None, None, None, None],
+        ['0x10', '3', '9', '5', '', 'TRUE', 'nan', 'null', 5],
+    ],
+    'Booleans': [
+        ['a', 'b', 'c', 'd', 'e'],
+        [True, True, True, 'TRUE', False],
+        [1.5, None, '2', 'FALSE', True],
+    ],
+    'OnlyBooleans': [['a', 'b'], [True, False], ['true', 'False']],
+    'Dates': [['a'], [datetime.datetime(2024, 1, 1, 9, 30)], [None], [datetime.datetime(2023, 12, 31)]],
+    'DatesAndNumbers': [['a', 'b'], [datetime.datetime(2024, 1, 1), 1], [5, 2.25]],
+    'Times': [['a', 'b'], [datetime.time(1, 2), datetime.date(2024, 1, 1)], [None, 'x']],
+    'BlankHeader': [[], [1, 'x'], [], [2, 'y', 'extra']],
+    'Wide': [['a', 'b'], [1, 'x', None, 'far'], [2.5, None, None, None, 'farther']],
+    'Duplicates': [['a', 'a', None, 'b'], [1, 2, 3, 4]],
+    'HeaderOnly': [['a', 'b']],
+    'Empty': [],
+    'TrailingBlanks': [['a', 'b'], [None, None], [1, None], [None, None], [None, None]],
+}
+
+
+@pytest.fixture
+def workbook_path(tmp_path):
+    return write_workbook(tmp_path / 'mixed.xlsx', SHEETS)
+
+
+def test_rows_match_legacy_pandas_output(workbook_path):
+    assert streamed_sheet_rows(workbook_path) == legacy_sheet_rows(workbook_path)
+
+
+def test_rows_match_legacy_pandas_output_across_blocks(tmp_path):
+    rows = [['Item', 'Amount', 'Reference', 'Date']]
+    for index in range(1, 40):
+        rows.append([
+            f"item {index}",
+            index * 1234.5678 if index % 3 else index,
+            index if index % 7 else f"REF-{index}",
+            datetime.datetime(2024, 1, 1) + datetime.timedelta(days=index) if index % 5 else None,
+        ])
+    path = write_workbook(tmp_path / 'long.xlsx', {'Long': rows})
+    assert streamed_sheet_rows(path, block_size=5) == legacy_sheet_rows(path)
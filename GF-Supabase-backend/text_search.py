@@ -0,0 +1,106 @@
+import re
+from collections import defaultdict
+
+# Local approximation of PostgreSQL's english full-text search, used by the
+# local vector store to reproduce the ts_rank_cd part of match_documents.
+# Tokens are lower-cased words and numbers, stop words keep their position
+# (as in to_tsvector) and a plural stemmer stands in for Snowball.
+
+ENGLISH_STOP_WORDS = frozenset("""
+i me my myself we our ours ourselves you your yours yourself yourselves he him
+his himself she her hers herself it its itself they them their theirs themselves
+what which who whom this that these those am is are was were be been being have
+has had having do does did doing a an the and but if or because as until while
+of at by for with about against between into through during before after above
+below to from up down in out on off over under again further then once here
+there when where why how all any both each few more most other some such no nor
+not only own same so than too very s t can will just don should now
+""".split())
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:\.[0-9]+)?(?:e[+-]?[0-9]+)?")
+
+# Default ts_rank_cd weight for lexemes without a setweight label (D)
+DEFAULT_WEIGHT = 0.1
+
+
+def stem(word):
+    """Reduce English plurals to their singular so that e.g. "costs" matches "cost" """
+    if word[0].isdigit() or len(word) <= 3:
+        return word
+    if word.endswith('ies'):
+        return word[:-3] + 'y'
+    if word.endswith('sses'):
+        return word[:-2]
+    if word.endswith('s') and not word.endswith(('ss', 'us', 'is')):
+        return word[:-1]
+    return word
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def to_tsvector(text):
+    """Map each lexeme of a document to its (1-based) word positions"""
+    tsvector = defaultdict(list)
+    for position, token in enumerate(tokenize(text), start=1):
+        if token not in ENGLISH_STOP_WORDS:
+            tsvector[stem(token)].append(position)
+    return dict(tsvector)
+
+
+def plainto_tsquery(text):
+    """Distinct lexemes of a query; plainto_tsquery ANDs them together"""
+    lexemes = []
+    for token in tokenize(text):
+        if token not in ENGLISH_STOP_WORDS:
+            lexeme = stem(token)
+            if lexeme not in lexemes:
+                lexemes.append(lexeme)
+    return lexemes
+
+
+def ts_rank_cd(tsvector, query_lexemes):
+    """Cover density rank of a document for an AND query, as ts_rank_cd with normalization 0
+
+    Every minimal cover (span of the document containing all query lexemes)
+    contributes DEFAULT_WEIGHT / (1 + number of non-matching words inside it).
+    """
+    if not query_lexemes or any(lexeme not in tsvector for lexeme in query_lexemes):
+        return 0.0
+
+    matches = sorted(
+        (position, lexeme)
+        for lexeme in query_lexemes
+        for position in tsvector[lexeme]
+    )
+    needed = len(query_lexemes)
+    rank = 0.0
+    start = 0
+    while start < len(matches):
+        # Smallest end such that matches[start..end] covers every lexeme
+        seen = set()
+        end = None
+        for i in range(start, len(matches)):
+            seen.add(matches[i][1])
+            if len(seen) == needed:
+                end = i
+                break
+        if end is None:
+            break
+
+        # Largest begin <= end that still covers every lexeme
+        seen = set()
+        begin = end
+        for j in range(end, start - 1, -1):
+            seen.add(matches[j][1])
+            if len(seen) == needed:
+                begin = j
+                break
+
+        noise = (matches[end][0] - matches[begin][0]) - (end - begin)
+        if noise < 0:
+            noise = (end - begin) // 2
+        rank += DEFAULT_WEIGHT / (1 + noise)
+        start = begin + 1
+    return rank
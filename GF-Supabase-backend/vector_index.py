@@ -0,0 +1,158 @@
+"""Approximate nearest neighbour index settings for the documents table
+
+The same sizing rules drive the pgvector index in Supabase and the
+in-process index of LocalVectorStore, so recall and latency measured
+offline with retrieval_benchmark.py carry over.
+
+    python vector_index.py status          # row count, chosen index and parameters
+    python vector_index.py rebuild         # build a right-sized index and swap it in
+    python vector_index.py sql --rows N    # print the CREATE INDEX CONCURRENTLY script for psql
+"""
+import os
+import re
+import math
+import argparse
+from logger import CustomLogger
+
+logger = CustomLogger('vector_index')
+
+METHODS = ('auto', 'hnsw', 'ivfflat', 'none')
+INDEX_NAMES = {
+    'hnsw': 'documents_embedding_hnsw_idx',
+    'ivfflat': 'documents_embedding_ivfflat_idx',
+}
+# Index created by earlier versions with a fixed lists = 100
+LEGACY_INDEX_NAME = 'documents_embedding_idx'
+
+
+def configured_method():
+    method = os.environ.get('VECTOR_INDEX', 'auto').lower()
+    if method not in METHODS:
+        raise ValueError(f"VECTOR_INDEX must be one of {', '.join(METHODS)}")
+    return method
+
+
+def exact_scan_rows():
+    """Row count below which a table, or a project, is scanned exactly instead of through an index"""
+    return int(os.environ.get('VECTOR_INDEX_MIN_ROWS', 10000))
+
+
+def candidate_count(match_count):
+    """Rows fetched from the index before hybrid re-scoring"""
+    return max(int(os.environ.get('VECTOR_CANDIDATES', 100)), match_count * 4)
+
+
+def choose_index_params(method, row_count):
+    """Index type and build/search parameters for a table of ``row_count`` rows
+
+    "auto" picks HNSW once the table reaches VECTOR_INDEX_MIN_ROWS rows
+    (default 10000) and no index below that, where a sequential scan is
+    as fast and exact. IVFFlat uses rows / 1000 lists up to a million
+    rows and sqrt(rows) beyond, probing sqrt(lists) of them; HNSW grows
+    m and ef_construction with the table.
+    """
+    if method == 'auto':
+        method = 'hnsw' if row_count >= exact_scan_rows() else 'none'
+    if method == 'ivfflat':
+        lists = max(10, row_count // 1000 if row_count <= 1_000_000 else int(math.sqrt(row_count)))
+        return {'method': 'ivfflat', 'lists': lists, 'probes': max(1, round(math.sqrt(lists)))}
+    if method == 'hnsw':
+        if row_count < 100_000:
+            m, ef_construction = 16, 64
+        elif row_count < 1_000_000:
+            m, ef_construction = 16, 128
+        else:
+            m, ef_construction = 32, 200
+        return {'method': 'hnsw', 'm': m, 'ef_construction': ef_construction, 'ef_search': 100}
+    return {'method': 'none'}
+
+
+def create_index_sql(params, name=None, concurrently=False):
+    """CREATE INDEX statement for chosen parameters, or None for no index"""
+    if params['method'] == 'none':
+        return None
+    name = name or INDEX_NAMES[params['method']]
+    if params['method'] == 'hnsw':
+        options = f"m = {params['m']}, ef_construction = {params['ef_construction']}"
+    else:
+        options = f"lists = {params['lists']}"
+    return (f"CREATE INDEX {'CONCURRENTLY ' if concurrently else ''}IF NOT EXISTS {name} "
+            f"ON documents USING {params['method']} (embedding vector_cosine_ops) WITH ({options});")
+
+
+def rebuild_statements(params, concurrently=False):
+    """Build the new index beside the old ones, then drop them and take over the canonical name
+
+    Queries keep using the old index until the swap, so the rebuild does
+    not interrupt retrieval. With ``concurrently`` the build does not
+    block writes either, but the statements must then run outside a
+    transaction (psql), not through the exec_sql RPC.
+    """
+    concurrent = 'CONCURRENTLY ' if concurrently else ''
+    statements = []
+    if params['method'] != 'none':
+        statements.append(create_index_sql(params, name=f"{INDEX_NAMES[params['method']]}_new",
+                                           concurrently=concurrently))
+    for name in [LEGACY_INDEX_NAME] + list(INDEX_NAMES.values()):
+        statements.append(f"DROP INDEX {concurrent}IF EXISTS {name};")
+    if params['method'] != 'none':
+        name = INDEX_NAMES[params['method']]
+        statements.append(f"ALTER INDEX {name}_new RENAME TO {name};")
+    return statements
+
+
+def parse_index_def(indexdef):
+    """Parameters of an existing index from its pg_indexes.indexdef"""
+    method = re.search(r'USING (\w+)', indexdef)
+    method = method.group(1).lower() if method else 'none'
+    options = {key.lower(): int(value) for key, value in re.findall(r"(\w+)\s*=\s*'?(\d+)'?", indexdef)}
+    if method == 'ivfflat':
+        lists = options.get('lists', 100)  # pgvector's default
+        return {'method': 'ivfflat', 'lists': lists, 'probes': max(1, round(math.sqrt(lists)))}
+    if method == 'hnsw':
+        return {'method': 'hnsw', 'm': options.get('m', 16), 'ef_construction': options.get('ef_construction', 64),
+                'ef_search': 100}
+    return {'method': method}
+
+
+def search_settings(params, match_count):
+    """match_documents arguments steering the index scan for these parameters
+
+    ef_search and probes are only sent for an index of that type, so the
+    search never narrows itself on a guess about the index in place.
+    Projects with fewer than exact_scan_rows rows skip the index: it is
+    shared by the whole table and filtered by project_id after the scan,
+    which can leave a small project with fewer candidates than asked for.
+    """
+    settings = {'candidate_count': candidate_count(match_count), 'exact_scan_rows': exact_scan_rows()}
+    if params.get('method') == 'hnsw':
+        settings['ef_search'] = max(params.get('ef_search', 40), settings['candidate_count'])
+    elif params.get('method') == 'ivfflat' and params.get('probes'):
+        settings['probes'] = params['probes']
+    return settings
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage the ANN index of the documents table")
+    parser.add_argument('command', choices=['status', 'rebuild', 'sql'])
+    parser.add_argument('--method', choices=METHODS, default=None, help="default VECTOR_INDEX")
+    parser.add_argument('--rows', type=int, default=None, help="row count to size the index for (sql only)")
+    args = parser.parse_args(argv)
+    method = args.method or configured_method()
+
+    if args.command == 'sql':
+        params = choose_index_params(method, args.rows or 0)
+        print("\n".join(rebuild_statements(params, concurrently=True)))
+        return
+
+    from vector_store import SupabaseVectorStore
+    store = SupabaseVectorStore()
+    if args.command == 'rebuild':
+        store.rebuild_ann_index(method)
+    print(f"rows={store.row_count()} "
+          f"installed={store.index_params} "
+          f"recommended={choose_index_params(method, store.row_count())}")
+
+
+if __name__ == '__main__':
+    main()